@@ -22,7 +22,15 @@ modules = [
     'pixel_rendering', 
     'pixel_utils', 
     'pixel_collection',
-    'pixel_tetris'
+    'pixel_tetris',
+    'pixel_profiling',
+    'pixel_material_pool',
+    'pixel_point_instancing',
+    'pixel_library_cache',
+    'pixel_surface',
+    'pixel_snapshots',
+    'pixel_render_cache',
+    'pixel_projection'
 ]
 
 for mod in modules:
@@ -0,0 +1,168 @@
+import os
+import json
+import time
+
+# Streams per-frame character data to an append-only JSON lines log next to the output
+# file, and turns the log into the {"frames": {...}} file on request. Plain Python, no
+# bpy.
+
+LOG_SUFFIX = ".jsonl"
+# Records and bytes held in memory before they are written out. Bounds what an
+# interrupted export can lose.
+BUFFER_RECORDS = 64
+BUFFER_BYTES = 1 << 20
+
+# Open writers by output path
+_writers = {}
+
+
+class CharacterStreamWriter:
+    """
+    Collects the character data of one output file.
+
+    Every write() appends one line, {"frame": ..., "characters": [...]}, to
+    `<file_path>.jsonl`, through a buffer flushed once it holds `buffer_records`
+    records or `buffer_bytes` bytes. Writing a frame costs the same however many frames
+    came before it, and an interrupted export leaves a log that is valid up to its last
+    complete line.
+
+    finalize() merges the log into `file_path` in the {"frames": {"<frame>":
+    {"characters": [...]}}} format, keeping frames already in that file. A frame
+    written more than once keeps its last record.
+    """
+
+    def __init__(self, file_path, buffer_records=BUFFER_RECORDS, buffer_bytes=BUFFER_BYTES):
+        self.file_path = file_path
+        self.log_path = file_path + LOG_SUFFIX
+        self.buffer_records = buffer_records
+        self.buffer_bytes = buffer_bytes
+        self.buffer = []
+        self.buffered_bytes = 0
+        self.written = 0
+
+    def write(self, frame, characters):
+        """
+        Queues the records of one frame.
+
+        Args:
+        frame (int): The frame.
+        characters (list): Dicts, one per character.
+        """
+        line = json.dumps({"frame": int(frame), "characters": characters}, separators=(",", ":")) + "\n"
+        self.buffer.append(line)
+        self.buffered_bytes += len(line)
+        if len(self.buffer) >= self.buffer_records or self.buffered_bytes >= self.buffer_bytes:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        directory = os.path.dirname(self.log_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.log_path, "a") as f:
+            if self.written == 0 and not self.ends_with_newline():
+                # The log was cut off mid-line, keep that line from swallowing the next
+                f.write("\n")
+            f.write("".join(self.buffer))
+        self.written += len(self.buffer)
+        self.buffer = []
+        self.buffered_bytes = 0
+
+    def ends_with_newline(self):
+        try:
+            with open(self.log_path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                return f.read(1) == b"\n"
+        except OSError:
+            # Missing or empty
+            return True
+
+    def read_log(self):
+        """
+        The records in the log, in order. A last line cut off by an interruption is
+        skipped.
+        """
+        records = []
+        if not os.path.exists(self.log_path):
+            return records
+        with open(self.log_path, "r") as f:
+            for number, line in enumerate(f, 1):
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    print(f"Skipping unreadable line {number} of {self.log_path}")
+        return records
+
+    def load_output(self):
+        """
+        The frames already in the output file.
+        """
+        if not os.path.exists(self.file_path):
+            return {}
+        try:
+            with open(self.file_path, "r") as f:
+                return json.load(f).get("frames", {})
+        except ValueError:
+            print(f"{self.file_path} is not valid JSON, starting it over")
+            return {}
+
+    def finalize(self, indent=4, write_json=True, frames=None):
+        """
+        Merges the log into the frames exported before, writes them to the output file
+        and removes the log.
+
+        The output is written to a temporary file and moved over the old one, so it is
+        never left half written.
+
+        Args:
+        indent (int): Indentation of the JSON output.
+        write_json (bool): Write the output file. Off when only another format, such
+            as the columnar tracks, is exported.
+        frames (dict): The frames exported before, defaults to those in the output file.
+
+        Returns:
+        dict: All frames, {"<frame>": {"characters": [...]}}.
+        """
+        started = time.time()
+        self.flush()
+        frames = self.load_output() if frames is None else frames
+        for record in self.read_log():
+            frames[str(record["frame"])] = {"characters": record["characters"]}
+        if write_json:
+            temp_path = self.file_path + ".tmp"
+            with open(temp_path, "w") as f:
+                json.dump({"frames": frames}, f, indent=indent)
+            os.replace(temp_path, self.file_path)
+        if os.path.exists(self.log_path):
+            os.remove(self.log_path)
+        print(f"finalized {len(frames)} frames of {self.file_path} in {time.time() - started:.2f}s")
+        return frames
+
+
+def character_stream(file_path):
+    """
+    The writer of an output file, created on first use.
+    """
+    key = os.path.abspath(file_path)
+    writer = _writers.get(key)
+    if writer is None:
+        writer = _writers[key] = CharacterStreamWriter(file_path)
+    return writer
+
+
+def flush_character_streams():
+    for writer in _writers.values():
+        writer.flush()
+
+
+def finalize_character_stream(file_path, write_json=True, frames=None):
+    """
+    Finalizes the output file at `file_path`, including a log left by an earlier
+    session. See CharacterStreamWriter.finalize.
+
+    Returns:
+    dict: All frames of the output.
+    """
+    writer = _writers.pop(os.path.abspath(file_path), None) or CharacterStreamWriter(file_path)
+    return writer.finalize(write_json=write_json, frames=frames)
@@ -0,0 +1,170 @@
+import os
+import json
+import shutil
+import numpy as np
+
+# Columnar export of character data: one float32 array per field, frames by characters,
+# memory mapped on read. Needs numpy but not bpy, so overlay tools outside Blender can
+# import this module on its own.
+#
+# Layout of a <name>.pixtracks directory:
+#   header.json    format version, the fields, and the object and camera id per column
+#   frames.npy     int32 (frames,), sorted
+#   <field>.npy    float32 (frames, characters), NaN where a character has no sample
+
+TRACKS_SUFFIX = ".pixtracks"
+HEADER_NAME = "header.json"
+FRAMES_NAME = "frames.npy"
+FORMAT_VERSION = 1
+FIELDS = ("x", "y", "z", "distance", "project_x", "project_y", "top_x", "top_y")
+
+
+def tracks_path(file_path):
+    """
+    Where the columnar export of the JSON output `file_path` goes.
+    """
+    return os.path.splitext(file_path)[0] + TRACKS_SUFFIX
+
+
+def character_keys(characters):
+    """
+    One key per character of a frame: object and camera id, and how many times the
+    pair came before in the same frame, so repeated pairs keep separate columns.
+    """
+    seen = {}
+    keys = []
+    for character in characters:
+        pair = (character.get("object_id", ""), character.get("camera_id", ""))
+        keys.append(pair + (seen.get(pair, 0),))
+        seen[pair] = seen.get(pair, 0) + 1
+    return keys
+
+
+def write_character_tracks(directory, frames):
+    """
+    Writes character data in the columnar format.
+
+    Args:
+    directory (str): The .pixtracks directory, replaced if it exists.
+    frames (dict): {frame: {"characters": [dict, ...]}} as in the JSON export; keys may
+        be strings.
+
+    Returns:
+    CharacterTracks: The written tracks, opened for reading.
+    """
+    frame_numbers = sorted(int(frame) for frame in frames)
+    columns = {}
+    for frame in frame_numbers:
+        for key in character_keys(frames.get(str(frame), frames.get(frame, {})).get("characters", [])):
+            columns.setdefault(key, len(columns))
+
+    temp_directory = directory + ".tmp"
+    shutil.rmtree(temp_directory, ignore_errors=True)
+    os.makedirs(temp_directory)
+    rows, cols = [], []
+    values = {field: [] for field in FIELDS}
+    for row, frame in enumerate(frame_numbers):
+        characters = frames.get(str(frame), frames.get(frame, {})).get("characters", [])
+        for key, character in zip(character_keys(characters), characters):
+            rows.append(row)
+            cols.append(columns[key])
+            for field in FIELDS:
+                values[field].append(character.get(field, np.nan))
+    for field in FIELDS:
+        array = np.full((len(frame_numbers), len(columns)), np.nan, dtype=np.float32)
+        array[rows, cols] = np.array(values[field], dtype=np.float32)
+        np.save(os.path.join(temp_directory, f"{field}.npy"), array)
+    np.save(os.path.join(temp_directory, FRAMES_NAME), np.array(frame_numbers, dtype=np.int32))
+    header = {
+        "version": FORMAT_VERSION,
+        "fields": list(FIELDS),
+        "characters": [{"object_id": object_id, "camera_id": camera_id}
+                       for (object_id, camera_id, _), _ in sorted(columns.items(), key=lambda item: item[1])]
+    }
+    with open(os.path.join(temp_directory, HEADER_NAME), "w") as f:
+        json.dump(header, f, indent=4)
+
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(temp_directory, directory)
+    return CharacterTracks.open(directory)
+
+
+class CharacterTracks:
+    """
+    Reads a .pixtracks directory. The field arrays are memory mapped, so opening is
+    cheap and reading a frame touches only that frame's rows.
+
+        tracks = CharacterTracks.open("overlay.pixtracks")
+        row = tracks.frame(120)            # {"x": array of characters, ...}
+        xs = tracks["project_x"][:, 0]     # first character over all frames
+    """
+
+    def __init__(self, directory, header, frames, fields):
+        self.directory = directory
+        self.header = header
+        self.frames = frames
+        self.fields = fields
+
+    @classmethod
+    def open(cls, directory):
+        with open(os.path.join(directory, HEADER_NAME), "r") as f:
+            header = json.load(f)
+        if header.get("version") != FORMAT_VERSION:
+            raise ValueError(f"{directory} has format version {header.get('version')}, expected {FORMAT_VERSION}")
+        frames = np.load(os.path.join(directory, FRAMES_NAME), mmap_mode='r')
+        fields = {field: np.load(os.path.join(directory, f"{field}.npy"), mmap_mode='r')
+                  for field in header["fields"]}
+        return cls(directory, header, frames, fields)
+
+    @property
+    def characters(self):
+        return self.header["characters"]
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, field):
+        return self.fields[field]
+
+    def row(self, frame):
+        """
+        The row index of a frame, or None if the frame wasn't exported.
+        """
+        index = int(np.searchsorted(self.frames, frame))
+        if index < len(self.frames) and self.frames[index] == frame:
+            return index
+        return None
+
+    def frame(self, frame):
+        """
+        Every field of one frame, as views of one value per character.
+        """
+        index = self.row(frame)
+        if index is None:
+            raise KeyError(frame)
+        return {field: values[index] for field, values in self.fields.items()}
+
+    def columns(self, object_id, camera_id=None):
+        """
+        The column indices of an object's characters, optionally only for one camera.
+        """
+        return [index for index, character in enumerate(self.characters)
+                if character["object_id"] == object_id
+                and (camera_id is None or character["camera_id"] == camera_id)]
+
+    def to_frames(self):
+        """
+        The tracks in the JSON export's {frame: {"characters": [...]}} form, skipping
+        characters without a sample in a frame.
+        """
+        frames = {}
+        for index, frame in enumerate(self.frames):
+            characters = []
+            for column, ids in enumerate(self.characters):
+                if np.isnan(self.fields["x"][index, column]):
+                    continue
+                character = {field: float(values[index, column]) for field, values in self.fields.items()}
+                character.update(ids)
+                characters.append(character)
+            frames[str(int(frame))] = {"characters": characters}
+        return frames
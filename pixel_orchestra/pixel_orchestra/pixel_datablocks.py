@@ -0,0 +1,180 @@
+import bpy
+
+# Creation and removal of objects and collections straight through bpy.data.
+# Nothing in here calls bpy.ops, so it doesn't depend on the active object,
+# selection or the area the call comes from, and removals happen in one
+# batch_remove call instead of one remove call per datablock.
+
+
+def remove_datablocks(datablocks):
+    """
+    Removes datablocks of any type in a single batch.
+
+    Args:
+    datablocks (iterable): The ID datablocks to remove. None entries and duplicates are ignored.
+
+    Returns:
+    int: The number of datablocks removed.
+    """
+    unique = {}
+    for datablock in datablocks:
+        if datablock is not None:
+            unique[datablock.as_pointer()] = datablock
+    if unique:
+        bpy.data.batch_remove(list(unique.values()))
+    return len(unique)
+
+
+def orphaned_data(objects):
+    """
+    Returns the data blocks (meshes, curves, ...) of the given objects that nothing
+    else uses, so they would be left orphaned once the objects are removed.
+    """
+    references = {}
+    data_blocks = {}
+    for obj in objects:
+        data = obj.data
+        if data is None:
+            continue
+        key = data.as_pointer()
+        references[key] = references.get(key, 0) + 1
+        data_blocks[key] = data
+    return [data for key, data in data_blocks.items()
+            if not data.use_fake_user and data.users <= references[key]]
+
+
+def remove_objects(objects, remove_data=False):
+    """
+    Removes objects in a single batch.
+
+    Args:
+    objects (iterable): The objects to remove.
+    remove_data (bool): Also remove data blocks only these objects use.
+
+    Returns:
+    int: The number of datablocks removed.
+    """
+    objects = [obj for obj in objects if obj is not None]
+    datablocks = list(objects)
+    if remove_data:
+        datablocks.extend(orphaned_data(objects))
+    return remove_datablocks(datablocks)
+
+
+def collect_collection_hierarchy(collection):
+    """
+    Returns a collection with all of its nested child collections, and every object in them.
+
+    Returns:
+    tuple: (collections, objects)
+    """
+    collections = []
+    stack = [collection]
+    while stack:
+        coll = stack.pop()
+        collections.append(coll)
+        stack.extend(coll.children)
+    return collections, list(collection.all_objects)
+
+
+def remove_collection_hierarchies(collections, remove_data=False):
+    """
+    Removes collections, their child collections and all objects in them in a single batch.
+
+    Args:
+    collections (iterable): The top collections to remove.
+    remove_data (bool): Also remove data blocks only the removed objects use.
+
+    Returns:
+    int: The number of datablocks removed.
+    """
+    all_collections = []
+    all_objects = []
+    for collection in collections:
+        if collection is None:
+            continue
+        child_collections, objects = collect_collection_hierarchy(collection)
+        all_collections.extend(child_collections)
+        all_objects.extend(objects)
+    datablocks = all_collections + all_objects
+    if remove_data:
+        datablocks.extend(orphaned_data(all_objects))
+    return remove_datablocks(datablocks)
+
+
+def create_collection(name, parent=None, scene=None, link=True):
+    """
+    Creates a collection and links it under `parent`, or under the scene's master
+    collection when no parent is given.
+
+    Args:
+    name (str): The name of the new collection.
+    parent (bpy.types.Collection): The collection to link the new one to.
+    scene (bpy.types.Scene): The scene used when there is no parent, defaults to the current scene.
+    link (bool): Link the new collection at all.
+
+    Returns:
+    bpy.types.Collection: The new collection.
+    """
+    collection = bpy.data.collections.new(name)
+    if not link:
+        return collection
+    if parent is None:
+        parent = (scene or bpy.context.scene).collection
+    parent.children.link(collection)
+    return collection
+
+
+def create_object(name, data, collection, parent=None):
+    """
+    Creates an object for a data block and links it to a collection.
+
+    Args:
+    name (str): The name of the object.
+    data (bpy.types.ID): The object data, or None for an empty.
+    collection (bpy.types.Collection): The collection to link the object to.
+    parent (bpy.types.Object): An optional parent.
+
+    Returns:
+    bpy.types.Object: The new object.
+    """
+    obj = bpy.data.objects.new(name, data)
+    if parent is not None:
+        obj.parent = parent
+    collection.objects.link(obj)
+    return obj
+
+
+def create_empty(name, collection, display_type='PLAIN_AXES', parent=None):
+    """
+    Creates an empty object and links it to a collection.
+
+    Args:
+    name (str): The name of the empty.
+    collection (bpy.types.Collection): The collection to link the empty to.
+    display_type (str): The empty's display type.
+    parent (bpy.types.Object): An optional parent.
+
+    Returns:
+    bpy.types.Object: The new empty.
+    """
+    empty = create_object(name, None, collection, parent=parent)
+    empty.empty_display_type = display_type
+    return empty
+
+
+def link_objects(objects, collection):
+    """
+    Links objects to a collection, skipping those already in it.
+
+    Returns:
+    int: The number of objects linked.
+    """
+    linked = 0
+    existing = set(collection.objects.keys())
+    for obj in objects:
+        if obj.name not in existing:
+            collection.objects.link(obj)
+            existing.add(obj.name)
+            linked += 1
+    return linked
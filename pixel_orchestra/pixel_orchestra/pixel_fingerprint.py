@@ -0,0 +1,349 @@
+import bpy
+import array
+import hashlib
+from .pixel_material_pool import material_signature
+
+PIX_PREFIX = "pix_"
+PIX_PROPERTIES = "pix_properties"
+
+# Paths of the node values that can change per material, see material_value_paths
+_material_value_paths = {}
+# Paths of the keyframed and driven values per ID block, see animated_paths
+_animated_paths = {}
+
+
+def fingerprint_value(value):
+    """
+    Converts a property value into something with a stable repr.
+    """
+    if isinstance(value, float):
+        return round(value, 6)
+    if isinstance(value, (int, bool, str)) or value is None:
+        return value
+    if isinstance(value, bpy.types.ID):
+        return value.name
+    if hasattr(value, "to_dict"):
+        return fingerprint_value(value.to_dict())
+    if isinstance(value, dict):
+        return tuple(sorted((k, fingerprint_value(v)) for k, v in value.items()))
+    try:
+        return tuple(fingerprint_value(v) for v in value)
+    except TypeError:
+        return str(value)
+
+
+def hash_parts(parts):
+    return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()
+
+
+def pix_items(id_or_struct):
+    """
+    Returns the pix_ custom properties of an ID or node, sorted by name.
+    """
+    return tuple(sorted((key, fingerprint_value(id_or_struct[key]))
+                        for key in id_or_struct.keys() if key.startswith(PIX_PREFIX)))
+
+
+def data_fingerprint(data):
+    """
+    Describes an object's data block by name and size.
+
+    Realized copies share the source's data unless they need their own, so the
+    name is what decides which data a copy ends up with. Pointers would change on
+    every file load.
+    """
+    if data is None:
+        return None
+    parts = [data.name, data.rna_type.identifier, pix_items(data)]
+    if isinstance(data, bpy.types.Mesh):
+        parts.extend([len(data.vertices), len(data.polygons)])
+    return tuple(parts)
+
+
+def material_pix_fingerprint(material):
+    """
+    Describes the parts of a material realization reads: its name and the pix
+    properties of its nodes.
+    """
+    if material is None:
+        return None
+    nodes = ()
+    if material.node_tree is not None:
+        nodes = tuple(sorted((node.name, pix_items(node)) for node in material.node_tree.nodes
+                             if any(key.startswith(PIX_PREFIX) for key in node.keys())))
+    return (material.name, nodes)
+
+
+def geometry_digest(data):
+    """
+    Hashes the vertex positions of a mesh, None for other data.
+    """
+    if not isinstance(data, bpy.types.Mesh):
+        return None
+    coordinates = array.array('f', bytes(len(data.vertices) * 3 * 4))
+    data.vertices.foreach_get("co", coordinates)
+    return hashlib.sha1(coordinates.tobytes()).hexdigest()
+
+
+def collection_fingerprint(collection, deep=False):
+    """
+    Hashes everything about a source collection that realization copies: its
+    objects, their hierarchy, local transforms, data, pix properties, modifiers
+    and materials.
+
+    By name is enough within one file. A deep fingerprint also hashes mesh
+    geometry and full material signatures, so it can tell apart same-named
+    collections from different files.
+
+    Args:
+    collection (bpy.types.Collection): The source collection.
+    deep (bool): Hash geometry and material contents as well.
+
+    Returns:
+    str: A hex digest that changes whenever a realized copy would come out different.
+    """
+    objects = []
+    for obj in sorted(collection.all_objects, key=lambda o: o.name):
+        parts = [
+            obj.name,
+            obj.type,
+            obj.parent.name if obj.parent else None,
+            fingerprint_value(obj.matrix_basis),
+            data_fingerprint(obj.data),
+            pix_items(obj),
+            tuple((mod.name, mod.type, mod.show_render) for mod in obj.modifiers),
+            tuple((slot.link, material_pix_fingerprint(slot.material)) for slot in obj.material_slots)
+        ]
+        if deep:
+            parts.append(geometry_digest(obj.data))
+            parts.append(tuple(material_signature(slot.material) if slot.material else None
+                               for slot in obj.material_slots))
+        objects.append(tuple(parts))
+    return hash_parts((collection.name, tuple(objects)))
+
+
+def realization_fingerprint(scene, collection, deep=False):
+    """
+    Fingerprint of a source collection together with the scene settings that change
+    what realizing it produces.
+    """
+    return hash_parts((collection_fingerprint(collection, deep=deep), scene.make_single, scene.pix_shading_mode))
+
+
+def instance_fingerprint(instance):
+    """
+    Hashes what realization takes from a collection instance: its transform,
+    parent, source collection and track/note.
+
+    Args:
+    instance (bpy.types.Object): The collection instance.
+
+    Returns:
+    str: A hex digest of the instance.
+    """
+    return hash_parts((
+        instance.instance_collection.name if instance.instance_collection else None,
+        instance.parent.name if instance.parent else None,
+        fingerprint_value(instance.location),
+        fingerprint_value(instance.rotation_quaternion),
+        fingerprint_value(instance.rotation_euler),
+        fingerprint_value(instance.rotation_axis_angle),
+        instance.rotation_mode,
+        fingerprint_value(instance.scale),
+        fingerprint_value(instance.get("track")),
+        fingerprint_value(instance.get("note"))
+    ))
+
+
+def node_tree_layout_key(node_tree):
+    """
+    Changes whenever nodes, drivers or keyframed curves are added to or removed from a
+    node tree, which is when its value paths need collecting again.
+    """
+    animation_data = node_tree.animation_data
+    drivers = len(animation_data.drivers) if animation_data else 0
+    fcurves = len(animation_data.action.fcurves) if animation_data and animation_data.action else 0
+    return (len(node_tree.nodes), drivers, fcurves)
+
+
+def material_value_paths(material):
+    """
+    The data paths, relative to the node tree, of the values that can make a material
+    look different from one frame to the next: everything a driver or F-curve writes
+    to, and the socket default values of customized (pix_properties) nodes.
+
+    Collected once per material and kept until its node tree layout changes.
+
+    Returns:
+    tuple: Sorted data paths.
+    """
+    node_tree = material.node_tree
+    if node_tree is None:
+        return ()
+    key = material.as_pointer()
+    layout = node_tree_layout_key(node_tree)
+    cached = _material_value_paths.get(key)
+    if cached is not None and cached[0] == material.name and cached[1] == layout:
+        return cached[2]
+
+    paths = set()
+    animation_data = node_tree.animation_data
+    if animation_data is not None:
+        paths.update(fcurve.data_path for fcurve in animation_data.drivers)
+        if animation_data.action is not None:
+            paths.update(fcurve.data_path for fcurve in animation_data.action.fcurves)
+    for node in node_tree.nodes:
+        if PIX_PROPERTIES not in node.keys():
+            continue
+        node_path = f'nodes["{bpy.utils.escape_identifier(node.name)}"]'
+        for kind, sockets in (("inputs", node.inputs), ("outputs", node.outputs)):
+            for index, socket in enumerate(sockets):
+                if hasattr(socket, "default_value"):
+                    paths.add(f"{node_path}.{kind}[{index}].default_value")
+    paths = tuple(sorted(paths))
+    _material_value_paths[key] = (material.name, layout, paths)
+    return paths
+
+
+def material_fingerprint(material, depsgraph=None):
+    """
+    Hashes the current values of a material's driven, keyframed and customized node
+    sockets into one 64-bit integer. Costs one lookup per such value, the paths
+    themselves come from material_value_paths.
+
+    Args:
+    material (bpy.types.Material): The material.
+    depsgraph (bpy.types.Depsgraph): Read the evaluated material, which is where
+        driver results end up. Without it the original material is read.
+
+    Returns:
+    int: The fingerprint, 0 for materials without node values that can change.
+    """
+    paths = material_value_paths(material)
+    if not paths:
+        return 0
+    source = material.evaluated_get(depsgraph) if depsgraph is not None else material
+    return values_fingerprint(source.node_tree, paths)
+
+
+def values_fingerprint(owner, paths):
+    """
+    Hashes the values at `paths` of `owner` into one 64-bit integer. The same values
+    give the same integer in every process, so it can go into keys kept on disk.
+    """
+    digest = hashlib.blake2b(digest_size=8)
+    values = array.array('d')
+    for path in paths:
+        try:
+            value = owner.path_resolve(path)
+        except ValueError:
+            values.append(float('nan'))
+            continue
+        if isinstance(value, (int, float)):
+            values.append(value)
+            continue
+        try:
+            values.extend(value)
+        except TypeError:
+            # Enums, strings and pointers; Python's own hash() is salted per process
+            digest.update(values.tobytes())
+            digest.update(str(value).encode("utf-8") + b"\0")
+            values = array.array('d')
+    digest.update(values.tobytes())
+    return int.from_bytes(digest.digest(), "little")
+
+
+def animation_actions(animation_data):
+    actions = [animation_data.action]
+    actions.extend(strip.action for track in animation_data.nla_tracks for strip in track.strips)
+    return [action for action in actions if action is not None]
+
+
+def animated_paths(id_block):
+    """
+    The data paths of everything an F-curve, NLA strip or driver writes to on an ID
+    block: keyed custom properties, data values such as light energy or modifier
+    settings, mesh attributes, shape key values.
+
+    Collected once per ID block and kept until its drivers or actions change.
+
+    Returns:
+    tuple: Sorted data paths.
+    """
+    animation_data = getattr(id_block, "animation_data", None) if id_block is not None else None
+    if animation_data is None:
+        return ()
+    actions = animation_actions(animation_data)
+    layout = (len(animation_data.drivers), tuple((action.name, len(action.fcurves)) for action in actions))
+    key = id_block.as_pointer()
+    cached = _animated_paths.get(key)
+    if cached is not None and cached[0] == id_block.name and cached[1] == layout:
+        return cached[2]
+    paths = {fcurve.data_path for fcurve in animation_data.drivers}
+    for action in actions:
+        paths.update(fcurve.data_path for fcurve in action.fcurves)
+    paths = tuple(sorted(paths))
+    _animated_paths[key] = (id_block.name, layout, paths)
+    return paths
+
+
+def id_fingerprint(id_block, depsgraph=None):
+    """
+    Hashes the current values of everything keyed or driven on an ID block, see
+    animated_paths. 0 for ID blocks without animation.
+
+    Args:
+    id_block (bpy.types.ID): The ID block.
+    depsgraph (bpy.types.Depsgraph): Read the evaluated ID block, where driver results
+        end up. Without it the original is read.
+    """
+    paths = animated_paths(id_block)
+    if not paths:
+        return 0
+    source = id_block.evaluated_get(depsgraph) if depsgraph is not None else id_block
+    return values_fingerprint(source, paths)
+
+
+def node_tree_fingerprint(owner, depsgraph=None):
+    """
+    id_fingerprint for the node tree of a world, light or material, which is read
+    through its evaluated owner since the node tree isn't an ID of its own in the
+    depsgraph.
+    """
+    node_tree = getattr(owner, "node_tree", None)
+    paths = animated_paths(node_tree)
+    if not paths:
+        return 0
+    source = owner.evaluated_get(depsgraph) if depsgraph is not None else owner
+    return values_fingerprint(source.node_tree, paths)
+
+
+def object_animation_ids(obj):
+    """
+    The ID blocks whose animation changes how an object looks without moving it: the
+    object itself for keyed custom properties and modifier settings, its data and its
+    shape keys.
+    """
+    ids = [obj]
+    if obj.data is not None:
+        ids.append(obj.data)
+        shape_keys = getattr(obj.data, "shape_keys", None)
+        if shape_keys is not None:
+            ids.append(shape_keys)
+    return ids
+
+
+def has_animated_channels(obj):
+    return any(animated_paths(id_block) for id_block in object_animation_ids(obj))
+
+
+def object_fingerprint(obj, depsgraph=None):
+    """
+    Hashes the keyed and driven values of an object, its data and its shape keys into
+    one 64-bit integer. Transforms are included, but they are better read in bulk
+    from matrix_world.
+    """
+    fingerprints = array.array('Q', [id_fingerprint(id_block, depsgraph) for id_block in object_animation_ids(obj)])
+    if not any(fingerprints):
+        return 0
+    return int.from_bytes(hashlib.blake2b(fingerprints.tobytes(), digest_size=8).digest(), "little")
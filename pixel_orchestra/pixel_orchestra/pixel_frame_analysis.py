@@ -0,0 +1,332 @@
+import bpy
+import numpy as np
+
+# Works out which frames differ from the frame before by reading F-curves and drivers,
+# without setting frames. A frame f "changes" when some animated value differs
+# between f - 1 and f. Results are boolean masks over frame_start..frame_end.
+
+TRANSFORM_PATHS = {"location", "rotation_euler", "rotation_quaternion", "rotation_axis_angle", "scale",
+                   "delta_location", "delta_rotation_euler", "delta_rotation_quaternion", "delta_scale"}
+# How deep to follow drivers reading driven properties before giving up
+MAX_DRIVER_DEPTH = 8
+
+
+class FrameRange:
+    def __init__(self, frame_start, frame_end):
+        self.start = frame_start
+        self.end = frame_end
+
+    def mask(self):
+        return np.zeros(self.end - self.start + 1, dtype=bool)
+
+    def mark(self, mask, first, last):
+        """
+        Marks the frames first..last (inclusive), clipped to the range.
+        """
+        first = max(int(first), self.start)
+        last = min(int(last), self.end)
+        if first <= last:
+            mask[first - self.start:last - self.start + 1] = True
+
+
+def segment_is_constant(k0, k1):
+    """
+    Whether the value stays the same from keyframe k0 up to (not including) k1.
+    """
+    if k0.interpolation == 'CONSTANT':
+        return True
+    if k0.co[1] != k1.co[1]:
+        return False
+    if k0.interpolation == 'BEZIER':
+        return k0.handle_right[1] == k0.co[1] and k1.handle_left[1] == k1.co[1]
+    # Linear and the easing modes only move when the two keys differ
+    return True
+
+
+def fcurve_can_be_read(fcurve):
+    """
+    Whether an F-curve's changes follow from its keyframes alone. Curves with active
+    modifiers or baked samples are evaluated frame by frame instead.
+    """
+    if any(not modifier.mute for modifier in fcurve.modifiers):
+        return False
+    return len(fcurve.sampled_points) == 0
+
+
+def fcurve_changes(fcurve, frames):
+    """
+    Frames where an F-curve's value differs from the frame before.
+
+    Args:
+    fcurve (bpy.types.FCurve): A keyframed F-curve.
+    frames (FrameRange): The frames to look at.
+
+    Returns:
+    numpy.ndarray: A boolean mask over the frame range.
+    """
+    mask = frames.mask()
+    if fcurve.mute:
+        return mask
+    if not fcurve_can_be_read(fcurve):
+        # evaluate() applies modifiers and needs no frame change
+        values = np.array([fcurve.evaluate(frame) for frame in range(frames.start - 1, frames.end + 1)])
+        mask[:] = values[1:] != values[:-1]
+        return mask
+
+    points = fcurve.keyframe_points
+    if len(points) == 0:
+        return mask
+    for k0, k1 in zip(points[:-1], points[1:]):
+        x0 = k0.co[0]
+        x1 = k1.co[0]
+        if k0.interpolation == 'CONSTANT':
+            # Holds k0 until it jumps to k1
+            if k0.co[1] != k1.co[1]:
+                frames.mark(mask, np.ceil(x1), np.ceil(x1))
+        elif not segment_is_constant(k0, k1):
+            frames.mark(mask, np.floor(x0) + 1, np.ceil(x1))
+
+    if fcurve.extrapolation == 'LINEAR':
+        first = points[0]
+        last = points[-1]
+        if len(points) > 1 or first.interpolation == 'BEZIER':
+            if first.interpolation == 'BEZIER':
+                slope_before = first.handle_left[1] != first.co[1]
+                slope_after = last.handle_right[1] != last.co[1]
+            else:
+                slope_before = first.interpolation != 'CONSTANT' and points[1].co[1] != first.co[1]
+                slope_after = points[-2].interpolation != 'CONSTANT' and points[-2].co[1] != last.co[1]
+            if slope_before:
+                frames.mark(mask, frames.start, np.ceil(first.co[0]))
+            if slope_after:
+                frames.mark(mask, np.floor(last.co[0]) + 1, frames.end)
+    return mask
+
+
+def path_matches(fcurve_path, data_path):
+    """
+    Whether an F-curve animates `data_path`, a part of it or the struct containing it.
+    """
+    if fcurve_path == data_path:
+        return True
+    return any(fcurve_path.startswith(data_path + sep) or data_path.startswith(fcurve_path + sep)
+               for sep in (".", "["))
+
+
+class ChangeDetector:
+    """
+    Unions the changed frames of every animated channel in a scene.
+
+    Channels it can't reason about, such as drivers with Python expressions, drivers
+    reading the frame, or IDs animated through the NLA, are collected in `fallback` as
+    (owner ID, data path) and sampled by setting frames.
+    """
+
+    def __init__(self, scene):
+        self.scene = scene
+        self.frames = FrameRange(scene.frame_start, scene.frame_end)
+        self.fallback = []
+        self._property_cache = {}
+        self._fcurve_cache = {}
+
+    def fcurve_mask(self, fcurve):
+        key = fcurve.as_pointer()
+        if key not in self._fcurve_cache:
+            self._fcurve_cache[key] = fcurve_changes(fcurve, self.frames)
+        return self._fcurve_cache[key]
+
+    def animated_ids(self):
+        """
+        The IDs that can change what the scene renders, with the ID (and path prefix)
+        their properties are resolved through. Node trees of materials are embedded,
+        so they resolve through their material.
+        """
+        seen = set()
+        owners = []
+
+        def add(id_block, owner=None, prefix=""):
+            if id_block is None or id_block.as_pointer() in seen:
+                return
+            seen.add(id_block.as_pointer())
+            owners.append((id_block, owner or id_block, prefix))
+
+        add(self.scene)
+        add(self.scene.world)
+        if self.scene.world is not None and self.scene.world.node_tree is not None:
+            add(self.scene.world.node_tree, self.scene.world, "node_tree.")
+        for obj in self.scene.objects:
+            add(obj)
+            data = obj.data
+            if data is not None:
+                add(data)
+                shape_keys = getattr(data, "shape_keys", None)
+                if shape_keys is not None:
+                    add(shape_keys)
+            for slot in obj.material_slots:
+                material = slot.material
+                if material is not None:
+                    add(material)
+                    if material.node_tree is not None:
+                        add(material.node_tree, material, "node_tree.")
+        return owners
+
+    def property_changes(self, id_block, data_path, depth=0):
+        """
+        Frames where a property of an ID changes, from its keyframes or its driver.
+
+        Returns:
+        numpy.ndarray: A mask, or None if it can't be worked out.
+        """
+        key = (id_block.as_pointer(), data_path)
+        if key in self._property_cache:
+            return self._property_cache[key]
+        mask = self.frames.mask()
+        animation_data = getattr(id_block, "animation_data", None)
+        if animation_data is not None:
+            if len(animation_data.nla_tracks) > 0:
+                mask = None
+            else:
+                if animation_data.action is not None:
+                    for fcurve in animation_data.action.fcurves:
+                        if path_matches(fcurve.data_path, data_path):
+                            mask |= self.fcurve_mask(fcurve)
+                for fcurve in animation_data.drivers:
+                    if path_matches(fcurve.data_path, data_path):
+                        driver_mask = self.driver_changes(fcurve.driver, depth + 1)
+                        if driver_mask is None:
+                            mask = None
+                            break
+                        mask |= driver_mask
+        self._property_cache[key] = mask
+        return mask
+
+    def transform_changes(self, obj, depth):
+        """
+        Frames where an object's world transform changes: its own transform channels,
+        its parent's, and their drivers.
+        """
+        mask = self.frames.mask()
+        while obj is not None:
+            for path in TRANSFORM_PATHS:
+                path_mask = self.property_changes(obj, path, depth)
+                if path_mask is None:
+                    return None
+                mask |= path_mask
+            if obj.constraints:
+                return None
+            obj = obj.parent
+        return mask
+
+    def driver_changes(self, driver, depth=0):
+        """
+        Frames where a driver's output can change, which is when any of its inputs do.
+
+        Returns:
+        numpy.ndarray: A mask, or None for drivers that depend on more than their
+        variables: Python expressions, the frame, or self.
+        """
+        if depth > MAX_DRIVER_DEPTH:
+            return None
+        if driver.use_self:
+            return None
+        if driver.type == 'SCRIPTED' and (not driver.is_simple_expression or "frame" in driver.expression):
+            return None
+        mask = self.frames.mask()
+        for var in driver.variables:
+            if var.type == 'SINGLE_PROP':
+                target = var.targets[0]
+                if target.id is None:
+                    continue
+                target_mask = self.property_changes(target.id, target.data_path, depth)
+            elif var.type in {'TRANSFORMS', 'LOC_DIFF', 'ROTATION_DIFF'}:
+                target_mask = self.frames.mask()
+                for target in var.targets:
+                    if isinstance(target.id, bpy.types.Object):
+                        object_mask = self.transform_changes(target.id, depth)
+                        if object_mask is None:
+                            return None
+                        target_mask |= object_mask
+            else:
+                return None
+            if target_mask is None:
+                return None
+            mask |= target_mask
+        return mask
+
+    def changed_frames(self):
+        """
+        The frame mask of the whole scene. Fallback channels are not included yet.
+        """
+        mask = self.frames.mask()
+        for id_block, owner, prefix in self.animated_ids():
+            animation_data = getattr(id_block, "animation_data", None)
+            if animation_data is None:
+                continue
+            if len(animation_data.nla_tracks) > 0:
+                paths = set()
+                for track in animation_data.nla_tracks:
+                    for strip in track.strips:
+                        if strip.action is not None:
+                            paths.update(fcurve.data_path for fcurve in strip.action.fcurves)
+                if animation_data.action is not None:
+                    paths.update(fcurve.data_path for fcurve in animation_data.action.fcurves)
+                self.fallback.extend((owner, prefix + path) for path in sorted(paths))
+            elif animation_data.action is not None:
+                for fcurve in animation_data.action.fcurves:
+                    mask |= self.fcurve_mask(fcurve)
+            for fcurve in animation_data.drivers:
+                if fcurve.mute:
+                    continue
+                driver_mask = self.driver_changes(fcurve.driver)
+                if driver_mask is None:
+                    self.fallback.append((owner, prefix + fcurve.data_path))
+                else:
+                    mask |= driver_mask
+        return mask
+
+    def sample_fallback(self, mask, context=None):
+        """
+        Sets every frame once and marks the frames where a fallback channel changed.
+        """
+        if not self.fallback:
+            return mask
+        context = context or bpy.context
+        scene = self.scene
+        original_frame = scene.frame_current
+        previous = None
+        for frame in range(self.frames.start - 1, self.frames.end + 1):
+            scene.frame_set(frame)
+            depsgraph = context.evaluated_depsgraph_get()
+            values = []
+            for owner, path in self.fallback:
+                try:
+                    value = owner.evaluated_get(depsgraph).path_resolve(path)
+                except ValueError:
+                    value = None
+                values.append(value if isinstance(value, (int, float, str)) or value is None else tuple(value))
+            if previous is not None and values != previous:
+                mask[frame - self.frames.start] = True
+            previous = values
+        scene.frame_set(original_frame)
+        return mask
+
+
+def analytic_changed_frames(scene, context=None):
+    """
+    Lists the frames that differ from the frame before, plus frame_start, from the
+    scene's F-curves and drivers. Only channels that can't be read are sampled.
+
+    Args:
+    scene (bpy.types.Scene): The scene to analyse.
+    context (bpy.types.Context): Used for the depsgraph when sampling.
+
+    Returns:
+    list: The frame numbers, sorted.
+    """
+    detector = ChangeDetector(scene)
+    mask = detector.changed_frames()
+    if detector.fallback:
+        print(f"sampling {len(detector.fallback)} channels that can't be read from F-curves")
+        mask = detector.sample_fallback(mask, context)
+    mask[0] = True
+    return [int(frame) for frame in np.flatnonzero(mask) + scene.frame_start]
@@ -0,0 +1,192 @@
+import os
+import json
+import shutil
+from bisect import bisect_right
+
+# Plain Python, no bpy, so render workers outside Blender's UI can read plans too.
+
+PIX_FRAME_PLAN = "pix_frame_plan"
+MANIFEST_NAME = "pix_frame_manifest.json"
+
+
+class FramePlan:
+    """
+    Which frames of a range have to be rendered, and which can reuse the image of an
+    earlier frame because nothing changed in between, or because they look exactly
+    like an earlier frame.
+
+    Attributes:
+    frame_start (int): The first frame of the range.
+    frame_end (int): The last frame of the range.
+    render_frames (list): The frames to render, sorted. Always includes frame_start.
+    aliases (dict): Frames that changed from the frame before but are identical to an
+        earlier rendered frame, mapped to that frame. They aren't rendered.
+    source (str): How the plan was made, for reports.
+    """
+
+    def __init__(self, frame_start, frame_end, render_frames, source="", aliases=None):
+        self.frame_start = frame_start
+        self.frame_end = frame_end
+        self.aliases = {int(frame): int(image) for frame, image in (aliases or {}).items()
+                        if frame_start <= int(frame) <= frame_end and int(frame) != frame_start}
+        frames = {frame for frame in render_frames
+                  if frame_start <= frame <= frame_end and frame not in self.aliases}
+        frames.add(frame_start)
+        self.render_frames = sorted(frames)
+        self.source = source
+
+    @classmethod
+    def from_mask(cls, frame_start, mask, source="", aliases=None):
+        """
+        Builds a plan from a sequence of booleans, one per frame from frame_start,
+        true where the frame differs from the one before.
+        """
+        frames = [frame_start + index for index, changed in enumerate(mask) if changed]
+        return cls(frame_start, frame_start + len(mask) - 1, frames, source, aliases)
+
+    @property
+    def frame_count(self):
+        return self.frame_end - self.frame_start + 1
+
+    @property
+    def change_frames(self):
+        """
+        Every frame that differs from the one before: rendered frames and aliases.
+        """
+        return sorted(self.render_frames + list(self.aliases))
+
+    def source_frame(self, frame):
+        """
+        Returns the rendered frame whose image `frame` shows.
+        """
+        changes = self.change_frames
+        change = changes[bisect_right(changes, frame) - 1]
+        return self.aliases.get(change, change)
+
+    @property
+    def holds(self):
+        """
+        Runs of frames that repeat a rendered frame.
+
+        Returns:
+        list: (rendered frame, first held frame, last held frame) tuples.
+        """
+        holds = []
+        changes = self.change_frames
+        ends = changes[1:] + [self.frame_end + 1]
+        for frame, next_frame in zip(changes, ends):
+            if frame in self.aliases:
+                holds.append((self.aliases[frame], frame, next_frame - 1))
+            elif next_frame - frame > 1:
+                holds.append((frame, frame + 1, next_frame - 1))
+        return holds
+
+    def to_dict(self):
+        return {
+            "frame_start": self.frame_start,
+            "frame_end": self.frame_end,
+            "render_frames": self.render_frames,
+            "aliases": {str(frame): image for frame, image in self.aliases.items()},
+            "source": self.source
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["frame_start"], data["frame_end"], data["render_frames"], data.get("source", ""),
+                   data.get("aliases"))
+
+    def __repr__(self):
+        return (f"FramePlan({self.frame_start}-{self.frame_end}, {len(self.render_frames)} rendered, "
+                f"{len(self.holds)} holds, {self.source})")
+
+
+def store_frame_plan(scene, plan):
+    # Kept as a JSON string, an ID property list of thousands of ints is slow to edit
+    scene[PIX_FRAME_PLAN] = json.dumps(plan.to_dict())
+
+
+def load_frame_plan(scene):
+    """
+    Returns the plan stored on a scene, or None if there is none.
+    """
+    if PIX_FRAME_PLAN not in scene:
+        return None
+    return FramePlan.from_dict(json.loads(scene[PIX_FRAME_PLAN]))
+
+
+def link_or_copy(source, destination):
+    """
+    Hard links `destination` to `source`, copying where the filesystem has no hard
+    links. An existing destination is replaced.
+
+    Returns:
+    bool: True if a link was made, False if the file was copied.
+    """
+    if os.path.abspath(source) == os.path.abspath(destination):
+        return True
+    if os.path.lexists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+        return True
+    except OSError:
+        shutil.copy2(source, destination)
+        return False
+
+
+def fill_holds(plan, frame_path):
+    """
+    Puts an image at every held frame of a plan, linked to the rendered frame it repeats.
+
+    Args:
+    plan (FramePlan): The plan that was rendered.
+    frame_path (callable): Returns the output file path of a frame, such as
+        scene.render.frame_path.
+
+    Returns:
+    tuple: (linked, copied, missing) frame counts. Missing frames are those whose
+    rendered frame has no file.
+    """
+    linked = copied = missing = 0
+    for image_frame, first, last in plan.holds:
+        source = frame_path(image_frame)
+        if not os.path.exists(source):
+            print(f"Rendered frame {image_frame} not found at {source}")
+            missing += last - first + 1
+            continue
+        for frame in range(first, last + 1):
+            if link_or_copy(source, frame_path(frame)):
+                linked += 1
+            else:
+                copied += 1
+    return linked, copied, missing
+
+
+def write_manifest(plan, frame_path, path=None):
+    """
+    Writes a JSON manifest mapping every output frame to the render it shows.
+
+    Args:
+    plan (FramePlan): The plan that was rendered.
+    frame_path (callable): Returns the output file path of a frame.
+    path (str): Where to write, defaults to pix_frame_manifest.json next to the first frame.
+
+    Returns:
+    str: The path written.
+    """
+    if path is None:
+        path = os.path.join(os.path.dirname(frame_path(plan.frame_start)), MANIFEST_NAME)
+    rendered = set(plan.render_frames)
+    frames = {}
+    for frame in range(plan.frame_start, plan.frame_end + 1):
+        source = plan.source_frame(frame)
+        frames[str(frame)] = {
+            "file": os.path.basename(frame_path(frame)),
+            "source_frame": source,
+            "source_file": os.path.basename(frame_path(source)),
+            "rendered": frame in rendered
+        }
+    manifest = {"plan": plan.to_dict(), "frames": frames}
+    with open(path, "w") as f:
+        json.dump(manifest, f, indent=4)
+    return path
@@ -0,0 +1,470 @@
+import bpy
+import os
+import json
+import time
+import hashlib
+import tempfile
+from . import pixel_datablocks
+from .pixel_fingerprint import hash_parts, realization_fingerprint
+
+MANIFEST_NAME = "manifest.json"
+TEMP_SUFFIX = ".tmp.blend"
+# Temporary files younger than this may be a write in progress from another session
+TEMP_GRACE_SECONDS = 3600
+# Bump when the layout of cached libraries changes, so old entries stop matching
+CACHE_VERSION = 2
+
+# bpy.data collections by ID type, for finding the local counterpart of shared data
+ID_COLLECTIONS = {
+    'MESH': 'meshes',
+    'CURVE': 'curves',
+    'MATERIAL': 'materials',
+    'ARMATURE': 'armatures',
+    'LATTICE': 'lattices',
+    'LIGHT': 'lights',
+    'CAMERA': 'cameras',
+    'META': 'metaballs',
+    'VOLUME': 'volumes',
+}
+
+
+def library_cache_key(scene, collection):
+    """
+    Content hash of what realizing `collection` produces with the scene's settings.
+
+    The deep fingerprint is used so that same-named collections in different files
+    only share an entry when their geometry and materials match too.
+    """
+    return hash_parts((CACHE_VERSION, tuple(bpy.app.version[:2]),
+                       realization_fingerprint(scene, collection, deep=True)))
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_directory(scene):
+    """
+    Returns the absolute cache directory of a scene. A relative path in an unsaved
+    file has nothing to be relative to, so the temp directory is used instead.
+    """
+    directory = scene.pix_library_cache_dir
+    if directory.startswith("//") and not bpy.data.filepath:
+        return os.path.join(tempfile.gettempdir(), "pix_library_cache")
+    return os.path.normpath(bpy.path.abspath(directory))
+
+
+def local_counterpart(id_block, shared):
+    """
+    Returns the local datablock an appended copy of shared data stands for, if the
+    current file has it.
+
+    Args:
+    id_block (bpy.types.ID): An appended datablock.
+    shared (dict): The manifest entry's {ID type: [names]} of shared datablocks.
+    """
+    reference = id_block.library_weak_reference
+    collection_name = ID_COLLECTIONS.get(id_block.id_type)
+    if reference is None or collection_name is None:
+        return None
+    # The weak reference keeps the name the datablock had in the library, with the two
+    # letter ID code in front, even when appending had to rename it
+    name = reference.id_name[2:]
+    if name not in shared.get(id_block.id_type, ()):
+        return None
+    local = getattr(bpy.data, collection_name).get(name)
+    if local is None or local == id_block or local.library is not None:
+        return None
+    return local
+
+
+def remap_references(id_block, mapping):
+    """
+    Points the parent, driver targets and modifier and constraint objects of a copied
+    datablock at the copies in `mapping`, {original pointer: copy}, instead of at the
+    originals.
+    """
+    def remap(value):
+        return mapping.get(value.as_pointer(), value) if value is not None else None
+
+    animation_data = getattr(id_block, "animation_data", None)
+    node_tree = getattr(id_block, "node_tree", None)
+    for data in (animation_data, node_tree.animation_data if node_tree is not None else None):
+        if data is None:
+            continue
+        for fcurve in data.drivers:
+            for variable in fcurve.driver.variables:
+                for target in variable.targets:
+                    if target.id is not None and target.id.as_pointer() in mapping:
+                        target.id = remap(target.id)
+    if isinstance(id_block, bpy.types.Object):
+        if id_block.parent is not None:
+            id_block.parent = remap(id_block.parent) if id_block.parent.as_pointer() in mapping else None
+        for struct in list(id_block.modifiers) + list(id_block.constraints):
+            for prop in struct.bl_rna.properties:
+                if prop.type == 'POINTER' and getattr(prop, "fixed_type", None) == bpy.types.Object.bl_rna:
+                    value = getattr(struct, prop.identifier)
+                    if value is not None and value.as_pointer() in mapping and not prop.is_readonly:
+                        setattr(struct, prop.identifier, remap(value))
+
+
+def copy_collection(template, parent_collection, shared, link=True):
+    """
+    Copies a realized collection in memory: its objects, with the data and materials
+    they own, and its child collections. Datablocks in `shared` stay shared, as they
+    are for an appended copy.
+
+    Args:
+    template (bpy.types.Collection): A collection appended or stored this session.
+    parent_collection (bpy.types.Collection): The collection to link the copy under.
+    shared (set): Pointers of the datablocks the copy keeps using.
+    link (bool): Link the copy at all, off for the private templates of LibraryCache.
+
+    Returns:
+    bpy.types.Collection: The copy.
+    """
+    mapping = {}
+    copies = []
+
+    def copy_id(id_block):
+        if id_block is None or id_block.as_pointer() in shared:
+            return id_block
+        copy = mapping.get(id_block.as_pointer())
+        if copy is None:
+            copy = mapping[id_block.as_pointer()] = id_block.copy()
+            copies.append(copy)
+        return copy
+
+    def copy_hierarchy(collection, parent, link=True):
+        new_collection = pixel_datablocks.create_collection(collection.name, parent=parent, link=link)
+        for obj in collection.objects:
+            new_obj = copy_id(obj)
+            new_obj.data = copy_id(obj.data)
+            for slot, new_slot in zip(obj.material_slots, new_obj.material_slots):
+                if slot.link == 'OBJECT' and slot.material is not None:
+                    new_slot.material = copy_id(slot.material)
+            new_collection.objects.link(new_obj)
+        for child in collection.children:
+            copy_hierarchy(child, new_collection)
+        return new_collection
+
+    new_collection = copy_hierarchy(template, parent_collection, link)
+    for copy in copies:
+        remap_references(copy, mapping)
+    return new_collection
+
+
+class LibraryCache:
+    """
+    A directory of .blend libraries, each holding one realized collection and named
+    by the content hash of what was realized.
+
+    manifest.json records every entry's collection name, the shared datablocks it
+    maps back to local ones, size, sha256 and when it was last used. Entries are
+    evicted least recently used first once the directory grows past its size limit.
+
+    A library is read from disk once per cache object; further copies of the same
+    key are made in memory from a private, unlinked copy of the first, which the
+    caller goes on to parent and place. Call release() when done.
+    """
+
+    def __init__(self, directory, size_limit):
+        self.directory = directory
+        self.size_limit = size_limit
+        self.manifest = self.load_manifest()
+        # Unlinked copies of the collections appended or stored through this cache, by
+        # key, with the pointers of the datablocks they share, see copy_collection
+        self.templates = {}
+
+    @classmethod
+    def from_scene(cls, scene):
+        return cls(cache_directory(scene), scene.pix_library_cache_limit * 1024 * 1024)
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.directory, MANIFEST_NAME)
+
+    def path_for(self, key):
+        return os.path.join(self.directory, f"{key}.blend")
+
+    def load_manifest(self):
+        try:
+            with open(self.manifest_path, "r") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return manifest if isinstance(manifest, dict) else {}
+
+    def save_manifest(self):
+        os.makedirs(self.directory, exist_ok=True)
+        temp_path = self.manifest_path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.manifest, f, indent=4)
+        os.replace(temp_path, self.manifest_path)
+
+    def store(self, key, collection, shared=()):
+        """
+        Writes a realized collection to the cache.
+
+        Args:
+        key (str): The content hash of the realization.
+        collection (bpy.types.Collection): The realized collection.
+        shared (iterable): Datablocks the collection uses but doesn't own, such as
+            meshes shared with the source. They are listed in the manifest so appending
+            maps them back to the local datablocks instead of keeping copies.
+
+        Returns:
+        str: The path of the library written.
+        """
+        shared = list(shared)
+        shared_names = {}
+        for id_block in shared:
+            shared_names.setdefault(id_block.id_type, []).append(id_block.name)
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path_for(key)
+        # Write next to the final path and move it in place, a half-written file is never visible.
+        # No fake users, appended copies are kept alive by the collection they're linked to.
+        temp_path = path[:-len(".blend")] + TEMP_SUFFIX
+        bpy.data.libraries.write(temp_path, {collection}, path_remap='ABSOLUTE', fake_user=False)
+        os.replace(temp_path, path)
+        self.keep_template(key, collection, {id_block.as_pointer() for id_block in shared})
+        self.manifest[key] = {
+            "file": os.path.basename(path),
+            "collection": collection.name,
+            "shared": shared_names,
+            "size": os.path.getsize(path),
+            "sha256": file_sha256(path),
+            "created": time.time(),
+            "last_used": time.time()
+        }
+        self.evict(keep=key)
+        self.save_manifest()
+        return path
+
+    def append(self, key, parent_collection):
+        """
+        Appends the cached realization for `key` under `parent_collection`.
+
+        Shared datablocks are remapped to their local counterparts and the appended
+        copies removed, so appended objects use the same meshes and materials an
+        in-session copy would. Once a key has been appended or stored, later calls
+        copy that collection in memory instead of reading the library again.
+
+        Returns:
+        bpy.types.Collection: The appended collection, or None on a cache miss.
+        """
+        entry = self.manifest.get(key)
+        if entry is None:
+            return None
+        if key in self.templates:
+            template, shared = self.templates[key]
+            entry["last_used"] = time.time()
+            return copy_collection(template, parent_collection, shared)
+        path = self.path_for(key)
+        if not os.path.exists(path):
+            print(f"Library cache file missing for {key}, dropping the entry")
+            del self.manifest[key]
+            self.save_manifest()
+            return None
+
+        with bpy.data.libraries.load(path, link=False) as (data_from, data_to):
+            if entry["collection"] in data_from.collections:
+                data_to.collections = [entry["collection"]]
+        if not data_to.collections or data_to.collections[0] is None:
+            print(f"Library cache file {path} has no collection '{entry['collection']}'")
+            return None
+        collection = data_to.collections[0]
+        parent_collection.children.link(collection)
+
+        replaced = []
+        shared = set()
+        for obj in collection.all_objects:
+            for id_block in [obj.data] + [slot.material for slot in obj.material_slots]:
+                if id_block is None:
+                    continue
+                local = local_counterpart(id_block, entry.get("shared", {}))
+                if local is not None:
+                    id_block.user_remap(local)
+                    replaced.append(id_block)
+                    shared.add(local.as_pointer())
+        pixel_datablocks.remove_datablocks(id_block for id_block in replaced if id_block.users == 0)
+
+        self.keep_template(key, collection, shared)
+        entry["last_used"] = time.time()
+        self.save_manifest()
+        return collection
+
+    def keep_template(self, key, collection, shared):
+        """
+        Keeps an unlinked copy of a freshly stored or appended collection for later
+        copies of `key`. Taken before the caller changes the collection, and out of the
+        scene, so removing the collection later doesn't take the template with it.
+        """
+        previous = self.templates.get(key)
+        if previous is not None:
+            self.release_templates([previous[0]], previous[1])
+        self.templates[key] = (copy_collection(collection, None, shared, link=False), shared)
+
+    def release_templates(self, templates, shared):
+        objects = [obj for template in templates for obj in template.all_objects]
+        # Materials copied for object-linked slots have no other user
+        materials = [slot.material for obj in objects for slot in obj.material_slots
+                     if slot.material is not None and slot.material.as_pointer() not in shared]
+        pixel_datablocks.remove_collection_hierarchies(templates, remove_data=True)
+        pixel_datablocks.remove_datablocks(material for material in materials if material.users == 0)
+
+    def release(self):
+        """
+        Removes the private templates, see keep_template.
+        """
+        for template, shared in self.templates.values():
+            self.release_templates([template], shared)
+        self.templates = {}
+
+    def total_size(self):
+        return sum(entry.get("size", 0) for entry in self.manifest.values())
+
+    def evict(self, keep=None):
+        """
+        Removes the least recently used entries until the cache fits its size limit.
+
+        Args:
+        keep (str): A key that is never evicted, usually the one just written.
+
+        Returns:
+        int: The number of entries removed.
+        """
+        removed = 0
+        entries = sorted(self.manifest.items(), key=lambda item: item[1].get("last_used", 0))
+        total = self.total_size()
+        for key, entry in entries:
+            if total <= self.size_limit:
+                break
+            if key == keep:
+                continue
+            try:
+                os.remove(self.path_for(key))
+            except OSError:
+                pass
+            total -= entry.get("size", 0)
+            del self.manifest[key]
+            removed += 1
+        return removed
+
+    def verify(self, repair=False):
+        """
+        Checks that every manifest entry has its file, that the file's sha256 matches
+        and that it holds the recorded collection. Also finds .blend files no entry
+        refers to. Temporary files of a write are only counted once they are older
+        than TEMP_GRACE_SECONDS, another session may still be writing them.
+
+        Args:
+        repair (bool): Remove broken entries and stray files.
+
+        Returns:
+        tuple: (number of good entries, list of problem descriptions)
+        """
+        problems = []
+        good = 0
+        broken = []
+        for key, entry in self.manifest.items():
+            path = self.path_for(key)
+            if not os.path.exists(path):
+                problems.append(f"{key}: file missing")
+                broken.append(key)
+                continue
+            if file_sha256(path) != entry.get("sha256"):
+                problems.append(f"{key}: checksum mismatch")
+                broken.append(key)
+                continue
+            with bpy.data.libraries.load(path, link=False) as (data_from, data_to):
+                collections = list(data_from.collections)
+            if entry.get("collection") not in collections:
+                problems.append(f"{key}: collection '{entry.get('collection')}' not in file")
+                broken.append(key)
+                continue
+            good += 1
+
+        known = {entry.get("file") for entry in self.manifest.values()}
+        strays = []
+        if os.path.isdir(self.directory):
+            now = time.time()
+            for name in os.listdir(self.directory):
+                if not name.endswith(".blend") or name in known:
+                    continue
+                if name.endswith(TEMP_SUFFIX):
+                    try:
+                        if now - os.path.getmtime(os.path.join(self.directory, name)) < TEMP_GRACE_SECONDS:
+                            continue
+                    except OSError:
+                        continue
+                strays.append(name)
+        problems.extend(f"{name}: not in manifest" for name in strays)
+
+        if repair:
+            for key in broken:
+                try:
+                    os.remove(self.path_for(key))
+                except OSError:
+                    pass
+                del self.manifest[key]
+            for name in strays:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+            self.save_manifest()
+        return good, problems
+
+
+class VerifyLibraryCacheOperator(bpy.types.Operator):
+    """Check the library cache files against their manifest"""
+    bl_idname = "scene.pix_verify_library_cache"
+    bl_label = "Verify Library Cache"
+
+    repair: bpy.props.BoolProperty(
+        name="Repair",
+        description="Remove broken entries and files the manifest doesn't know",
+        default=False
+    )
+
+    def execute(self, context):
+        cache = LibraryCache.from_scene(context.scene)
+        good, problems = cache.verify(repair=self.repair)
+        for problem in problems:
+            print(problem)
+        if problems:
+            self.report({'WARNING'}, f"{good} entries ok, {len(problems)} problems (see console)")
+        else:
+            self.report({'INFO'}, f"{good} entries ok, {cache.total_size() / (1024 * 1024):.1f} MB")
+        return {'FINISHED'}
+
+
+def register():
+    bpy.utils.register_class(VerifyLibraryCacheOperator)
+    bpy.types.Scene.pix_use_library_cache = bpy.props.BoolProperty(
+        name="Library cache",
+        description="Realize each unique collection once into a cached .blend and append it from there",
+        default=False
+    )
+    bpy.types.Scene.pix_library_cache_dir = bpy.props.StringProperty(
+        name="Cache directory",
+        subtype='DIR_PATH',
+        default="//pix_library_cache/"
+    )
+    bpy.types.Scene.pix_library_cache_limit = bpy.props.IntProperty(
+        name="Cache size (MB)",
+        description="Least recently used libraries are removed past this size",
+        default=2048,
+        min=1
+    )
+
+def unregister():
+    bpy.utils.unregister_class(VerifyLibraryCacheOperator)
+    del bpy.types.Scene.pix_use_library_cache
+    del bpy.types.Scene.pix_library_cache_dir
+    del bpy.types.Scene.pix_library_cache_limit
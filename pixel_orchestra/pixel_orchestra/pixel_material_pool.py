@@ -0,0 +1,276 @@
+import bpy
+import hashlib
+from . import pixel_datablocks
+
+PIX_ID_DUPS = "pix_id_dups"
+PIX_MATERIAL_SIGNATURE = "pix_material_signature"
+
+# Node properties every node has, these don't change what a material renders
+BASE_NODE_PROPERTIES = {
+    "rna_type", "type", "location", "width", "width_hidden", "height", "dimensions",
+    "name", "label", "inputs", "outputs", "internal_links", "parent", "use_custom_color",
+    "color", "select", "show_options", "show_preview", "hide", "mute", "show_texture",
+    "bl_idname", "bl_label", "bl_description", "bl_icon", "bl_static_type",
+    "bl_width_default", "bl_width_min", "bl_width_max", "bl_height_default",
+    "bl_height_min", "bl_height_max"
+}
+
+
+# How deep struct_signature follows nested structs
+MAX_STRUCT_DEPTH = 4
+
+
+def signature_value(value, depth=0):
+    """
+    Converts a socket or property value into something hashable and stable.
+    """
+    if isinstance(value, float):
+        return round(value, 6)
+    if isinstance(value, (int, bool, str)) or value is None:
+        return value
+    if isinstance(value, bpy.types.ID):
+        return value.name
+    if isinstance(value, bpy.types.bpy_struct):
+        return struct_signature(value, depth + 1)
+    try:
+        return tuple(signature_value(v, depth) for v in value)
+    except TypeError:
+        return str(value)
+
+
+def struct_signature(struct, depth=0):
+    """
+    The values of every property of a nested struct such as a color ramp, a curve
+    mapping or an image user. Its repr would hold the struct's address, so two
+    identical materials would never compare equal.
+    """
+    if depth > MAX_STRUCT_DEPTH:
+        return struct.bl_rna.identifier
+    properties = tuple((prop.identifier, signature_value(getattr(struct, prop.identifier, None), depth))
+                       for prop in struct.bl_rna.properties if prop.identifier != "rna_type")
+    return (struct.bl_rna.identifier, properties)
+
+
+def node_signature(node):
+    properties = []
+    for prop in node.bl_rna.properties:
+        if prop.identifier in BASE_NODE_PROPERTIES or prop.type == 'COLLECTION':
+            continue
+        properties.append((prop.identifier, signature_value(getattr(node, prop.identifier, None))))
+    inputs = [(socket.identifier, signature_value(getattr(socket, "default_value", None))) for socket in node.inputs]
+    outputs = [(socket.identifier, signature_value(getattr(socket, "default_value", None))) for socket in node.outputs]
+    custom = sorted((key, signature_value(node[key])) for key in node.keys())
+    return (node.bl_idname, node.name, tuple(properties), tuple(inputs), tuple(outputs), tuple(custom))
+
+
+def driver_signature(fcurve):
+    driver = fcurve.driver
+    variables = []
+    for var in driver.variables:
+        targets = tuple((t.id.name if t.id else None, t.data_path, getattr(t, "transform_type", None))
+                        for t in var.targets)
+        variables.append((var.name, var.type, targets))
+    return (fcurve.data_path, fcurve.array_index, driver.type, driver.expression, tuple(variables))
+
+
+def material_signature(material):
+    """
+    Hashes everything in a material that affects how it renders: its node settings,
+    socket values, links and drivers, including the objects the drivers read from.
+
+    Two materials with the same signature render the same and can be merged.
+
+    Args:
+    material (bpy.types.Material): The material to hash.
+
+    Returns:
+    str: A hex digest of the material's parameters.
+    """
+    parts = [material.blend_method, material.shadow_method, material.use_backface_culling]
+    node_tree = material.node_tree
+    if material.use_nodes and node_tree is not None:
+        parts.append(tuple(node_signature(node) for node in sorted(node_tree.nodes, key=lambda n: n.name)))
+        parts.append(tuple(sorted((link.from_node.name, link.from_socket.identifier,
+                                   link.to_node.name, link.to_socket.identifier)
+                                  for link in node_tree.links)))
+        if node_tree.animation_data:
+            parts.append(tuple(sorted(driver_signature(fcurve) for fcurve in node_tree.animation_data.drivers)))
+    else:
+        parts.append(signature_value(material.diffuse_color))
+    return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()
+
+
+def is_animated_path(id_block, data_path):
+    """
+    Checks whether a property of an ID block is keyframed or driven.
+    """
+    animation_data = getattr(id_block, "animation_data", None)
+    if animation_data is None:
+        return False
+    paths = {data_path, f'["{data_path}"]'}
+    if animation_data.action is not None:
+        for fcurve in animation_data.action.fcurves:
+            if fcurve.data_path in paths:
+                return True
+    for fcurve in animation_data.drivers:
+        if fcurve.data_path in paths:
+            return True
+    return False
+
+
+def is_constant_driver(driver):
+    """
+    Checks whether a driver can only ever produce one value, which is the case when
+    it reads plain properties that nothing animates and doesn't depend on the frame.
+    """
+    if driver.use_self or "frame" in driver.expression:
+        return False
+    for var in driver.variables:
+        if var.type != 'SINGLE_PROP':
+            return False
+        target = var.targets[0]
+        if target.id is None or is_animated_path(target.id, target.data_path):
+            return False
+    return True
+
+
+def bake_constant_drivers(material, depsgraph):
+    """
+    Replaces the drivers of a material that always produce the same value with that
+    value, so the material no longer depends on the object the driver reads from.
+
+    Returns:
+    int: The number of drivers removed.
+    """
+    node_tree = material.node_tree
+    if node_tree is None or node_tree.animation_data is None:
+        return 0
+    evaluated_tree = material.evaluated_get(depsgraph).node_tree
+    baked = 0
+    for fcurve in list(node_tree.animation_data.drivers):
+        if not is_constant_driver(fcurve.driver):
+            continue
+        try:
+            value = evaluated_tree.path_resolve(fcurve.data_path)
+        except ValueError:
+            continue
+        if not isinstance(value, (int, float)):
+            value = value[fcurve.array_index]
+        owner_path, _, prop = fcurve.data_path.rpartition(".")
+        owner = node_tree.path_resolve(owner_path)
+        array_index = fcurve.array_index
+        node_tree.animation_data.drivers.remove(fcurve)
+        current = getattr(owner, prop)
+        if isinstance(current, (int, float)):
+            setattr(owner, prop, value)
+        else:
+            current[array_index] = value
+        baked += 1
+    return baked
+
+
+class MaterialPool:
+    """
+    Keeps one material per signature and hands it out for every identical material.
+    """
+
+    def __init__(self):
+        self.materials = {}
+
+    def seed(self):
+        """
+        Adds the materials pooled by earlier runs.
+        """
+        for material in bpy.data.materials:
+            if PIX_MATERIAL_SIGNATURE in material:
+                signature = material_signature(material)
+                material[PIX_MATERIAL_SIGNATURE] = signature
+                self.materials.setdefault(signature, material)
+
+    def acquire(self, material):
+        """
+        Returns the pooled material identical to `material`, adding `material` to the
+        pool if there is none yet.
+        """
+        signature = material_signature(material)
+        pooled = self.materials.get(signature)
+        if pooled is None:
+            material[PIX_MATERIAL_SIGNATURE] = signature
+            self.materials[signature] = material
+            return material
+        return pooled
+
+
+def pool_realized_materials(context, bake_constants=False):
+    """
+    Merges the per-instance material copies of all realized collections that ended up
+    identical. With `bake_constants`, drivers that can only produce a single value are
+    baked first, so only instances whose drivers read animated properties keep a
+    material of their own.
+
+    Baking removes the drivers for good: re-realize before applying the music again.
+
+    Args:
+    context (bpy.types.Context): The current context.
+    bake_constants (bool): Bake drivers that read unanimated properties.
+
+    Returns:
+    tuple: The number of per-instance materials before and after pooling.
+    """
+    depsgraph = context.evaluated_depsgraph_get()
+    pool = MaterialPool()
+    pool.seed()
+    instance_materials = set()
+    replaced = {}
+    for collection in bpy.data.collections:
+        if PIX_ID_DUPS not in collection:
+            continue
+        for obj in collection.all_objects:
+            for slot in obj.material_slots:
+                material = slot.material
+                if material is None or slot.link != 'OBJECT':
+                    continue
+                instance_materials.add(material.name)
+                if bake_constants:
+                    bake_constant_drivers(material, depsgraph)
+                pooled = pool.acquire(material)
+                if pooled != material:
+                    slot.material = pooled
+                    replaced[material.name] = material
+    removed = pixel_datablocks.remove_datablocks(material for material in replaced.values() if material.users == 0)
+    before = len(instance_materials)
+    print(f"pooled {before} materials into {before - removed}")
+    return before, before - removed
+
+
+class PoolMaterialsOperator(bpy.types.Operator):
+    """Merge identical per-instance materials of realized collections"""
+    bl_idname = "scene.pix_pool_materials"
+    bl_label = "Pool Materials"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    def execute(self, context):
+        before, after = pool_realized_materials(context, context.scene.pool_bake_drivers)
+        self.report({'INFO'}, f"Pooled {before} materials into {after}")
+        return {'FINISHED'}
+
+
+def register():
+    bpy.utils.register_class(PoolMaterialsOperator)
+    bpy.types.Scene.pool_materials = bpy.props.BoolProperty(
+        name="Pool materials",
+        description="Merge identical per-instance materials after applying music. Materials whose "
+                    "drivers read their own instance never match unless constant drivers are baked",
+        default=False
+    )
+    bpy.types.Scene.pool_bake_drivers = bpy.props.BoolProperty(
+        name="Bake constant drivers",
+        description="Replace drivers that always give the same value with that value before pooling. "
+                    "The drivers are removed, re-realize before applying music again",
+        default=False
+    )
+
+def unregister():
+    bpy.utils.unregister_class(PoolMaterialsOperator)
+    del bpy.types.Scene.pool_materials
+    del bpy.types.Scene.pool_bake_drivers
@@ -0,0 +1,125 @@
+import numpy as np
+from .pixel_frame_plan import FramePlan
+
+# Works out which frames change straight from the note tables, without the scene.
+# Apply Music keys every note as base -> value over (start_frame, start_peak] and
+# value -> base over (end_peak, end_frame], holding in between, so only those ramps
+# can make a frame differ from the one before. Notes of the same track and midi key
+# the same property; where they overlap or touch, Bezier interpolation between their
+# interleaved keys bends outside the ramps, so the whole merged span changes.
+
+
+def note_envelopes(times, durations, fps, start, end):
+    """
+    The keyframes ApplyMusicOperator puts on each note, computed for all notes at once.
+
+    Args:
+    times (numpy.ndarray): Note start times in seconds.
+    durations (numpy.ndarray): Note durations in seconds.
+    fps (float): The scene's frame rate.
+    start (float): The PixelNodeMath start parameter, where the rise ends (0..1).
+    end (float): The PixelNodeMath end parameter, where the fall begins (0..1).
+
+    Returns:
+    tuple: (start_frame, start_peak, end_peak, end_frame, keyed) int arrays, keyed being
+    the mask of notes long enough to be keyed at all.
+    """
+    times = np.asarray(times, dtype=np.float64)
+    durations = np.asarray(durations, dtype=np.float64)
+    # int() truncates towards zero, the same as Apply Music does
+    start_frame = np.trunc(fps * times).astype(np.int64)
+    end_frame = np.trunc(fps * times + fps * durations).astype(np.int64)
+    frames = end_frame - start_frame
+    start_peak = np.maximum(start_frame + 1, np.trunc(start_frame + frames * start).astype(np.int64))
+    end_peak = np.minimum(end_frame - 1, np.trunc(end_frame - frames * (1 - end)).astype(np.int64))
+    keyed = start_frame + 3 < end_frame
+    return start_frame, start_peak, end_peak, end_frame, keyed
+
+
+def merged_runs(rows, keys, first, last):
+    """
+    Merges the notes of each row and key whose first..last frames overlap or touch.
+
+    Returns:
+    tuple: (rows, first, last) int arrays of the runs of more than one note.
+    """
+    if len(rows) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty
+    # Midi values may come as numbers or strings, only equality matters
+    key_index = np.unique(np.array([str(key) for key in keys]), return_inverse=True)[1]
+    order = np.lexsort((first, key_index, rows))
+    runs = []
+    current = None
+    for index in order.tolist():
+        group = (int(rows[index]), int(key_index[index]))
+        if current is not None and current[0] == group and first[index] <= current[2]:
+            current[2] = max(current[2], int(last[index]))
+            current[3] += 1
+            continue
+        if current is not None and current[3] > 1:
+            runs.append(current)
+        current = [group, int(first[index]), int(last[index]), 1]
+    if current[3] > 1:
+        runs.append(current)
+    return (np.array([run[0][0] for run in runs], dtype=np.int64),
+            np.array([run[1] for run in runs], dtype=np.int64),
+            np.array([run[2] for run in runs], dtype=np.int64))
+
+
+def activation_bitmap(tracks, times, durations, fps, envelopes, frame_start, frame_end, track_count=None,
+                      keys=None):
+    """
+    A track x frame bitmap, true where a track's values change from the frame before.
+
+    Args:
+    tracks (numpy.ndarray): The track index of every note.
+    times (numpy.ndarray): Note start times in seconds.
+    durations (numpy.ndarray): Note durations in seconds.
+    fps (float): The scene's frame rate.
+    envelopes (list): (start, end) parameters of every PixelNodeMath node keying the notes.
+    frame_start (int): The first frame of the bitmap.
+    frame_end (int): The last frame of the bitmap.
+    track_count (int): The number of rows, defaults to the highest track index + 1.
+    keys (sequence): The midi value of every note. Overlapping or touching notes of
+        the same track and midi then mark their whole merged span.
+
+    Returns:
+    numpy.ndarray: A bool array of shape (track_count, frame_end - frame_start + 1).
+    """
+    tracks = np.asarray(tracks, dtype=np.int64)
+    if track_count is None:
+        track_count = int(tracks.max()) + 1 if len(tracks) else 0
+    frame_count = frame_end - frame_start + 1
+    # Difference array: +1 where a ramp starts, -1 after it ends, a cumulative sum gives coverage
+    coverage = np.zeros((track_count, frame_count + 1), dtype=np.int32)
+
+    def add_ramps(rows, first, last):
+        first = np.clip(first - frame_start, 0, frame_count)
+        last = np.clip(last - frame_start + 1, 0, frame_count)
+        valid = first < last
+        np.add.at(coverage, (rows[valid], first[valid]), 1)
+        np.add.at(coverage, (rows[valid], last[valid]), -1)
+
+    for start, end in envelopes:
+        start_frame, start_peak, end_peak, end_frame, keyed = note_envelopes(times, durations, fps, start, end)
+        rows = tracks[keyed]
+        add_ramps(rows, start_frame[keyed] + 1, start_peak[keyed])
+        add_ramps(rows, end_peak[keyed] + 1, end_frame[keyed])
+        if keys is not None:
+            run_rows, run_first, run_last = merged_runs(rows, [key for key, k in zip(keys, keyed) if k],
+                                                        start_frame[keyed], end_frame[keyed])
+            add_ramps(run_rows, run_first, run_last)
+    return np.cumsum(coverage, axis=1)[:, :frame_count] > 0
+
+
+def plan_from_bitmap(bitmap, frame_start, frame_end):
+    """
+    Turns an activation bitmap into a FramePlan: a frame is rendered when any track
+    changes on it.
+    """
+    if bitmap.shape[0] == 0:
+        mask = np.zeros(frame_end - frame_start + 1, dtype=bool)
+    else:
+        mask = bitmap.any(axis=0)
+    return FramePlan.from_mask(frame_start, mask.tolist(), source="notes")
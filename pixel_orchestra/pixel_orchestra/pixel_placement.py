@@ -0,0 +1,343 @@
+import numpy as np
+from mathutils import Vector, kdtree
+from .pixel_surface import get_surface, track_z_rotations
+from .pixel_fingerprint import collection_fingerprint
+
+# How many candidate points are drawn per point still needed, before the spacing is relaxed
+CANDIDATES_PER_POINT = 30
+SPACING_RELAXATION = 0.8
+RELAX_ITERATIONS = 10
+# Object types whose bounding box says nothing about the space they take up
+NON_GEOMETRY_TYPES = {'EMPTY', 'LIGHT', 'LIGHT_PROBE', 'CAMERA', 'SPEAKER'}
+
+_bounding_radii = {}
+
+
+class SpatialHash:
+    """
+    A uniform grid of points with radii for minimum-distance queries. Cells are kept
+    at least as large as the spacing and the widest point, so only a few cells around
+    a point need checking.
+    """
+
+    def __init__(self, cell_size):
+        self.cell_size = max(cell_size, 1e-6)
+        self.cells = {}
+        self.points = []
+        self.radii = []
+        self.max_radius = 0.0
+
+    def cell(self, point):
+        return tuple(int(np.floor(c / self.cell_size)) for c in point)
+
+    def ensure_cell_size(self, cell_size):
+        """
+        Grows the cells to `cell_size`, re-hashing the points already in.
+        """
+        if cell_size <= self.cell_size:
+            return
+        self.cell_size = cell_size
+        self.cells = {}
+        for index, point in enumerate(self.points):
+            self.cells.setdefault(self.cell(point), []).append(index)
+
+    def insert(self, point, radius=0.0):
+        self.ensure_cell_size(2 * radius)
+        self.cells.setdefault(self.cell(point), []).append(len(self.points))
+        self.points.append(point)
+        self.radii.append(radius)
+        self.max_radius = max(self.max_radius, radius)
+
+    def is_free(self, point, min_distance, radius=0.0, scale=1.0):
+        """
+        Checks that `point` is at least `min_distance` from every point in the hash, and
+        that a sphere of `radius` around it doesn't overlap theirs.
+
+        Args:
+        scale (float): Multiplies the summed radii, below 1 to tolerate some overlap.
+        """
+        reach_distance = max(min_distance, (radius + self.max_radius) * scale)
+        if reach_distance <= 0 or not self.points:
+            return True
+        reach = int(np.ceil(reach_distance / self.cell_size))
+        cx, cy, cz = self.cell(point)
+        for x in range(cx - reach, cx + reach + 1):
+            for y in range(cy - reach, cy + reach + 1):
+                for z in range(cz - reach, cz + reach + 1):
+                    for index in self.cells.get((x, y, z), ()):
+                        other = self.points[index]
+                        dx = other[0] - point[0]
+                        dy = other[1] - point[1]
+                        dz = other[2] - point[2]
+                        limit = max(min_distance, (radius + self.radii[index]) * scale)
+                        if dx * dx + dy * dy + dz * dz < limit * limit:
+                            return False
+        return True
+
+
+class Placements:
+    """
+    Sampled points on a SurfaceSet, as arrays.
+
+    Attributes:
+    objects (list): The plane object of each point.
+    world_positions (numpy.ndarray): (N, 3) positions in world space.
+    world_rotations (numpy.ndarray): (N, 3) Euler rotations aligning Z with the world face normal.
+    local_positions (numpy.ndarray): (N, 3) positions in the plane object's space.
+    local_rotations (numpy.ndarray): (N, 3) Euler rotations aligning Z with the local face normal.
+    relaxed (bool): Whether the spacing or radii had to be relaxed to fit the points,
+        so they may overlap.
+    """
+
+    def __init__(self, objects, world_positions, world_rotations, local_positions, local_rotations):
+        self.objects = objects
+        self.world_positions = world_positions
+        self.world_rotations = world_rotations
+        self.local_positions = local_positions
+        self.local_rotations = local_rotations
+        self.relaxed = False
+
+    def __len__(self):
+        return len(self.objects)
+
+
+def sample_candidates(surfaces, count, rng):
+    """
+    Draws points uniformly over the area of a SurfaceSet: triangles are picked in
+    proportion to their world-space area, then a uniform point inside each.
+
+    Returns:
+    tuple: (surface indices, triangle indices within their surface, barycentric weights (N, 3))
+    """
+    areas = surfaces.concatenate("triangle_areas")
+    if areas.sum() <= 0:
+        raise ValueError("Surface has no area to place on")
+    triangle_offsets = np.cumsum([0] + [len(surface.triangles) for surface in surfaces.surfaces])
+    picked = rng.choice(len(areas), size=count, p=areas / areas.sum())
+    surface_indices = np.searchsorted(triangle_offsets, picked, side='right') - 1
+    triangle_indices = picked - triangle_offsets[surface_indices]
+
+    # Folding the unit square onto the triangle keeps the distribution uniform
+    u = rng.random(count)
+    v = rng.random(count)
+    flip = u + v > 1
+    u[flip] = 1 - u[flip]
+    v[flip] = 1 - v[flip]
+    weights = np.stack([1 - u - v, u, v], axis=1)
+    return surface_indices, triangle_indices, weights
+
+
+def place_on_surfaces(surfaces, count, spacing=0.0, seed=0, occupied=None, radii=None):
+    """
+    Samples `count` points on a SurfaceSet, proportional to face area and at least
+    `spacing` apart (Poisson-disk). The same seed always gives the same points.
+
+    If the surface can't fit `count` points that far apart, the spacing and radii are
+    relaxed step by step until it can.
+
+    Args:
+    surfaces (SurfaceSet): The faces to place on.
+    count (int): The number of points.
+    spacing (float): The minimum distance between points, 0 for none.
+    seed (int): The random seed.
+    occupied (SpatialHash): Points already placed, for instance by another track on
+        the same plane. Accepted points are added to it.
+    radii (sequence): Optional bounding radius of each point. Points are kept far
+        enough apart that these spheres don't overlap.
+
+    Returns:
+    Placements: The sampled points.
+    """
+    rng = np.random.default_rng(seed)
+    if radii is None:
+        radii = [0.0] * count
+    radii = [float(radius) for radius in radii]
+    if occupied is None:
+        occupied = SpatialHash(spacing)
+    occupied.ensure_cell_size(max([spacing] + [2 * radius for radius in radii]))
+    accepted = []
+    min_distance = spacing
+    relax = 1.0
+    while len(accepted) < count:
+        needed = count - len(accepted)
+        candidates = sample_candidates(surfaces, needed * CANDIDATES_PER_POINT, rng)
+        positions = np.empty((len(candidates[0]), 3))
+        for surface_index, surface in enumerate(surfaces.surfaces):
+            mask = candidates[0] == surface_index
+            corners = surface.world_vertices[surface.triangles[candidates[1][mask]]]
+            positions[mask] = np.einsum('ij,ijk->ik', candidates[2][mask], corners)
+        for index, position in enumerate(positions.tolist()):
+            radius = radii[len(accepted)]
+            if occupied.is_free(position, min_distance, radius, relax):
+                occupied.insert(position, radius)
+                accepted.append((candidates[0][index], candidates[1][index], candidates[2][index], position))
+                if len(accepted) == count:
+                    break
+        if len(accepted) < count:
+            min_distance *= SPACING_RELAXATION
+            relax *= SPACING_RELAXATION
+            print(f"Could not fit {count} points {spacing} apart, relaxing spacing to {min_distance:.4f}")
+    placements = build_placements(surfaces, accepted)
+    placements.relaxed = relax < 1.0
+    return placements
+
+
+def build_placements(surfaces, accepted):
+    objects = []
+    world_positions = np.empty((len(accepted), 3))
+    local_positions = np.empty((len(accepted), 3))
+    world_normals = np.empty((len(accepted), 3))
+    local_normals = np.empty((len(accepted), 3))
+    for index, (surface_index, triangle_index, weights, position) in enumerate(accepted):
+        surface = surfaces.surfaces[surface_index]
+        polygon = surface.triangle_polygons[triangle_index]
+        objects.append(surfaces.objects[surface_index])
+        world_positions[index] = position
+        # Barycentric weights carry over to local space, matrix_world is affine
+        local_positions[index] = weights @ surface.vertices[surface.triangles[triangle_index]]
+        world_normals[index] = surface.normals[polygon]
+        local_normals[index] = surface.polygon_normals[polygon]
+    return Placements(objects, world_positions, track_z_rotations(world_normals),
+                      local_positions, track_z_rotations(local_normals))
+
+
+def collection_bounding_radius(collection):
+    """
+    Radius of the sphere around a collection's instance offset that holds the bounding
+    boxes of all its objects. Cached per collection until its fingerprint changes.
+    """
+    fingerprint = collection_fingerprint(collection)
+    cached = _bounding_radii.get(collection.name)
+    if cached is not None and cached[0] == fingerprint:
+        return cached[1]
+    radius = 0.0
+    origin = np.array(collection.instance_offset)
+    for obj in collection.all_objects:
+        if obj.type in NON_GEOMETRY_TYPES:
+            continue
+        corners = np.array([obj.matrix_world @ Vector(corner) for corner in obj.bound_box])
+        radius = max(radius, float(np.linalg.norm(corners - origin, axis=1).max()))
+    _bounding_radii[collection.name] = (fingerprint, radius)
+    return radius
+
+
+def instance_radii(instances):
+    """
+    Bounding radius of each collection instance, scaled by its largest scale axis.
+    """
+    # Once per collection, the fingerprint check costs a pass over all of its objects
+    collection_radii = {}
+    radii = []
+    for instance in instances:
+        radius = 0.0
+        collection = instance.instance_collection
+        if collection is not None:
+            radius = collection_radii.get(collection.name)
+            if radius is None:
+                radius = collection_radii[collection.name] = collection_bounding_radius(collection)
+        radii.append(radius * max(abs(value) for value in instance.scale))
+    return radii
+
+
+def snap_to_surface(placements, index, world_position):
+    """
+    Moves a placement to the point of its plane object's surface closest to
+    `world_position`, taking over that point's normal.
+    """
+    obj = placements.objects[index]
+    surface = get_surface(obj)
+    matrix = obj.matrix_world
+    local, normal, triangle, _ = surface.bvh().find_nearest(matrix.inverted() @ Vector(world_position))
+    if local is None:
+        return
+    world_normal = (matrix.to_3x3().inverted().transposed() @ normal).normalized()
+    placements.local_positions[index] = local
+    placements.world_positions[index] = matrix @ local
+    placements.local_rotations[index] = track_z_rotations(np.array([normal]))[0]
+    placements.world_rotations[index] = track_z_rotations(np.array([world_normal]))[0]
+
+
+def resolve_overlaps(groups, iterations=RELAX_ITERATIONS, seed=0):
+    """
+    Pushes apart placed instances whose bounding spheres overlap, across any number of
+    tracks and planes, and snaps the moved ones back onto their surfaces.
+
+    A KD-tree over all placements finds the overlapping pairs. Each pair is moved
+    apart by half the overlap along the line between them, repeated until nothing
+    overlaps or `iterations` runs out.
+
+    Args:
+    groups (list): (Placements, radii) pairs, updated in place.
+    iterations (int): The most relaxation passes.
+    seed (int): Seed for the direction of exactly coinciding pairs.
+
+    Returns:
+    int: The number of overlapping pairs left.
+    """
+    rng = np.random.default_rng(seed)
+    owners = [(group, index) for group, (placements, _) in enumerate(groups) for index in range(len(placements))]
+    if not owners:
+        return 0
+    radii = np.concatenate([np.asarray(group_radii, dtype=np.float64) for _, group_radii in groups])
+    max_radius = radii.max()
+    overlaps = 0
+    for _ in range(iterations):
+        positions = np.concatenate([placements.world_positions for placements, _ in groups])
+        tree = kdtree.KDTree(len(positions))
+        for index, position in enumerate(positions.tolist()):
+            tree.insert(position, index)
+        tree.balance()
+
+        moves = np.zeros_like(positions)
+        overlaps = 0
+        for index, position in enumerate(positions.tolist()):
+            if radii[index] <= 0:
+                continue
+            for _, other, distance in tree.find_range(position, radii[index] + max_radius):
+                limit = radii[index] + radii[other]
+                if other <= index or distance >= limit:
+                    continue
+                overlaps += 1
+                direction = positions[index] - positions[other]
+                length = np.linalg.norm(direction)
+                if length < 1e-9:
+                    direction = rng.normal(size=3)
+                    length = np.linalg.norm(direction)
+                push = direction / length * (limit - distance) / 2
+                moves[index] += push
+                moves[other] -= push
+        if overlaps == 0:
+            break
+        for index in np.flatnonzero(np.any(moves != 0, axis=1)):
+            group, group_index = owners[index]
+            snap_to_surface(groups[group][0], group_index, positions[index] + moves[index])
+    if overlaps:
+        print(f"{overlaps} overlapping instances left after {iterations} passes")
+    return overlaps
+
+
+def apply_placements(instances, placements, pin_to_face=False):
+    """
+    Moves instances onto their placements. Nothing is updated here, the caller updates
+    the view layer once after all placements are applied.
+
+    Args:
+    instances (list): The objects to move, one per placement.
+    placements (Placements): Where to put them.
+    pin_to_face (bool): Parent each instance to its plane object, so it follows the plane.
+    """
+    if pin_to_face:
+        positions = placements.local_positions.tolist()
+        rotations = placements.local_rotations.tolist()
+    else:
+        positions = placements.world_positions.tolist()
+        rotations = placements.world_rotations.tolist()
+    for index, instance in enumerate(instances):
+        if pin_to_face:
+            instance.parent = placements.objects[index]
+            instance.matrix_parent_inverse.identity()
+        else:
+            instance.parent = None
+        instance.rotation_mode = 'XYZ'
+        instance.location = positions[index]
+        instance.rotation_euler = rotations[index]
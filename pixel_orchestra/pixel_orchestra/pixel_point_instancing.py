@@ -0,0 +1,316 @@
+import bpy
+from . import pixel_datablocks
+
+PIX_PREFIX = "pix_"
+PIX_PROPERTIES = "pix_properties"
+PIX_POINT_TRACK = "pix_point_track"
+PIX_POINT_SOURCE = "pix_point_source"
+POINT_ROTATION = "pix_rotation"
+POINT_SCALE = "pix_scale"
+
+# Pix properties that move the instance rather than feed its materials
+LOCATION_PROPERTIES = ("location_x", "location_y", "location_z")
+ROTATION_PROPERTIES = ("rotation_x", "rotation_y", "rotation_z")
+
+# Point indices by note per point cloud mesh, see point_note_index
+_point_notes = {}
+
+
+def collect_pix_defaults(collection):
+    """
+    Finds the pix properties used by a collection's objects and material nodes,
+    with their default values.
+
+    Args:
+    collection (bpy.types.Collection): The source collection.
+
+    Returns:
+    dict: Maps a property name (without the pix_ prefix) to its default float value.
+    """
+    defaults = {}
+
+    def read(owner):
+        if PIX_PROPERTIES not in owner.keys():
+            return
+        for prop in owner[PIX_PROPERTIES].split(','):
+            value = owner.get(f"{PIX_PREFIX}{prop}", 0.0)
+            try:
+                defaults.setdefault(prop, float(value))
+            except (TypeError, ValueError):
+                defaults.setdefault(prop, 0.0)
+
+    for obj in collection.all_objects:
+        read(obj)
+        for slot in obj.material_slots:
+            if slot.material is not None and slot.material.node_tree is not None:
+                for node in slot.material.node_tree.nodes:
+                    read(node)
+    return defaults
+
+
+def new_group_socket(group, name, in_out, socket_type):
+    # Blender 4.0 replaced group.inputs/outputs with the interface API
+    if hasattr(group, "interface"):
+        return group.interface.new_socket(name=name, in_out=in_out, socket_type=socket_type)
+    if in_out == 'INPUT':
+        return group.inputs.new(socket_type, name)
+    return group.outputs.new(socket_type, name)
+
+
+def named_attribute(nodes, name, data_type, location):
+    node = nodes.new('GeometryNodeInputNamedAttribute')
+    node.data_type = data_type
+    node.inputs['Name'].default_value = name
+    node.location = location
+    # Older versions keep one hidden output per data type, all called Attribute
+    return next(output for output in node.outputs if output.name == 'Attribute' and output.enabled)
+
+
+def combine_attributes(nodes, links, names, location):
+    combine = nodes.new('ShaderNodeCombineXYZ')
+    combine.location = location
+    for i, name in enumerate(names):
+        attribute = named_attribute(nodes, name, 'FLOAT', (location[0] - 200, location[1] - i * 120))
+        links.new(attribute, combine.inputs[i])
+    return combine.outputs[0]
+
+
+def get_point_instancer_group(collection):
+    """
+    Returns the Geometry Nodes group that instances `collection` on every point of
+    its geometry, creating it on first use.
+
+    Each point's pix_rotation and pix_scale attributes give the instance its base
+    transform. The location_* and rotation_* pix attributes are added on top in the
+    instance's local space. Point attributes are carried over to the instances, so
+    materials read the other pix values through Attribute nodes set to Instancer.
+    """
+    name = f"PixPointInstancer_{collection.name}"
+    group = bpy.data.node_groups.get(name)
+    if group is not None:
+        return group
+
+    group = bpy.data.node_groups.new(name, 'GeometryNodeTree')
+    new_group_socket(group, "Geometry", 'INPUT', 'NodeSocketGeometry')
+    new_group_socket(group, "Geometry", 'OUTPUT', 'NodeSocketGeometry')
+    nodes = group.nodes
+    links = group.links
+
+    group_input = nodes.new('NodeGroupInput')
+    group_input.location = (-800, 0)
+    group_output = nodes.new('NodeGroupOutput')
+    group_output.location = (800, 0)
+
+    collection_info = nodes.new('GeometryNodeCollectionInfo')
+    collection_info.location = (-500, -200)
+    collection_info.inputs['Collection'].default_value = collection
+
+    instance_on_points = nodes.new('GeometryNodeInstanceOnPoints')
+    instance_on_points.location = (0, 0)
+    links.new(group_input.outputs[0], instance_on_points.inputs['Points'])
+    links.new(collection_info.outputs[0], instance_on_points.inputs['Instance'])
+    links.new(named_attribute(nodes, POINT_ROTATION, 'FLOAT_VECTOR', (-300, -400)), instance_on_points.inputs['Rotation'])
+    links.new(named_attribute(nodes, POINT_SCALE, 'FLOAT_VECTOR', (-300, -550)), instance_on_points.inputs['Scale'])
+
+    translate = nodes.new('GeometryNodeTranslateInstances')
+    translate.location = (250, 0)
+    links.new(instance_on_points.outputs[0], translate.inputs['Instances'])
+    links.new(combine_attributes(nodes, links, LOCATION_PROPERTIES, (50, -300)), translate.inputs['Translation'])
+
+    rotate = nodes.new('GeometryNodeRotateInstances')
+    rotate.location = (500, 0)
+    links.new(translate.outputs[0], rotate.inputs['Instances'])
+    links.new(combine_attributes(nodes, links, ROTATION_PROPERTIES, (300, -300)), rotate.inputs['Rotation'])
+
+    links.new(rotate.outputs[0], group_output.inputs[0])
+    return group
+
+
+def point_cloud_index():
+    """
+    Maps (source collection name, track) to the point cloud made for them, with one
+    pass over bpy.data.objects. (None, track) maps to the first point cloud of a track.
+    """
+    index = {}
+    for obj in bpy.data.objects:
+        if PIX_POINT_TRACK in obj:
+            index.setdefault((obj.get(PIX_POINT_SOURCE), obj[PIX_POINT_TRACK]), obj)
+            index.setdefault((None, obj[PIX_POINT_TRACK]), obj)
+    return index
+
+
+def find_track_point_cloud(track, collection=None, index=None):
+    """
+    Returns the point cloud object made for a track, optionally for a given source
+    collection. Pass an index from point_cloud_index when looking up many tracks.
+    """
+    if index is None:
+        index = point_cloud_index()
+    return index.get((collection.name if collection is not None else None, track))
+
+
+def build_point_cloud(name, instances, collection, parent_collection, pix_defaults):
+    """
+    Creates a mesh with one vertex per instance, carrying the instance's track, note,
+    base transform and pix values as point attributes, and an object using it with
+    the point instancer modifier.
+
+    Args:
+    name (str): The name of the new object and mesh.
+    instances (list): The collection instances, all of one track and source collection.
+    collection (bpy.types.Collection): The source collection.
+    parent_collection (bpy.types.Collection): The collection to link the object to.
+    pix_defaults (dict): The pix properties to add as attributes, with their start values.
+
+    Returns:
+    bpy.types.Object: The point cloud object.
+    """
+    instances = sorted(instances, key=lambda insta: insta.get('note', 0))
+    mesh = bpy.data.meshes.new(name)
+    mesh.vertices.add(len(instances))
+    coordinates = []
+    rotations = []
+    scales = []
+    for insta in instances:
+        location, rotation, scale = insta.matrix_world.decompose()
+        coordinates.extend(location)
+        rotations.extend(rotation.to_euler())
+        scales.extend(scale)
+    mesh.vertices.foreach_set("co", coordinates)
+
+    mesh.attributes.new("track", 'INT', 'POINT').data.foreach_set("value", [insta.get('track', 0) for insta in instances])
+    mesh.attributes.new("note", 'INT', 'POINT').data.foreach_set("value", [insta.get('note', 0) for insta in instances])
+    mesh.attributes.new(POINT_ROTATION, 'FLOAT_VECTOR', 'POINT').data.foreach_set("vector", rotations)
+    mesh.attributes.new(POINT_SCALE, 'FLOAT_VECTOR', 'POINT').data.foreach_set("vector", scales)
+    # Transform properties are offsets on top of the base transform, so they start at zero
+    attribute_defaults = {prop: 0.0 if prop in LOCATION_PROPERTIES or prop in ROTATION_PROPERTIES else value
+                          for prop, value in pix_defaults.items() if prop not in mesh.attributes}
+    for prop, value in attribute_defaults.items():
+        mesh.attributes.new(prop, 'FLOAT', 'POINT').data.foreach_set("value", [value] * len(instances))
+    mesh.update()
+
+    obj = pixel_datablocks.create_object(name, mesh, parent_collection)
+    for prop, value in attribute_defaults.items():
+        obj[f"{PIX_PREFIX}{prop}"] = value
+    obj[PIX_POINT_TRACK] = instances[0].get('track', 0)
+    obj[PIX_POINT_SOURCE] = collection.name
+    modifier = obj.modifiers.new("PixPointInstancer", 'NODES')
+    modifier.node_group = get_point_instancer_group(collection)
+    return obj
+
+
+def realize_point_instances(scene, parent_collection=None):
+    """
+    Replaces the collection instances made by Process JSON File with one point cloud
+    per track and source collection, instanced through Geometry Nodes. Point clouds
+    from an earlier run are replaced.
+
+    Returns:
+    list: The point cloud objects created.
+    """
+    if parent_collection is None:
+        parent_collection = scene.collection
+    groups = {}
+    for obj in bpy.data.objects:
+        if obj.instance_type == 'COLLECTION' and obj.instance_collection is not None and 'track' in obj:
+            groups.setdefault((obj['track'], obj.instance_collection.name), []).append(obj)
+
+    old_clouds = [obj for obj in bpy.data.objects
+                  if PIX_POINT_TRACK in obj and (obj[PIX_POINT_TRACK], obj.get(PIX_POINT_SOURCE)) in groups]
+    pixel_datablocks.remove_objects(old_clouds, remove_data=True)
+
+    clouds = []
+    instances = []
+    for (track, collection_name), track_instances in groups.items():
+        collection = bpy.data.collections[collection_name]
+        name = f"PixPoints_Track_{track}_{collection_name}"
+        clouds.append(build_point_cloud(name, track_instances, collection, parent_collection, collect_pix_defaults(collection)))
+        instances.extend(track_instances)
+    pixel_datablocks.remove_objects(instances)
+    return clouds
+
+
+def point_note_index(point_cloud):
+    """
+    Maps each note to the indices of its points in a point cloud. Read once per
+    point cloud and kept while its mesh keeps the same name and point count.
+    """
+    mesh = point_cloud.data
+    key = mesh.as_pointer()
+    cached = _point_notes.get(key)
+    if cached is not None and cached[0] == mesh.name and cached[1] == len(mesh.vertices):
+        return cached[2]
+    notes = [0] * len(mesh.vertices)
+    mesh.attributes["note"].data.foreach_get("value", notes)
+    index = {}
+    for point, note in enumerate(notes):
+        index.setdefault(note, []).append(point)
+    _point_notes[key] = (mesh.name, len(mesh.vertices), index)
+    return index
+
+
+def customized_materials(collection):
+    """
+    The names of the materials in a collection with customized (pix_properties) nodes.
+    """
+    return sorted({slot.material.name for obj in collection.all_objects for slot in obj.material_slots
+                   if slot.material is not None and slot.material.node_tree is not None
+                   and any(PIX_PROPERTIES in node.keys() for node in slot.material.node_tree.nodes)})
+
+
+def key_point_note(point_cloud, note, property_name, base_value, value, frames):
+    """
+    Keys a pix attribute of every point of a note, the point cloud counterpart of the
+    keyframes ApplyMusicOperator adds to realized objects.
+
+    Args:
+    point_cloud (bpy.types.Object): A point cloud made by realize_point_instances.
+    note (int): The note whose points are keyed.
+    property_name (str): The pix property, which is also the attribute name.
+    base_value (float): The value at the start and end of the note.
+    value (float): The value between the peaks.
+    frames (tuple): (start_frame, start_peak, end_peak, end_frame)
+    """
+    mesh = point_cloud.data
+    attribute = mesh.attributes.get(property_name)
+    if attribute is None:
+        print(f"Point cloud '{point_cloud.name}' has no attribute '{property_name}'")
+        return
+    start_frame, start_peak, end_peak, end_frame = frames
+    for index in point_note_index(point_cloud).get(note, ()):
+        point = attribute.data[index]
+        for frame, frame_value in ((start_frame, base_value), (start_peak, value),
+                                   (end_peak, value), (end_frame, base_value)):
+            point.value = frame_value
+            point.keyframe_insert("value", frame=frame)
+
+
+class RealizePointInstancesOperator(bpy.types.Operator):
+    """Replace collection instances with one Geometry Nodes point cloud per track.
+    Materials are the source collection's own and aren't rewired: customized nodes keep
+    their drivers on the source objects, so pix values other than location and rotation
+    only show once the material reads them with an Attribute node set to Instancer"""
+    bl_idname = "object.realize_point_instances"
+    bl_label = "Realize as Point Instances"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    def execute(self, context):
+        parent_collection = bpy.data.collections.get(context.scene.target_collection_enum)
+        clouds = realize_point_instances(context.scene, parent_collection)
+        sources = {cloud.get(PIX_POINT_SOURCE) for cloud in clouds}
+        materials = sorted({name for source in sources if source in bpy.data.collections
+                            for name in customized_materials(bpy.data.collections[source])})
+        if materials:
+            self.report({'WARNING'}, f"Created {len(clouds)} point clouds. Customized materials "
+                                     f"{', '.join(materials)} don't read the point attributes, add "
+                                     f"Attribute nodes set to Instancer for their pix values")
+        else:
+            self.report({'INFO'}, f"Created {len(clouds)} point clouds")
+        return {'FINISHED'}
+
+
+def register():
+    bpy.utils.register_class(RealizePointInstancesOperator)
+
+def unregister():
+    bpy.utils.unregister_class(RealizePointInstancesOperator)
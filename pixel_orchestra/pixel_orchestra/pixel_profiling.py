@@ -0,0 +1,403 @@
+import bpy
+import json
+import time
+
+PIX_ID_DUPS = "pix_id_dups"
+
+DRIVER_KIND_SIMPLE = "SIMPLE"
+DRIVER_KIND_PYTHON = "PYTHON"
+
+
+def classify_driver(driver):
+    """
+    Classifies a driver by how Blender evaluates it.
+
+    Scripted drivers whose expression Blender can evaluate without the Python
+    interpreter, and all non-scripted drivers (average, sum, min, max), are
+    'SIMPLE'. Every other scripted driver goes through Python and is 'PYTHON'.
+
+    Args:
+    driver (bpy.types.Driver): The driver to classify.
+
+    Returns:
+    str: DRIVER_KIND_SIMPLE or DRIVER_KIND_PYTHON.
+    """
+    if driver.type != 'SCRIPTED':
+        return DRIVER_KIND_SIMPLE
+    if driver.is_simple_expression:
+        return DRIVER_KIND_SIMPLE
+    return DRIVER_KIND_PYTHON
+
+
+def find_realized_collections():
+    """
+    Returns all collections created by the realize operator.
+    """
+    return [coll for coll in bpy.data.collections if PIX_ID_DUPS in coll]
+
+
+def collect_realized_drivers():
+    """
+    Lists every driver created by realize_objects and realize_nodes, grouped by the
+    realized collection that owns it.
+
+    Object drivers are read from the objects of each realized collection, node drivers
+    from the node trees of the materials those objects use. A material shared between
+    several realized collections is only reported for the first one.
+
+    Returns:
+    dict: Maps a collection name to a list of dicts with the keys 'owner', 'owner_type',
+          'data_path', 'array_index', 'expression', 'kind' and 'fcurve'.
+    """
+    groups = {}
+    seen_materials = set()
+    for coll in find_realized_collections():
+        drivers = []
+        for obj in coll.all_objects:
+            if obj.animation_data:
+                for fcurve in obj.animation_data.drivers:
+                    drivers.append(describe_driver(obj.name, 'OBJECT', fcurve))
+            for slot in obj.material_slots:
+                material = slot.material
+                if material is None or material.node_tree is None or material.name in seen_materials:
+                    continue
+                seen_materials.add(material.name)
+                if material.node_tree.animation_data:
+                    for fcurve in material.node_tree.animation_data.drivers:
+                        drivers.append(describe_driver(material.name, 'MATERIAL', fcurve))
+        if drivers:
+            groups[coll.name] = drivers
+    return groups
+
+
+def describe_driver(owner_name, owner_type, fcurve):
+    driver = fcurve.driver
+    return {
+        "owner": owner_name,
+        "owner_type": owner_type,
+        "data_path": fcurve.data_path,
+        "array_index": fcurve.array_index,
+        "expression": driver.expression if driver.type == 'SCRIPTED' else driver.type,
+        "kind": classify_driver(driver),
+        "fcurve": fcurve
+    }
+
+
+def sample_frames(scene, count):
+    """
+    Picks up to `count` frames spread evenly over the scene's frame range.
+    """
+    start = scene.frame_start
+    end = scene.frame_end
+    if count <= 1 or end <= start:
+        return [start]
+    count = min(count, end - start + 1)
+    return sorted({start + round(i * (end - start) / (count - 1)) for i in range(count)})
+
+
+def time_frames(scene, frames, repeats):
+    """
+    Returns the mean time in seconds spent evaluating the depsgraph for one of the
+    given frames.
+    """
+    total = 0.0
+    for _ in range(repeats):
+        for frame in frames:
+            start = time.perf_counter()
+            scene.frame_set(frame)
+            total += time.perf_counter() - start
+    return total / (repeats * len(frames))
+
+
+def time_with_muted(scene, fcurves, frames, repeats):
+    previous = [fcurve.mute for fcurve in fcurves]
+    try:
+        for fcurve in fcurves:
+            fcurve.mute = True
+        return time_frames(scene, frames, repeats)
+    finally:
+        for fcurve, mute in zip(fcurves, previous):
+            fcurve.mute = mute
+
+
+def profile_realized_drivers(scene, frame_count=10, repeats=3, measure_individual=False):
+    """
+    Measures what the drivers of realized collections cost during playback.
+
+    The scene is evaluated over a sample of frames with every driver enabled, then again
+    with the drivers of one realized collection muted at a time. The difference is the
+    collection's cost. With `measure_individual` each driver is also muted on its own;
+    otherwise a driver's cost is its collection's cost split evenly across its drivers.
+
+    Args:
+    scene (bpy.types.Scene): The scene to evaluate.
+    frame_count (int): How many frames of the frame range to sample.
+    repeats (int): How many times each sample is evaluated.
+    measure_individual (bool): Time every driver separately.
+
+    Returns:
+    dict: A JSON serializable report with the per-collection and per-driver cost in ms.
+    """
+    groups = collect_realized_drivers()
+    frames = sample_frames(scene, frame_count)
+    original_frame = scene.frame_current
+
+    report = {
+        "scene": scene.name,
+        "frames": frames,
+        "repeats": repeats,
+        "baseline_ms": 0.0,
+        "collections": [],
+        "drivers": []
+    }
+    try:
+        # Discarded warm-up, so cold caches aren't charged to whichever collection is
+        # measured first. The one baseline below is used for every cost.
+        time_frames(scene, frames, 1)
+        baseline = time_frames(scene, frames, repeats)
+        report["baseline_ms"] = baseline * 1000.0
+        for collection_name, drivers in groups.items():
+            fcurves = [d["fcurve"] for d in drivers]
+            cost = max(0.0, baseline - time_with_muted(scene, fcurves, frames, repeats))
+            report["collections"].append({
+                "collection": collection_name,
+                "driver_count": len(drivers),
+                "python_count": len([d for d in drivers if d["kind"] == DRIVER_KIND_PYTHON]),
+                "cost_ms": cost * 1000.0
+            })
+            for d in drivers:
+                if measure_individual:
+                    driver_cost = max(0.0, baseline - time_with_muted(scene, [d["fcurve"]], frames, repeats))
+                else:
+                    driver_cost = cost / len(drivers)
+                entry = {key: value for key, value in d.items() if key != "fcurve"}
+                entry["collection"] = collection_name
+                entry["cost_ms"] = driver_cost * 1000.0
+                entry["measured"] = measure_individual
+                report["drivers"].append(entry)
+    finally:
+        scene.frame_set(original_frame)
+
+    report["collections"].sort(key=lambda c: c["cost_ms"], reverse=True)
+    report["drivers"].sort(key=lambda d: d["cost_ms"], reverse=True)
+    return report
+
+
+def store_report(scene, report):
+    """
+    Copies a profiling report into the scene so the panel can show it.
+    """
+    props = scene.pix_driver_profile
+    props.driver_costs.clear()
+    props.collection_costs.clear()
+    props.baseline_ms = report["baseline_ms"]
+    props.frame_count = len(report["frames"])
+    for c in report["collections"]:
+        item = props.collection_costs.add()
+        item.name = c["collection"]
+        item.collection = c["collection"]
+        item.driver_count = c["driver_count"]
+        item.python_count = c["python_count"]
+        item.cost_ms = c["cost_ms"]
+    for d in report["drivers"]:
+        item = props.driver_costs.add()
+        item.name = f"{d['owner']} {d['data_path']}[{d['array_index']}]"
+        item.owner = d["owner"]
+        item.owner_type = d["owner_type"]
+        item.data_path = d["data_path"]
+        item.array_index = d["array_index"]
+        item.expression = d["expression"]
+        item.kind = d["kind"]
+        item.collection = d["collection"]
+        item.cost_ms = d["cost_ms"]
+        item.measured = d["measured"]
+    scene["pix_driver_profile_report"] = json.dumps(report)
+
+
+class PixDriverCostItem(bpy.types.PropertyGroup):
+    owner: bpy.props.StringProperty(name="Owner")
+    owner_type: bpy.props.StringProperty(name="Owner Type")
+    data_path: bpy.props.StringProperty(name="Data Path")
+    array_index: bpy.props.IntProperty(name="Index")
+    expression: bpy.props.StringProperty(name="Expression")
+    kind: bpy.props.StringProperty(name="Kind")
+    collection: bpy.props.StringProperty(name="Collection")
+    cost_ms: bpy.props.FloatProperty(name="Cost (ms)")
+    measured: bpy.props.BoolProperty(name="Measured")
+
+
+class PixCollectionCostItem(bpy.types.PropertyGroup):
+    collection: bpy.props.StringProperty(name="Collection")
+    driver_count: bpy.props.IntProperty(name="Drivers")
+    python_count: bpy.props.IntProperty(name="Python Drivers")
+    cost_ms: bpy.props.FloatProperty(name="Cost (ms)")
+
+
+class PixDriverProfileProperties(bpy.types.PropertyGroup):
+    driver_costs: bpy.props.CollectionProperty(type=PixDriverCostItem)
+    driver_costs_index: bpy.props.IntProperty()
+    collection_costs: bpy.props.CollectionProperty(type=PixCollectionCostItem)
+    collection_costs_index: bpy.props.IntProperty()
+    baseline_ms: bpy.props.FloatProperty(name="Frame (ms)")
+    frame_count: bpy.props.IntProperty(name="Frames")
+    sample_frames: bpy.props.IntProperty(name="Sample Frames", default=10, min=1)
+    repeats: bpy.props.IntProperty(name="Repeats", default=3, min=1)
+    measure_individual: bpy.props.BoolProperty(
+        name="Time each driver",
+        description="Mute every driver on its own instead of splitting the collection's cost",
+        default=False
+    )
+
+
+def sort_cost_items(items, sort_by):
+    """
+    Returns the display order for a UI list of cost items, most expensive first.
+    """
+    if sort_by == 'NAME':
+        return bpy.types.UI_UL_list.sort_items_by_name(items, "name")
+    if sort_by == 'KIND':
+        keyed = [(i, getattr(item, "kind", "")) for i, item in enumerate(items)]
+        return bpy.types.UI_UL_list.sort_items_helper(keyed, key=lambda k: k[1])
+    keyed = [(i, -item.cost_ms) for i, item in enumerate(items)]
+    return bpy.types.UI_UL_list.sort_items_helper(keyed, key=lambda k: k[1])
+
+
+SORT_ITEMS = [
+    ('COST', "Cost", "Most expensive first"),
+    ('NAME', "Name", "Alphabetical"),
+    ('KIND', "Kind", "Python drivers first")
+]
+
+
+class PIX_UL_driver_costs(bpy.types.UIList):
+    sort_by: bpy.props.EnumProperty(name="Sort By", items=SORT_ITEMS, default='COST')
+
+    def draw_item(self, context, layout, data, item, icon, active_data, active_propname, index):
+        row = layout.row(align=True)
+        row.label(text=item.name, icon='DRIVER')
+        row.label(text=item.kind)
+        row.label(text=f"{item.cost_ms:.3f} ms" + ("" if item.measured else " ~"))
+
+    def draw_filter(self, context, layout):
+        layout.prop(self, "filter_name", text="")
+        layout.prop(self, "sort_by", expand=True)
+
+    def filter_items(self, context, data, propname):
+        items = getattr(data, propname)
+        flags = []
+        if self.filter_name:
+            flags = bpy.types.UI_UL_list.filter_items_by_name(self.filter_name, self.bitflag_filter_item, items, "name")
+        return flags, sort_cost_items(items, self.sort_by)
+
+
+class PIX_UL_collection_costs(bpy.types.UIList):
+    sort_by: bpy.props.EnumProperty(name="Sort By", items=SORT_ITEMS[:2], default='COST')
+
+    def draw_item(self, context, layout, data, item, icon, active_data, active_propname, index):
+        row = layout.row(align=True)
+        row.label(text=item.collection, icon='OUTLINER_COLLECTION')
+        row.label(text=f"{item.driver_count} ({item.python_count} py)")
+        row.label(text=f"{item.cost_ms:.3f} ms")
+
+    def draw_filter(self, context, layout):
+        layout.prop(self, "filter_name", text="")
+        layout.prop(self, "sort_by", expand=True)
+
+    def filter_items(self, context, data, propname):
+        items = getattr(data, propname)
+        flags = []
+        if self.filter_name:
+            flags = bpy.types.UI_UL_list.filter_items_by_name(self.filter_name, self.bitflag_filter_item, items, "name")
+        return flags, sort_cost_items(items, self.sort_by)
+
+
+class ProfileDriversOperator(bpy.types.Operator):
+    """Time the drivers of realized collections across a sample of frames"""
+    bl_idname = "scene.pix_profile_drivers"
+    bl_label = "Profile Drivers"
+
+    def execute(self, context):
+        scene = context.scene
+        props = scene.pix_driver_profile
+        report = profile_realized_drivers(
+            scene,
+            frame_count=props.sample_frames,
+            repeats=props.repeats,
+            measure_individual=props.measure_individual
+        )
+        store_report(scene, report)
+        python_count = len([d for d in report["drivers"] if d["kind"] == DRIVER_KIND_PYTHON])
+        self.report({'INFO'}, f"Profiled {len(report['drivers'])} drivers ({python_count} Python) in {len(report['collections'])} collections")
+        return {'FINISHED'}
+
+
+class ExportDriverProfileOperator(bpy.types.Operator):
+    """Write the last driver profile to a JSON file"""
+    bl_idname = "scene.pix_export_driver_profile"
+    bl_label = "Export Driver Profile"
+
+    filepath: bpy.props.StringProperty(subtype="FILE_PATH")
+
+    @classmethod
+    def poll(cls, context):
+        return "pix_driver_profile_report" in context.scene
+
+    def invoke(self, context, event):
+        if not self.filepath:
+            self.filepath = "driver_profile.json"
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+
+    def execute(self, context):
+        if not self.filepath:
+            self.report({'ERROR'}, "No file path provided")
+            return {'CANCELLED'}
+        report = json.loads(context.scene["pix_driver_profile_report"])
+        with open(bpy.path.abspath(self.filepath), 'w') as file:
+            json.dump(report, file, indent=4)
+        self.report({'INFO'}, f"Driver profile written to {self.filepath}")
+        return {'FINISHED'}
+
+
+class PixelDriverProfilePanel(bpy.types.Panel):
+    """Shows the cost of the drivers created by realization"""
+    bl_label = "Pixel Driver Profile"
+    bl_idname = "OBJECT_PT_pixeldriverprofile"
+    bl_space_type = 'PROPERTIES'
+    bl_region_type = 'WINDOW'
+    bl_context = "scene"
+    bl_options = {'DEFAULT_CLOSED'}
+
+    def draw(self, context):
+        layout = self.layout
+        props = context.scene.pix_driver_profile
+
+        row = layout.row()
+        row.prop(props, "sample_frames")
+        row.prop(props, "repeats")
+        layout.prop(props, "measure_individual")
+        row = layout.row()
+        row.operator("scene.pix_profile_drivers")
+        row.operator("scene.pix_export_driver_profile")
+
+        if props.frame_count:
+            layout.label(text=f"Mean frame: {props.baseline_ms:.3f} ms over {props.frame_count} frames")
+            layout.label(text="Collections")
+            layout.template_list("PIX_UL_collection_costs", "", props, "collection_costs", props, "collection_costs_index")
+            layout.label(text="Drivers")
+            layout.template_list("PIX_UL_driver_costs", "", props, "driver_costs", props, "driver_costs_index")
+
+
+classes = (PixDriverCostItem, PixCollectionCostItem, PixDriverProfileProperties,
+           PIX_UL_driver_costs, PIX_UL_collection_costs,
+           ProfileDriversOperator, ExportDriverProfileOperator, PixelDriverProfilePanel)
+
+def register():
+    for cls in classes:
+        bpy.utils.register_class(cls)
+    bpy.types.Scene.pix_driver_profile = bpy.props.PointerProperty(type=PixDriverProfileProperties)
+
+def unregister():
+    del bpy.types.Scene.pix_driver_profile
+    for cls in reversed(classes):
+        bpy.utils.unregister_class(cls)
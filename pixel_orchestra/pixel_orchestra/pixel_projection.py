@@ -0,0 +1,450 @@
+import bpy
+import os
+import shutil
+import tempfile
+import numpy as np
+from bpy.app.handlers import persistent
+from .pixel_fingerprint import id_fingerprint, material_fingerprint, node_tree_fingerprint, object_fingerprint
+
+# Object types whose change can light or shade pixels anywhere in the image, so they
+# always need a full render
+GLOBAL_TYPES = {'LIGHT', 'LIGHT_PROBE', 'CAMERA'}
+# Ray visibility through which an object shows up on other objects, outside its own bounds
+SPILL_VISIBILITY = ("visible_shadow", "visible_glossy", "visible_diffuse", "visible_transmission")
+# Pixels rendered around a region and thrown away, so the denoiser and the pixel filter
+# see the same neighbourhood at the region's edge as in a full render
+SEAM_MARGIN = 32
+
+
+def matrix_array(matrix):
+    return np.array(matrix, dtype=np.float64)
+
+
+class CameraProjection:
+    """
+    Vectorized bpy_extras.object_utils.world_to_camera_view for one camera at one
+    frame.
+
+    The camera frame comes from Camera.view_frame, which already accounts for sensor
+    fit, lens shift and the render aspect ratio, and the result is scaled by the
+    resolution percentage like the rendered image. Frame and camera transform are
+    folded into one 4x4 view-projection matrix, so projecting N points is one matrix
+    product and one division.
+    """
+
+    def __init__(self, scene, camera):
+        render = scene.render
+        scale = render.resolution_percentage / 100
+        self.width = render.resolution_x * scale
+        self.height = render.resolution_y * scale
+        world_to_camera = np.linalg.inv(matrix_array(camera.matrix_world.normalized()))
+        frame = [tuple(corner) for corner in camera.data.view_frame(scene=scene)]
+        # view_frame is top right, bottom right, bottom left, top left
+        min_x, max_x = frame[2][0], frame[1][0]
+        min_y, max_y = frame[1][1], frame[0][1]
+        frame_z = frame[0][2]
+        # Rows give x and y before the division, the depth in front of the camera, and
+        # the divisor: how far the camera frame is scaled out at the point's depth
+        if camera.data.type != 'ORTHO':
+            w = np.array([0.0, 0.0, 1.0 / frame_z, 0.0])
+            offset = np.array([0.0, 0.0, 1.0 / frame_z, 0.0])
+        else:
+            w = np.array([0.0, 0.0, 0.0, 1.0])
+            offset = w
+        projection = np.array([
+            (np.array([1.0, 0.0, 0.0, 0.0]) - min_x * offset) / (max_x - min_x),
+            (np.array([0.0, 1.0, 0.0, 0.0]) - min_y * offset) / (max_y - min_y),
+            [0.0, 0.0, -1.0, 0.0],
+            w
+        ])
+        self.matrix = projection @ world_to_camera
+
+    def to_view(self, points):
+        """
+        Projects world-space points.
+
+        Args:
+        points (np.ndarray): (N, 3) world coordinates.
+
+        Returns:
+        np.ndarray: (N, 3) of x and y from 0 to 1 across the camera frame, bottom left
+        origin, and the distance in front of the camera, negative behind it.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        projected = points @ self.matrix[:, :3].T + self.matrix[:, 3]
+        w = projected[:, 3]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x = projected[:, 0] / w
+            y = projected[:, 1] / w
+        # world_to_camera_view puts points in the camera's plane at the center
+        on_plane = w == 0
+        x[on_plane] = 0.5
+        y[on_plane] = 0.5
+        return np.stack([x, y, projected[:, 2]], axis=1)
+
+    def to_pixels(self, points):
+        """
+        Projects world-space points to pixel coordinates of the rendered image, top
+        left origin, the way project_3d_point_to_image does.
+
+        Returns:
+        np.ndarray: (N, 2) pixel x and y.
+        """
+        view = self.to_view(points)
+        return np.stack([view[:, 0] * self.width, (1 - view[:, 1]) * self.height], axis=1)
+
+
+# Projections of the current frame by camera, see camera_projection
+_projections = {}
+
+
+def camera_projection(scene, camera):
+    """
+    The projection of `camera` at the scene's current frame, built once per frame and
+    camera. The cache is cleared when the frame changes or a camera is edited.
+    """
+    key = (scene.as_pointer(), camera.as_pointer(), scene.frame_current)
+    projection = _projections.get(key)
+    if projection is None:
+        if len(_projections) > 64:
+            _projections.clear()
+        projection = _projections[key] = CameraProjection(scene, camera)
+    return projection
+
+
+def project_points_to_image(scene, camera, points):
+    return camera_projection(scene, camera).to_pixels(points)
+
+
+@persistent
+def clear_projections_on_frame_change(scene, depsgraph=None):
+    _projections.clear()
+
+
+@persistent
+def clear_projections_on_update(scene, depsgraph):
+    if not _projections:
+        return
+    for update in depsgraph.updates:
+        id_block = update.id
+        if isinstance(id_block, (bpy.types.Camera, bpy.types.Scene)) or (
+                isinstance(id_block, bpy.types.Object) and id_block.type == 'CAMERA'):
+            _projections.clear()
+            return
+
+
+def spills(obj):
+    """
+    Whether an object can be seen outside its bounding box: casting shadows, in
+    reflections, refractions or bounced light. Objects before Blender 3.0 count as
+    visible to every ray.
+    """
+    return any(getattr(obj, name, True) for name in SPILL_VISIBILITY)
+
+
+def world_bounds(objects):
+    """
+    The eight world-space corners of each object's bounding box.
+
+    Returns:
+    np.ndarray: (N, 8, 3) corners.
+    """
+    if not objects:
+        return np.zeros((0, 8, 3))
+    local = np.array([[tuple(corner) for corner in obj.bound_box] for obj in objects], dtype=np.float64)
+    matrices = np.array([matrix_array(obj.matrix_world) for obj in objects])
+    return np.einsum('nij,nkj->nki', matrices[:, :3, :3], local) + matrices[:, None, :3, 3]
+
+
+class RegionState:
+    """
+    What the region renderer compares between two frames: per visible object its
+    evaluated world bounds, material fingerprints and keyed values (custom properties
+    read by attribute shading, data, shape keys, modifiers, see object_fingerprint),
+    plus the camera, lights, world, scene and collection instancers, any change of
+    which can reach the whole image.
+    """
+
+    def __init__(self, scene, depsgraph):
+        objects = []
+        global_parts = [scene.camera.name if scene.camera else None, id_fingerprint(scene, depsgraph)]
+        for obj in scene.objects:
+            if obj.type in GLOBAL_TYPES:
+                evaluated = obj.evaluated_get(depsgraph)
+                global_parts.append((obj.name, obj.hide_render, tuple(map(tuple, obj.matrix_world)),
+                                     tuple(getattr(evaluated.data, name, None)
+                                           for name in ("energy", "lens", "shift_x", "shift_y")),
+                                     object_fingerprint(obj, depsgraph),
+                                     node_tree_fingerprint(obj.data, depsgraph) if obj.type == 'LIGHT' else 0))
+            elif obj.instance_type == 'COLLECTION' and obj.instance_collection is not None:
+                # The bounding box of an instancer doesn't cover what it instances
+                global_parts.append((obj.name, obj.hide_render, tuple(map(tuple, obj.matrix_world))))
+            elif not obj.hide_render:
+                objects.append(obj.evaluated_get(depsgraph))
+        if scene.world is not None:
+            global_parts.append(material_fingerprint(scene.world, depsgraph) if scene.world.node_tree else None)
+            global_parts.append(id_fingerprint(scene.world, depsgraph))
+        self.global_key = tuple(global_parts)
+
+        fingerprints = {}
+        self.names = [obj.name for obj in objects]
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.corners = world_bounds(objects)
+        materials = []
+        for obj in objects:
+            keys = []
+            for slot in obj.material_slots:
+                material = slot.material
+                if material is None:
+                    keys.append(0)
+                    continue
+                if material.name not in fingerprints:
+                    fingerprints[material.name] = material_fingerprint(material, depsgraph)
+                keys.append(fingerprints[material.name])
+            materials.append(tuple(keys))
+        self.materials = materials
+        self.channels = [object_fingerprint(obj.original, depsgraph) for obj in objects]
+        self.spills = [spills(obj) for obj in objects]
+
+    def changed_corners(self, previous, contained=False):
+        """
+        The bounding box corners, at both frames, of every object that differs from
+        `previous`: moved, resized, restyled, rekeyed, shown or hidden.
+
+        Args:
+        contained (bool): Trust that changes stay within the bounds and padding. Off,
+            a changed object that casts shadows or shows up in reflections or bounced
+            light on other objects needs the whole image.
+
+        Returns:
+        np.ndarray: (M, 3) world-space corners, or None when the whole image can change.
+        """
+        if self.global_key != previous.global_key:
+            return None
+        corners = []
+        for name in set(self.names) | set(previous.names):
+            current = self.index.get(name)
+            before = previous.index.get(name)
+            if current is not None and before is not None:
+                if (np.array_equal(self.corners[current], previous.corners[before])
+                        and self.materials[current] == previous.materials[before]
+                        and self.channels[current] == previous.channels[before]):
+                    continue
+            if not contained and ((current is not None and self.spills[current])
+                                  or (before is not None and previous.spills[before])):
+                return None
+            if current is not None:
+                corners.append(self.corners[current])
+            if before is not None:
+                corners.append(previous.corners[before])
+        if not corners:
+            return np.zeros((0, 3))
+        return np.concatenate(corners)
+
+
+def changed_region(scene, camera, state, previous, padding=32, threshold=0.5, contained=False):
+    """
+    The pixel rectangle that has to be rendered again for the frame described by
+    `state` to match a full render, given the image of the frame of `previous`.
+
+    Args:
+    padding (int): Pixels added on every side, for anti-aliasing, soft shadows and
+        glow reaching past the bounding boxes.
+    threshold (float): Above this fraction of the image, a full render is cheaper.
+    contained (bool): See RegionState.changed_corners.
+
+    Returns:
+    tuple: ((xmin, ymin, xmax, ymax) in pixels with a bottom left origin, xmax and
+    ymax exclusive, and the fraction of the image it covers). The rectangle is None
+    for a full render; an empty rectangle means nothing visible changed.
+    """
+    corners = state.changed_corners(previous, contained)
+    if corners is None:
+        return None, 1.0
+    projection = camera_projection(scene, camera)
+    width, height = int(round(projection.width)), int(round(projection.height))
+    if len(corners) == 0:
+        return (0, 0, 0, 0), 0.0
+    view = projection.to_view(corners)
+    if np.any(view[:, 2] <= 0) or not np.all(np.isfinite(view)):
+        # A box reaching behind the camera projects unreliably
+        return None, 1.0
+    xmin = max(0, int(np.floor(view[:, 0].min() * width)) - padding)
+    xmax = min(width, int(np.ceil(view[:, 0].max() * width)) + padding)
+    ymin = max(0, int(np.floor(view[:, 1].min() * height)) - padding)
+    ymax = min(height, int(np.ceil(view[:, 1].max() * height)) + padding)
+    if xmin >= xmax or ymin >= ymax:
+        # Everything that changed is off screen
+        return (0, 0, 0, 0), 0.0
+    coverage = (xmax - xmin) * (ymax - ymin) / float(width * height)
+    if coverage > threshold:
+        return None, coverage
+    return (xmin, ymin, xmax, ymax), coverage
+
+
+def seam_rect(scene, rect, margin=SEAM_MARGIN):
+    """
+    `rect` grown by `margin` pixels on every side, within the image.
+    """
+    render = scene.render
+    scale = render.resolution_percentage / 100
+    width, height = int(round(render.resolution_x * scale)), int(round(render.resolution_y * scale))
+    xmin, ymin, xmax, ymax = rect
+    return (max(0, xmin - margin), max(0, ymin - margin), min(width, xmax + margin), min(height, ymax + margin))
+
+
+def render_region(scene, rect, filepath):
+    """
+    Renders only `rect` of the current frame, cropped, to `filepath`.
+    """
+    render = scene.render
+    scale = render.resolution_percentage / 100
+    width, height = render.resolution_x * scale, render.resolution_y * scale
+    saved = (render.use_border, render.use_crop_to_border, render.border_min_x, render.border_min_y,
+             render.border_max_x, render.border_max_y, render.filepath, render.use_file_extension)
+    xmin, ymin, xmax, ymax = rect
+    render.use_border = True
+    render.use_crop_to_border = True
+    # Borders on exact pixel edges, so the cropped image is exactly the rectangle
+    render.border_min_x, render.border_max_x = xmin / width, xmax / width
+    render.border_min_y, render.border_max_y = ymin / height, ymax / height
+    render.filepath = filepath
+    render.use_file_extension = False
+    try:
+        bpy.ops.render.render(write_still=True)
+    finally:
+        (render.use_border, render.use_crop_to_border, render.border_min_x, render.border_min_y,
+         render.border_max_x, render.border_max_y, render.filepath, render.use_file_extension) = saved
+
+
+def image_array(image):
+    pixels = np.empty(len(image.pixels), dtype=np.float32)
+    image.pixels.foreach_get(pixels)
+    return pixels.reshape(image.size[1], image.size[0], image.channels)
+
+
+def composite_region(base_path, region_path, output_path, rect, rendered_rect=None):
+    """
+    Pastes `rect` of the cropped render in `region_path` over the image in
+    `base_path` and saves the result to `output_path` in the base image's format.
+
+    Args:
+    rendered_rect (tuple): The rectangle the cropped render covers, when it was
+        rendered larger than `rect`, see seam_rect. Defaults to `rect`.
+    """
+    rendered_rect = rendered_rect or rect
+    base = bpy.data.images.load(base_path, check_existing=False)
+    region = bpy.data.images.load(region_path, check_existing=False)
+    try:
+        pixels = image_array(base)
+        xmin, ymin, xmax, ymax = rect
+        # Image pixels run bottom up, like the border
+        left, bottom = xmin - rendered_rect[0], ymin - rendered_rect[1]
+        patch = image_array(region)[bottom:bottom + ymax - ymin, left:left + xmax - xmin]
+        height = min(patch.shape[0], pixels.shape[0] - ymin)
+        width = min(patch.shape[1], pixels.shape[1] - xmin)
+        channels = min(patch.shape[2], pixels.shape[2])
+        pixels[ymin:ymin + height, xmin:xmin + width, :channels] = patch[:height, :width, :channels]
+        base.pixels.foreach_set(pixels.ravel())
+        base.filepath_raw = output_path
+        base.save()
+    finally:
+        bpy.data.images.remove(base)
+        bpy.data.images.remove(region)
+
+
+class RegionRenderer:
+    """
+    Renders frames in order, each one only where it differs from the frame rendered
+    before it, and falls back to a full render when the change covers more than
+    `threshold` of the image or can't be bounded on screen.
+
+    Unless `contained` is set, any changed object that casts shadows or shows up in
+    reflections or bounced light also gets a full render, since its effect on other
+    objects isn't bounded by its box. Regions are rendered SEAM_MARGIN pixels larger
+    than they are pasted, so denoising and pixel filtering at the edge see the same
+    neighbourhood as in a full render. Sampling noise still differs at the seam when
+    the render isn't converged or uses a time-based seed.
+    """
+
+    def __init__(self, scene, padding=32, threshold=0.5, contained=False):
+        self.scene = scene
+        self.padding = padding
+        self.threshold = threshold
+        self.contained = contained
+        self.previous = None
+        self.current = None
+        self.previous_path = None
+        self.region_path = os.path.join(tempfile.gettempdir(),
+                                        f"pix_region_{os.getpid()}{scene.render.file_extension}")
+        self.stats = {"full": 0, "region": 0, "unchanged": 0, "coverage": 0.0}
+
+    def plan(self, depsgraph):
+        """
+        Captures the state of the current frame and decides how to render it.
+
+        Returns:
+        tuple: (rect or None, coverage), see changed_region.
+        """
+        scene = self.scene
+        state = RegionState(scene, depsgraph)
+        previous, self.current = self.previous, state
+        if (previous is None or scene.camera is None or self.previous_path is None
+                or not os.path.exists(self.previous_path)):
+            return None, 1.0
+        return changed_region(scene, scene.camera, state, previous, self.padding, self.threshold, self.contained)
+
+    def render(self, depsgraph, output_path, full_render):
+        """
+        Renders the current frame to `output_path`.
+
+        Args:
+        full_render (callable): Renders the whole frame to output_path.
+
+        Returns:
+        str: 'FULL', 'REGION' or 'UNCHANGED'.
+        """
+        rect, coverage = self.plan(depsgraph)
+        if rect is None:
+            full_render()
+            mode = 'FULL'
+        elif rect[2] <= rect[0]:
+            shutil.copyfile(self.previous_path, output_path)
+            mode = 'UNCHANGED'
+        else:
+            rendered_rect = seam_rect(self.scene, rect)
+            render_region(self.scene, rendered_rect, self.region_path)
+            composite_region(self.previous_path, self.region_path, output_path, rect, rendered_rect)
+            mode = 'REGION'
+        self.accept(output_path)
+        self.stats[mode.lower()] += 1
+        self.stats["coverage"] += coverage
+        return mode
+
+    def accept(self, output_path):
+        """
+        Makes the frame just planned the one the next frame is compared to.
+        """
+        self.previous = self.current
+        self.previous_path = output_path
+
+    def record(self, depsgraph, output_path):
+        """
+        Takes note of a frame whose image came from somewhere else, like the render
+        cache, so the next frame can be compared to it.
+        """
+        self.current = RegionState(self.scene, depsgraph)
+        self.accept(output_path)
+
+    def cleanup(self):
+        if os.path.exists(self.region_path):
+            os.remove(self.region_path)
+
+
+def register():
+    bpy.app.handlers.frame_change_post.append(clear_projections_on_frame_change)
+    bpy.app.handlers.depsgraph_update_post.append(clear_projections_on_update)
+
+def unregister():
+    bpy.app.handlers.frame_change_post.remove(clear_projections_on_frame_change)
+    bpy.app.handlers.depsgraph_update_post.remove(clear_projections_on_update)
@@ -0,0 +1,352 @@
+import bpy
+import os
+import json
+import time
+import array
+import shutil
+import hashlib
+import tempfile
+from .pixel_fingerprint import (animated_paths, data_fingerprint, fingerprint_value, geometry_digest,
+                                has_animated_channels, hash_parts, id_fingerprint, material_fingerprint,
+                                node_tree_fingerprint, object_fingerprint, pix_items)
+from .pixel_material_pool import material_signature, node_signature
+
+MANIFEST_NAME = "manifest.json"
+# Bump when what goes into a frame key changes, so old entries stop matching
+CACHE_VERSION = 2
+
+# Render settings that change the image, read as render.<name>
+RENDER_SETTINGS = (
+    "engine", "resolution_x", "resolution_y", "resolution_percentage", "pixel_aspect_x",
+    "pixel_aspect_y", "film_transparent", "use_border", "use_crop_to_border", "border_min_x",
+    "border_min_y", "border_max_x", "border_max_y", "filter_size", "use_motion_blur",
+    "motion_blur_shutter", "dither_intensity"
+)
+IMAGE_SETTINGS = ("file_format", "color_mode", "color_depth", "compression", "quality", "exr_codec")
+VIEW_SETTINGS = ("view_transform", "look", "exposure", "gamma")
+LIGHT_SETTINGS = ("type", "energy", "color", "shadow_soft_size", "spot_size", "spot_blend", "use_shadow")
+CAMERA_SETTINGS = (
+    "type", "lens", "lens_unit", "ortho_scale", "sensor_fit", "sensor_width", "sensor_height",
+    "shift_x", "shift_y", "clip_start", "clip_end"
+)
+
+
+def settings_values(struct, names):
+    return tuple((name, fingerprint_value(getattr(struct, name, None))) for name in names)
+
+
+def render_settings_hash(scene):
+    """
+    Hashes the render, output and color management settings, including the sample
+    counts of the render engine in use.
+    """
+    render = scene.render
+    parts = [
+        settings_values(render, RENDER_SETTINGS),
+        settings_values(render.image_settings, IMAGE_SETTINGS),
+        settings_values(scene.view_settings, VIEW_SETTINGS),
+        scene.display_settings.display_device
+    ]
+    if render.engine == 'CYCLES' and hasattr(scene, "cycles"):
+        parts.append(settings_values(scene.cycles, ("samples", "use_denoising", "max_bounces", "seed")))
+    elif hasattr(scene, "eevee"):
+        parts.append(settings_values(scene.eevee, ("taa_render_samples", "use_bloom", "use_ssr", "use_gtao")))
+    return hash_parts(parts)
+
+
+def world_signature(world):
+    if world is None:
+        return None
+    if not world.use_nodes or world.node_tree is None:
+        return (world.name, fingerprint_value(world.color))
+    return (world.name, tuple(node_signature(node) for node in sorted(world.node_tree.nodes, key=lambda n: n.name)))
+
+
+def static_scene_hash(scene):
+    """
+    Hashes what the frames share: render settings, the world, and every object's
+    data, geometry, light settings, modifiers and full material signatures.
+
+    Read once per render job at the first frame, so values that change over time
+    hash the same whatever frame the job starts on. What changes per frame goes into
+    FrameStateHasher.key.
+    """
+    objects = []
+    for obj in sorted(scene.objects, key=lambda o: o.name):
+        objects.append((
+            obj.name,
+            obj.type,
+            obj.hide_render,
+            data_fingerprint(obj.data),
+            geometry_digest(obj.data),
+            settings_values(obj.data, LIGHT_SETTINGS) if obj.type == 'LIGHT' else None,
+            pix_items(obj),
+            tuple((mod.name, mod.type, mod.show_render) for mod in obj.modifiers),
+            tuple(material_signature(slot.material) if slot.material else None for slot in obj.material_slots)
+        ))
+    return hash_parts((
+        CACHE_VERSION,
+        tuple(bpy.app.version[:2]),
+        render_settings_hash(scene),
+        scene.camera.name if scene.camera else None,
+        world_signature(scene.world),
+        tuple(objects)
+    ))
+
+
+class FrameStateHasher:
+    """
+    Turns the state of the scene at a frame into a cache key: the static scene hash,
+    the world matrices of all objects, the evaluated camera settings, the fingerprints
+    of the scene's materials, and the evaluated value of every F-curve and driver on
+    the objects, their data and shape keys, the materials, the world and the scene.
+
+    The last part covers keyed custom properties read by attribute shading, point cloud
+    attributes, light settings, modifier settings and world values, which the static
+    hash only sees at the first frame.
+    """
+
+    def __init__(self, scene):
+        self.scene = scene
+        original_frame = scene.frame_current
+        scene.frame_set(scene.frame_start)
+        self.static_hash = static_scene_hash(scene)
+        scene.frame_set(original_frame)
+        self.materials = sorted({slot.material.name: slot.material for obj in scene.objects
+                                 for slot in obj.material_slots if slot.material}.items())
+        self.matrices = array.array('f', bytes(len(scene.objects) * 16 * 4))
+        self.keyed_objects = sorted((obj for obj in scene.objects if has_animated_channels(obj)),
+                                    key=lambda o: o.name)
+        keyed_ids = [scene, scene.world] + [material for _, material in self.materials]
+        self.keyed_ids = [id_block for id_block in keyed_ids if id_block is not None and animated_paths(id_block)]
+        # World and light node trees, material node trees are in material_fingerprint
+        owners = {obj.data.name: obj.data for obj in scene.objects if obj.type == 'LIGHT'}
+        self.keyed_node_trees = [owner for owner in [scene.world] + [owners[name] for name in sorted(owners)]
+                                 if owner is not None and animated_paths(getattr(owner, "node_tree", None))]
+
+    def key(self, depsgraph):
+        """
+        The key of the frame the scene is at now.
+        """
+        scene = self.scene
+        digest = hashlib.blake2b(self.static_hash.encode("utf-8"), digest_size=16)
+        scene.objects.foreach_get("matrix_world", self.matrices)
+        digest.update(self.matrices.tobytes())
+        if scene.camera is not None and scene.camera.type == 'CAMERA':
+            camera = scene.camera.evaluated_get(depsgraph).data
+            digest.update(repr(settings_values(camera, CAMERA_SETTINGS)).encode("utf-8"))
+        fingerprints = array.array('Q', [material_fingerprint(material, depsgraph) for _, material in self.materials])
+        fingerprints.extend(object_fingerprint(obj, depsgraph) for obj in self.keyed_objects)
+        fingerprints.extend(id_fingerprint(id_block, depsgraph) for id_block in self.keyed_ids)
+        fingerprints.extend(node_tree_fingerprint(owner, depsgraph) for owner in self.keyed_node_trees)
+        digest.update(fingerprints.tobytes())
+        return digest.hexdigest()
+
+    def frame_keys(self, frames, context=None):
+        """
+        Sets each frame in turn and returns {frame: key}.
+        """
+        context = context or bpy.context
+        scene = self.scene
+        original_frame = scene.frame_current
+        keys = {}
+        for frame in frames:
+            scene.frame_set(frame)
+            keys[frame] = self.key(context.evaluated_depsgraph_get())
+        scene.frame_set(original_frame)
+        return keys
+
+
+def cache_directory(scene):
+    directory = scene.pix_render_cache_dir
+    if directory.startswith("//") and not bpy.data.filepath:
+        return os.path.join(tempfile.gettempdir(), "pix_render_cache")
+    return os.path.normpath(bpy.path.abspath(directory))
+
+
+class RenderCache:
+    """
+    A directory of rendered images named by the state key of the frame they show.
+
+    manifest.json records every entry's file, size and last use, and the hit and miss
+    counts over the cache's lifetime. Entries are evicted least recently used first
+    once the directory grows past its size limit.
+
+    Images are copied in and out rather than linked: Blender overwrites output files
+    in place, which would change a linked cache entry too.
+    """
+
+    def __init__(self, directory, size_limit):
+        self.directory = directory
+        self.size_limit = size_limit
+        self.manifest = self.load_manifest()
+        self.session = {"hits": 0, "misses": 0, "stored": 0, "evicted": 0}
+
+    @classmethod
+    def from_scene(cls, scene):
+        return cls(cache_directory(scene), scene.pix_render_cache_limit * 1024 * 1024)
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.directory, MANIFEST_NAME)
+
+    @property
+    def entries(self):
+        return self.manifest["entries"]
+
+    def load_manifest(self):
+        try:
+            with open(self.manifest_path, "r") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = {}
+        if not isinstance(manifest, dict) or manifest.get("version") != CACHE_VERSION:
+            manifest = {"version": CACHE_VERSION, "entries": {}, "stats": {"hits": 0, "misses": 0}}
+        return manifest
+
+    def save_manifest(self):
+        os.makedirs(self.directory, exist_ok=True)
+        temp_path = self.manifest_path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.manifest, f, indent=4)
+        os.replace(temp_path, self.manifest_path)
+
+    def count(self, name):
+        self.session[name] += 1
+        if name in self.manifest["stats"]:
+            self.manifest["stats"][name] += 1
+
+    def fetch(self, key, destination):
+        """
+        Copies the cached image for `key` to `destination`.
+
+        Returns:
+        bool: True on a hit, False if there's no usable entry.
+        """
+        entry = self.entries.get(key)
+        if entry is not None:
+            path = os.path.join(self.directory, entry["file"])
+            if os.path.exists(path):
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                shutil.copyfile(path, destination)
+                entry["last_used"] = time.time()
+                entry["hits"] = entry.get("hits", 0) + 1
+                self.count("hits")
+                return True
+            print(f"Render cache file missing for {key}, dropping the entry")
+            del self.entries[key]
+        self.count("misses")
+        return False
+
+    def store(self, key, source):
+        """
+        Copies a rendered image into the cache under `key`.
+        """
+        if not os.path.exists(source):
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        name = key + os.path.splitext(source)[1]
+        path = os.path.join(self.directory, name)
+        temp_path = path + ".tmp"
+        shutil.copyfile(source, temp_path)
+        os.replace(temp_path, path)
+        self.entries[key] = {
+            "file": name,
+            "size": os.path.getsize(path),
+            "created": time.time(),
+            "last_used": time.time(),
+            "hits": 0
+        }
+        self.session["stored"] += 1
+        self.session["evicted"] += self.evict(keep=key)
+        return path
+
+    def total_size(self):
+        return sum(entry.get("size", 0) for entry in self.entries.values())
+
+    def evict(self, keep=None):
+        """
+        Removes the least recently used entries until the cache fits its size limit.
+
+        Returns:
+        int: The number of entries removed.
+        """
+        removed = 0
+        total = self.total_size()
+        for key, entry in sorted(self.entries.items(), key=lambda item: item[1].get("last_used", 0)):
+            if total <= self.size_limit:
+                break
+            if key == keep:
+                continue
+            try:
+                os.remove(os.path.join(self.directory, entry["file"]))
+            except OSError:
+                pass
+            total -= entry.get("size", 0)
+            del self.entries[key]
+            removed += 1
+        return removed
+
+    def clear(self):
+        for entry in self.entries.values():
+            try:
+                os.remove(os.path.join(self.directory, entry["file"]))
+            except OSError:
+                pass
+        self.entries.clear()
+        self.save_manifest()
+
+    def summary(self):
+        """
+        Hit and miss counts of this session and of the cache's lifetime.
+        """
+        lifetime = self.manifest["stats"]
+        looked_up = lifetime["hits"] + lifetime["misses"]
+        return {
+            "session": dict(self.session),
+            "hits": lifetime["hits"],
+            "misses": lifetime["misses"],
+            "hit_rate": lifetime["hits"] / looked_up if looked_up else 0.0,
+            "entries": len(self.entries),
+            "size_mb": self.total_size() / (1024 * 1024)
+        }
+
+
+class ClearRenderCacheOperator(bpy.types.Operator):
+    """Remove every image from the render cache"""
+    bl_idname = "scene.pix_clear_render_cache"
+    bl_label = "Clear Render Cache"
+
+    def execute(self, context):
+        cache = RenderCache.from_scene(context.scene)
+        summary = cache.summary()
+        cache.clear()
+        self.report({'INFO'}, f"Removed {summary['entries']} images, {summary['size_mb']:.1f} MB; "
+                              f"{summary['hits']} hits and {summary['misses']} misses so far")
+        return {'FINISHED'}
+
+
+def register():
+    bpy.utils.register_class(ClearRenderCacheOperator)
+    bpy.types.Scene.pix_use_render_cache = bpy.props.BoolProperty(
+        name="Render cache",
+        description="Copy frames whose scene state was rendered before instead of rendering them again",
+        default=False
+    )
+    bpy.types.Scene.pix_render_cache_dir = bpy.props.StringProperty(
+        name="Render cache directory",
+        subtype='DIR_PATH',
+        default="//pix_render_cache/"
+    )
+    bpy.types.Scene.pix_render_cache_limit = bpy.props.IntProperty(
+        name="Render cache size (MB)",
+        description="Least recently used images are removed past this size",
+        default=4096,
+        min=1
+    )
+
+def unregister():
+    bpy.utils.unregister_class(ClearRenderCacheOperator)
+    del bpy.types.Scene.pix_use_render_cache
+    del bpy.types.Scene.pix_render_cache_dir
+    del bpy.types.Scene.pix_render_cache_limit
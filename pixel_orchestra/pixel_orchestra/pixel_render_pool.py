@@ -0,0 +1,211 @@
+import os
+import json
+import time
+import queue
+import threading
+import subprocess
+from collections import deque
+
+# Runs frames through several headless Blender processes. Plain Python, no bpy, so it
+# can drive renders from outside Blender too.
+
+FRAME_MARKER = "PIX_FRAME "
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pixel_render_worker.py")
+
+
+def chunk_frames(frames, chunk_size):
+    """
+    Splits a list of frames into consecutive chunks of at most `chunk_size`.
+    """
+    chunk_size = max(1, chunk_size)
+    return [list(frames[i:i + chunk_size]) for i in range(0, len(frames), chunk_size)]
+
+
+def threads_per_worker(workers, threads=0):
+    """
+    The thread count each worker gets: `threads` if set, otherwise the machine's cores
+    split evenly between the workers.
+    """
+    if threads > 0:
+        return threads
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+
+def worker_command(blender, blend_file, frames, threads, extra_args=()):
+    """
+    The command line of one worker rendering `frames` of `blend_file`.
+    """
+    return [blender, "-b", blend_file, "-t", str(threads), "--python", WORKER_SCRIPT, "--",
+            "--frames", ",".join(str(frame) for frame in frames)] + list(extra_args)
+
+
+def queue_worker_command(blender, blend_file, directory, worker_id=None, threads=0, extra_args=()):
+    """
+    The command line of one worker taking frames from the render queue in `directory`.
+    """
+    command = [blender, "-b", blend_file]
+    if threads > 0:
+        command += ["-t", str(threads)]
+    command += ["--python", WORKER_SCRIPT, "--", "--queue", directory]
+    if worker_id:
+        command += ["--worker-id", worker_id]
+    return command + list(extra_args)
+
+
+class WorkerProcess:
+    """
+    One running worker and the frames it reported so far. Its output is read on a
+    thread so polling never blocks.
+    """
+
+    def __init__(self, worker_id, chunk, attempt, command):
+        self.worker_id = worker_id
+        self.chunk = chunk
+        self.attempt = attempt
+        self.started = time.time()
+        self.done = {}
+        self.output = deque(maxlen=50)
+        self.lines = queue.Queue()
+        self.process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                        universal_newlines=True, bufsize=1)
+        self.reader = threading.Thread(target=self.read, daemon=True)
+        self.reader.start()
+
+    def read(self):
+        for line in self.process.stdout:
+            self.lines.put(line)
+        self.process.stdout.close()
+
+    def collect(self):
+        """
+        Parses the lines read since the last call. Returns the new frame records.
+        """
+        records = []
+        while True:
+            try:
+                line = self.lines.get_nowait()
+            except queue.Empty:
+                break
+            self.output.append(line.rstrip())
+            if line.startswith(FRAME_MARKER):
+                try:
+                    record = json.loads(line[len(FRAME_MARKER):])
+                except ValueError:
+                    continue
+                record["worker"] = self.worker_id
+                record["attempt"] = self.attempt
+                self.done[record["frame"]] = record
+                records.append(record)
+        return records
+
+    def finished(self):
+        return self.process.poll() is not None and not self.reader.is_alive()
+
+
+class RenderPool:
+    """
+    Hands chunks of frames to up to `workers` Blender processes at a time.
+
+    A chunk whose worker exits before reporting all of its frames goes back on the queue
+    with only the missing frames, up to `retries` times. Every worker renders the same
+    saved .blend with the same settings, so the images match a single-process render.
+
+    Call poll() regularly (from a modal timer for instance) or run() to block until done.
+    """
+
+    def __init__(self, blender, blend_file, frames, workers=4, threads=0, chunk_size=8, retries=2,
+                 extra_args=()):
+        self.blender = blender
+        self.blend_file = blend_file
+        self.workers = max(1, workers)
+        self.threads = threads_per_worker(self.workers, threads)
+        self.retries = retries
+        self.extra_args = list(extra_args)
+        self.pending = deque((chunk, 0) for chunk in chunk_frames(list(frames), chunk_size))
+        self.running = []
+        self.records = {}
+        self.failed = {}
+        self.total = len(frames)
+        self.started = time.time()
+        self.finished_at = None
+        self.next_worker_id = 0
+
+    @property
+    def done(self):
+        return not self.pending and not self.running
+
+    def start_workers(self):
+        while self.pending and len(self.running) < self.workers:
+            chunk, attempt = self.pending.popleft()
+            command = worker_command(self.blender, self.blend_file, chunk, self.threads, self.extra_args)
+            self.running.append(WorkerProcess(self.next_worker_id, chunk, attempt, command))
+            self.next_worker_id += 1
+
+    def poll(self):
+        """
+        Collects output, retires finished workers, requeues what they missed and starts
+        new workers.
+
+        Returns:
+        bool: True once every frame is rendered or has run out of retries.
+        """
+        for worker in list(self.running):
+            # Checked before collecting, so a finished worker's last lines are already queued
+            finished = worker.finished()
+            for record in worker.collect():
+                self.records[record["frame"]] = record
+            if not finished:
+                continue
+            self.running.remove(worker)
+            missing = [frame for frame in worker.chunk if frame not in worker.done]
+            if not missing:
+                continue
+            if worker.attempt < self.retries:
+                print(f"worker {worker.worker_id} exited with {worker.process.returncode}, "
+                      f"retrying {len(missing)} frames")
+                self.pending.append((missing, worker.attempt + 1))
+            else:
+                for frame in missing:
+                    self.failed[frame] = list(worker.output)[-10:]
+        self.start_workers()
+        if self.done and self.finished_at is None:
+            self.finished_at = time.time()
+        return self.done
+
+    def run(self, interval=0.5):
+        self.start_workers()
+        while not self.poll():
+            time.sleep(interval)
+        return self.report()
+
+    def terminate(self):
+        for worker in self.running:
+            worker.process.terminate()
+        self.pending.clear()
+
+    @property
+    def progress(self):
+        return len(self.records), self.total
+
+    def report(self):
+        """
+        Per-frame timings and a summary of the run.
+        """
+        seconds = [record.get("seconds", 0.0) for record in self.records.values()]
+        elapsed = (self.finished_at or time.time()) - self.started
+        return {
+            "workers": self.workers,
+            "threads_per_worker": self.threads,
+            "frames_rendered": len(self.records),
+            "frames_failed": sorted(self.failed),
+            "wall_seconds": elapsed,
+            "render_seconds": sum(seconds),
+            "mean_frame_seconds": sum(seconds) / len(seconds) if seconds else 0.0,
+            "frames": {str(frame): self.records[frame] for frame in sorted(self.records)},
+            "failures": {str(frame): output for frame, output in self.failed.items()}
+        }
+
+    def write_report(self, path):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=4)
+        return path
@@ -0,0 +1,536 @@
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+
+# A render queue that lives in a directory on shared storage. Workers on any machine that
+# can see the directory claim frames, render them and record them, without a manager.
+# Plain Python, no bpy and no imports from the add-on, so render workers can import it
+# on its own. Run it as a script to simulate several local workers on a temp directory:
+#   python pixel_render_queue.py --workers 4 --frames 40
+#
+# Layout:
+#   queue.json       the frames to render and the .blend they come from
+#   locks/<frame>    a claimed frame, created with O_EXCL; its mtime is the heartbeat
+#   done/<frame>     a finished frame
+#   parked/<frame>   a frame that failed too often, left out until the queue is created again
+#   ledger.jsonl     one line per claim, reclaim, failure and completion
+
+QUEUE_NAME = "queue.json"
+LEDGER_NAME = "ledger.jsonl"
+FINALIZED_NAME = "finalized"
+LOCKS_DIR = "locks"
+DONE_DIR = "done"
+PARKED_DIR = "parked"
+# A claim whose heartbeat is older than this belongs to a dead worker. Has to be well
+# above the heartbeat interval plus the clock difference between machines.
+STALE_SECONDS = 300
+HEARTBEAT_SECONDS = 30
+# Failed renders of one frame, over all workers, before it is parked
+MAX_ATTEMPTS = 3
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def write_json_atomic(path, data):
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(data, f, indent=4)
+    os.replace(temp_path, path)
+
+
+def read_json(path):
+    """
+    Returns the JSON in a file, or None if the file is missing or not written yet.
+    """
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class Claim:
+    """
+    A frame a worker holds the lock of. The token tells this claim apart from a later
+    claim of the same frame by another worker.
+    """
+
+    def __init__(self, queue, frame, worker_id, token):
+        self.queue = queue
+        self.frame = frame
+        self.worker_id = worker_id
+        self.token = token
+        self.claimed = time.time()
+
+    @property
+    def lock_path(self):
+        return self.queue.lock_path(self.frame)
+
+    def owned(self):
+        lock = read_json(self.lock_path)
+        return lock is not None and lock.get("token") == self.token
+
+    def heartbeat(self):
+        """
+        Touches the lock file. Returns False if the claim was reclaimed meanwhile.
+        """
+        if not self.owned():
+            return False
+        try:
+            os.utime(self.lock_path)
+        except OSError:
+            return False
+        return True
+
+    def release(self):
+        if self.owned():
+            try:
+                os.remove(self.lock_path)
+            except OSError:
+                pass
+
+
+class Heartbeat:
+    """
+    Keeps a claim alive from a background thread while the frame renders. Use as a
+    context manager around the render.
+
+    The thread only runs while the render releases the GIL, which
+    bpy.ops.render.render doesn't; Blender workers call beat() from a render_stats
+    handler as well, see RenderQueue.heartbeat.
+    """
+
+    def __init__(self, claim, interval=HEARTBEAT_SECONDS):
+        self.claim = claim
+        self.interval = interval
+        self.last_beat = time.time()
+        self.lost = False
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def beat(self):
+        """
+        Touches the lock once `interval` has passed since the last touch. Cheap enough
+        to call on every render progress update.
+        """
+        if self.lost or time.time() - self.last_beat < self.interval:
+            return
+        with self.lock:
+            self.last_beat = time.time()
+            if not self.claim.heartbeat():
+                self.lost = True
+                print(f"lost the claim on frame {self.claim.frame}")
+
+    def run(self):
+        while not self.stopped.wait(self.interval) and not self.lost:
+            self.beat()
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stopped.set()
+        self.thread.join()
+
+
+class RenderQueue:
+    """
+    The frames of a frame plan shared between workers through a directory.
+
+    Claims are lock files created with O_CREAT | O_EXCL, which exactly one worker can
+    win, also over NFS. A worker refreshes the mtime of its lock while it renders; a lock
+    that hasn't been touched for `stale_seconds` is reclaimed by renaming it away, which
+    again only one worker can do.
+    """
+
+    def __init__(self, directory, stale_seconds=STALE_SECONDS):
+        self.directory = directory
+        self.stale_seconds = stale_seconds
+        # The Heartbeat of the frame work() is rendering, None between frames
+        self.heartbeat = None
+        self.data = read_json(os.path.join(directory, QUEUE_NAME))
+        if self.data is None:
+            raise FileNotFoundError(f"No render queue in {directory}")
+        self.frames = [int(frame) for frame in self.data["frames"]]
+
+    @classmethod
+    def create(cls, directory, frames, blend_file="", plan=None, stale_seconds=STALE_SECONDS,
+               max_attempts=MAX_ATTEMPTS):
+        """
+        Writes a new queue. Claims and completions of an earlier queue in the same
+        directory are kept, so a queue can be created again to resume it. Parked frames
+        get another `max_attempts` tries, and the held frames are filled again once the
+        resumed queue is complete.
+
+        Args:
+        directory (str): The shared directory.
+        frames (list): The frames to render.
+        blend_file (str): The .blend the workers should open, for reference.
+        plan (dict): The frame plan the frames come from (FramePlan.to_dict()), so
+            workers can fill the held frames once everything is rendered.
+        max_attempts (int): Failed renders of a frame before it is parked.
+        """
+        os.makedirs(os.path.join(directory, LOCKS_DIR), exist_ok=True)
+        os.makedirs(os.path.join(directory, DONE_DIR), exist_ok=True)
+        parked_directory = os.path.join(directory, PARKED_DIR)
+        os.makedirs(parked_directory, exist_ok=True)
+        for name in os.listdir(parked_directory):
+            os.remove(os.path.join(parked_directory, name))
+        try:
+            os.remove(os.path.join(directory, FINALIZED_NAME))
+        except FileNotFoundError:
+            pass
+        write_json_atomic(os.path.join(directory, QUEUE_NAME), {
+            "frames": sorted(int(frame) for frame in frames),
+            "blend_file": blend_file,
+            "plan": plan,
+            "max_attempts": max_attempts,
+            "created": time.time()
+        })
+        return cls(directory, stale_seconds)
+
+    @property
+    def blend_file(self):
+        return self.data.get("blend_file", "")
+
+    @property
+    def plan(self):
+        return self.data.get("plan")
+
+    @property
+    def max_attempts(self):
+        return self.data.get("max_attempts", MAX_ATTEMPTS)
+
+    def lock_path(self, frame):
+        return os.path.join(self.directory, LOCKS_DIR, str(frame))
+
+    def done_path(self, frame):
+        return os.path.join(self.directory, DONE_DIR, str(frame))
+
+    def parked_path(self, frame):
+        return os.path.join(self.directory, PARKED_DIR, str(frame))
+
+    def log(self, event, frame, worker_id, **fields):
+        record = dict(event=event, frame=frame, worker=worker_id, time=time.time(), **fields)
+        line = (json.dumps(record) + "\n").encode("utf-8")
+        # One write of one short line with O_APPEND, so lines of concurrent workers don't mix
+        fd = os.open(os.path.join(self.directory, LEDGER_NAME), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+
+    def ledger(self):
+        records = []
+        try:
+            with open(os.path.join(self.directory, LEDGER_NAME), "r") as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except OSError:
+            pass
+        return records
+
+    def completed(self):
+        return {int(name) for name in os.listdir(os.path.join(self.directory, DONE_DIR)) if name.lstrip("-").isdigit()}
+
+    def parked(self):
+        try:
+            names = os.listdir(os.path.join(self.directory, PARKED_DIR))
+        except FileNotFoundError:
+            return set()
+        return {int(name) for name in names if name.lstrip("-").isdigit()}
+
+    def failures(self, frame):
+        """
+        Failed renders of a frame since the queue was created.
+        """
+        created = self.data.get("created", 0)
+        return len([record for record in self.ledger()
+                    if record.get("event") == "failed" and record.get("frame") == frame
+                    and record.get("time", 0) >= created])
+
+    def remaining(self):
+        """
+        The frames nobody has finished yet, not counting parked ones.
+        """
+        done = self.completed() | self.parked()
+        return [frame for frame in self.frames if frame not in done]
+
+    def is_complete(self):
+        return not self.remaining()
+
+    def lock_age(self, frame):
+        """
+        Seconds since the lock of a frame was last touched, or None if it isn't locked.
+        """
+        try:
+            return time.time() - os.stat(self.lock_path(frame)).st_mtime
+        except OSError:
+            return None
+
+    def try_lock(self, frame, worker_id):
+        token = uuid.uuid4().hex
+        try:
+            fd = os.open(self.lock_path(frame), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            return None
+        try:
+            os.write(fd, json.dumps({"worker": worker_id, "token": token, "claimed": time.time()}).encode("utf-8"))
+        finally:
+            os.close(fd)
+        return Claim(self, frame, worker_id, token)
+
+    def reclaim(self, frame, worker_id):
+        """
+        Removes the lock of a frame if its heartbeat is stale.
+
+        Returns:
+        bool: True if this worker removed it.
+        """
+        path = self.lock_path(frame)
+        stale = read_json(path) or {}
+        age = self.lock_age(frame)
+        if age is None or age < self.stale_seconds:
+            return False
+        moved = f"{path}.{uuid.uuid4().hex}.stale"
+        try:
+            os.rename(path, moved)
+        except OSError:
+            # Another worker got there first
+            return False
+        if (read_json(moved) or {}).get("token") != stale.get("token"):
+            # The stale lock was replaced between reading and renaming it: this is a
+            # fresh claim, put it back unless the frame has been locked again since
+            try:
+                os.link(moved, path)
+            except OSError:
+                pass
+            os.remove(moved)
+            return False
+        os.remove(moved)
+        self.log("reclaimed", frame, worker_id, previous=stale.get("worker"), age=age)
+        print(f"reclaimed frame {frame} from {stale.get('worker')}, silent for {age:.0f}s")
+        return True
+
+    def claim(self, worker_id):
+        """
+        Claims the first frame nobody has finished or holds, taking over frames of
+        dead workers.
+
+        Returns:
+        Claim: The claim, or None if every remaining frame is held by a live worker.
+        """
+        done = self.completed() | self.parked()
+        for frame in self.frames:
+            if frame in done:
+                continue
+            claim = self.try_lock(frame, worker_id)
+            if claim is None and self.reclaim(frame, worker_id):
+                claim = self.try_lock(frame, worker_id)
+            if claim is None:
+                continue
+            if os.path.exists(self.done_path(frame)) or os.path.exists(self.parked_path(frame)):
+                # Finished or parked between listing and locking
+                claim.release()
+                continue
+            self.log("claimed", frame, worker_id)
+            return claim
+        return None
+
+    def complete(self, claim, **fields):
+        """
+        Records a rendered frame and releases its lock.
+        """
+        seconds = time.time() - claim.claimed
+        write_json_atomic(self.done_path(claim.frame), dict(worker=claim.worker_id, seconds=seconds, **fields))
+        self.log("completed", claim.frame, claim.worker_id, seconds=seconds, **fields)
+        claim.release()
+
+    def fail(self, claim, error):
+        """
+        Records a failed render and releases the lock, so another worker can try the
+        frame. After max_attempts failures the frame is parked instead.
+
+        Returns:
+        bool: True if the frame was parked.
+        """
+        self.log("failed", claim.frame, claim.worker_id, error=error)
+        attempts = self.failures(claim.frame)
+        parked = attempts >= self.max_attempts
+        if parked:
+            write_json_atomic(self.parked_path(claim.frame), {"attempts": attempts, "error": error})
+            self.log("parked", claim.frame, claim.worker_id, attempts=attempts)
+            print(f"parked frame {claim.frame} after {attempts} failed attempts: {error}")
+        claim.release()
+        return parked
+
+    def try_finalize(self, worker_id):
+        """
+        Lets exactly one worker do the work that follows the last frame. Parked frames
+        count as done, their files are missing from the output.
+
+        Returns:
+        bool: True for the one worker that should finalize.
+        """
+        if not self.is_complete():
+            return False
+        try:
+            fd = os.open(os.path.join(self.directory, FINALIZED_NAME), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            return False
+        os.write(fd, worker_id.encode("utf-8"))
+        os.close(fd)
+        self.log("finalized", None, worker_id)
+        return True
+
+    def status(self):
+        completed = self.completed()
+        parked = self.parked() - completed
+        locked = {}
+        for frame in self.frames:
+            if frame in completed or frame in parked:
+                continue
+            age = self.lock_age(frame)
+            if age is not None:
+                locked[frame] = age
+        return {
+            "frames": len(self.frames),
+            "completed": len(completed & set(self.frames)),
+            "parked": len(parked & set(self.frames)),
+            "claimed": len([age for age in locked.values() if age < self.stale_seconds]),
+            "stale": len([age for age in locked.values() if age >= self.stale_seconds])
+        }
+
+    def work(self, render, worker_id=None, poll_seconds=5.0, heartbeat_seconds=HEARTBEAT_SECONDS):
+        """
+        Claims and renders frames until the queue is complete.
+
+        When every remaining frame is held by another worker, waits and looks again, so
+        frames of a worker that dies are picked up by the ones still running. A frame
+        that fails to render is logged and handed out again, up to max_attempts times
+        over all workers, then parked; the worker carries on with the next frame.
+
+        Args:
+        render (callable): Renders a frame. Returns a dict of fields for the ledger.
+        worker_id (str): Defaults to host name and process id.
+
+        Returns:
+        list: The frames this worker rendered.
+        """
+        worker_id = worker_id or default_worker_id()
+        rendered = []
+        while True:
+            claim = self.claim(worker_id)
+            if claim is None:
+                if self.is_complete():
+                    return rendered
+                time.sleep(poll_seconds)
+                continue
+            try:
+                with Heartbeat(claim, heartbeat_seconds) as self.heartbeat:
+                    fields = render(claim.frame) or {}
+            except Exception as e:
+                print(f"frame {claim.frame} failed: {e}")
+                self.fail(claim, str(e))
+                continue
+            finally:
+                self.heartbeat = None
+            self.complete(claim, **fields)
+            rendered.append(claim.frame)
+
+    def beat(self):
+        """
+        Keeps the claim of the frame being rendered alive, for render progress
+        callbacks that run while the heartbeat thread can't.
+        """
+        heartbeat = self.heartbeat
+        if heartbeat is not None:
+            heartbeat.beat()
+
+
+def simulate_worker(directory, seconds, fail_frame):
+    """
+    One simulated worker: takes frames from the queue in `directory` and "renders"
+    each by sleeping, failing every time on `fail_frame`.
+    """
+    queue = RenderQueue(directory)
+
+    def render(frame):
+        time.sleep(seconds * random.uniform(0.5, 1.5))
+        if frame == fail_frame:
+            raise RuntimeError("simulated failure")
+        return {"pid": os.getpid()}
+
+    queue.work(render, poll_seconds=seconds, heartbeat_seconds=seconds)
+
+
+def simulate(workers=4, frames=40, seconds=0.05, fail_frame=None):
+    """
+    Runs `workers` worker processes on a queue of `frames` frames in a temp directory
+    and checks the ledger: every frame completed exactly once, except `fail_frame`,
+    which has to end up parked after MAX_ATTEMPTS failures. The directory is removed
+    when it did, and kept to look at when it didn't.
+
+    Returns:
+    list: Problems found, empty when the queue behaved.
+    """
+    directory = tempfile.mkdtemp(prefix="pix_render_queue_")
+    queue = RenderQueue.create(directory, range(1, frames + 1))
+    processes = [subprocess.Popen([sys.executable, os.path.abspath(__file__), "--worker", directory,
+                                   "--seconds", str(seconds), "--fail-frame", str(fail_frame or 0)])
+                 for _ in range(workers)]
+    for process in processes:
+        process.wait()
+    completions = {}
+    for record in queue.ledger():
+        if record.get("event") == "completed":
+            completions.setdefault(record["frame"], []).append(record.get("pid"))
+    problems = []
+    for frame in queue.frames:
+        count = len(completions.get(frame, []))
+        expected = 0 if frame == fail_frame else 1
+        if count != expected:
+            problems.append(f"frame {frame} completed {count} times, expected {expected}")
+    if fail_frame and queue.parked() != {fail_frame}:
+        problems.append(f"parked {sorted(queue.parked())}, expected [{fail_frame}]")
+    if not queue.is_complete():
+        problems.append(f"{len(queue.remaining())} frames remaining")
+    workers_used = {pid for pids in completions.values() for pid in pids}
+    print(f"{len(workers_used)} of {workers} workers rendered {sum(map(len, completions.values()))} frames "
+          f"in {directory}")
+    if not problems:
+        shutil.rmtree(directory, ignore_errors=True)
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate local render queue workers")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--frames", type=int, default=40)
+    parser.add_argument("--seconds", type=float, default=0.05, help="Simulated render time per frame")
+    parser.add_argument("--fail-frame", type=int, default=0, help="A frame that always fails, 0 for none")
+    parser.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        simulate_worker(args.worker, args.seconds, args.fail_frame)
+        sys.exit(0)
+    problems = simulate(args.workers, args.frames, args.seconds, args.fail_frame or None)
+    for problem in problems:
+        print(problem)
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,129 @@
+import bpy
+import os
+import sys
+import json
+import time
+import argparse
+
+# Render worker started by pixel_render_pool:
+#   blender -b file.blend -t THREADS --python pixel_render_worker.py -- --frames 1,2,3
+# or on any machine that sees a shared render queue:
+#   blender -b file.blend --python pixel_render_worker.py -- --queue /shared/queue
+# Every frame goes to the path render.frame_path gives it, the same file an in-process
+# render writes, and is reported on stdout as a PIX_FRAME line. Workers open a copy of
+# the .blend saved elsewhere, so a relative output path is passed in with --output
+# as the absolute path it has in the original file.
+
+# Run as a script, not as part of the add-on, so its plain Python modules are imported
+# from next to this file
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from pixel_frame_plan import FramePlan, PIX_FRAME_PLAN, fill_holds, write_manifest  # noqa: E402
+from pixel_render_queue import RenderQueue, STALE_SECONDS, HEARTBEAT_SECONDS, default_worker_id  # noqa: E402
+
+FRAME_MARKER = "PIX_FRAME "
+
+
+def parse_args(argv):
+    argv = argv[argv.index("--") + 1:] if "--" in argv else []
+    parser = argparse.ArgumentParser(description="Render frames of the open .blend")
+    frames = parser.add_mutually_exclusive_group(required=True)
+    frames.add_argument("--frames", help="Comma separated frame numbers")
+    frames.add_argument("--queue", help="Directory of a shared render queue to take frames from")
+    parser.add_argument("--output", default=None,
+                        help="Absolute render output path, replaces the file's own render.filepath")
+    parser.add_argument("--worker-id", default=None, help="Name in the queue ledger, host-pid by default")
+    parser.add_argument("--stale-seconds", type=float, default=STALE_SECONDS,
+                        help="Silence after which another worker's frame is taken over")
+    parser.add_argument("--heartbeat-seconds", type=float, default=HEARTBEAT_SECONDS)
+    parser.add_argument("--poll-seconds", type=float, default=5.0,
+                        help="Wait between looks at the queue when every frame is taken")
+    return parser.parse_args(argv)
+
+
+def render_frame(scene, frame):
+    """
+    Renders one frame to its output file and returns the time it took.
+    """
+    started = time.time()
+    scene.frame_set(frame)
+    path = bpy.path.abspath(scene.render.frame_path(frame=frame))
+    filepath = scene.render.filepath
+    use_file_extension = scene.render.use_file_extension
+    scene.render.filepath = path
+    scene.render.use_file_extension = False
+    try:
+        bpy.ops.render.render(write_still=True)
+    finally:
+        scene.render.filepath = filepath
+        scene.render.use_file_extension = use_file_extension
+    return path, time.time() - started
+
+
+def report_frame(frame, path, seconds):
+    print(FRAME_MARKER + json.dumps({"frame": frame, "seconds": seconds, "path": path}), flush=True)
+
+
+def open_queue(scene, args):
+    """
+    Opens the queue in args.queue, creating it from the scene's frame plan if this is
+    the first worker to arrive.
+    """
+    try:
+        return RenderQueue(args.queue, args.stale_seconds)
+    except FileNotFoundError:
+        pass
+    if PIX_FRAME_PLAN not in scene:
+        raise RuntimeError(f"No render queue in {args.queue} and no frame plan in {bpy.data.filepath}")
+    plan = FramePlan.from_dict(json.loads(scene[PIX_FRAME_PLAN]))
+    return RenderQueue.create(args.queue, plan.render_frames, bpy.data.filepath, plan.to_dict(),
+                              args.stale_seconds)
+
+
+def work_queue(scene, args):
+    queue = open_queue(scene, args)
+    worker_id = args.worker_id or default_worker_id()
+
+    def render(frame):
+        path, seconds = render_frame(scene, frame)
+        report_frame(frame, path, seconds)
+        return {"path": path, "render_seconds": seconds}
+
+    # The render holds the GIL, so the heartbeat thread stalls until it returns; render
+    # progress updates keep the claim alive instead
+    def beat(*args):
+        queue.beat()
+
+    bpy.app.handlers.render_stats.append(beat)
+    bpy.app.handlers.render_post.append(beat)
+    try:
+        rendered = queue.work(render, worker_id, args.poll_seconds, args.heartbeat_seconds)
+    finally:
+        bpy.app.handlers.render_stats.remove(beat)
+        bpy.app.handlers.render_post.remove(beat)
+    print(f"rendered {len(rendered)} frames from {args.queue}")
+    parked = sorted(queue.parked())
+    if parked:
+        print(f"parked after {queue.max_attempts} failed attempts: {', '.join(str(frame) for frame in parked)}")
+    if queue.plan and queue.try_finalize(worker_id):
+        plan = FramePlan.from_dict(queue.plan)
+        frame_path = lambda frame: bpy.path.abspath(scene.render.frame_path(frame=frame))
+        linked, copied, missing = fill_holds(plan, frame_path)
+        write_manifest(plan, frame_path)
+        print(f"filled {linked + copied} held frames, {missing} missing")
+
+
+def main():
+    args = parse_args(sys.argv)
+    scene = bpy.context.scene
+    if args.output:
+        scene.render.filepath = args.output
+    if args.queue:
+        work_queue(scene, args)
+        return
+    for frame in [int(frame) for frame in args.frames.split(",") if frame]:
+        path, seconds = render_frame(scene, frame)
+        report_frame(frame, path, seconds)
+
+
+if __name__ == "__main__":
+    main()
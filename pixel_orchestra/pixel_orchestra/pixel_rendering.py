@@ -1,57 +1,346 @@
 import bpy
+import os
+import subprocess
+from .pixel_frame_analysis import analytic_changed_frames
+from .pixel_frame_plan import fill_holds, load_frame_plan, write_manifest
+from .pixel_snapshots import record_snapshots, snapshot_directory
+from .pixel_fingerprint import material_fingerprint
+from .pixel_render_pool import RenderPool, queue_worker_command
+from .pixel_render_queue import RenderQueue
+from .pixel_render_cache import FrameStateHasher, RenderCache
+from .pixel_projection import RegionRenderer
 
 
 class RENDER_OT_SpecificFramesModal(bpy.types.Operator):
-    """Render Specific Frames in Modal Operator"""
+    """Render the frames of the scene's frame plan, then fill the held frames with links to them"""
     bl_idname = "render.specific_frames_modal"
     bl_label = "Render Specific Frames (Modal)"
     bl_options = {'REGISTER'}
 
     _timer = None
-    frames_to_render = [10, 20, 30]  # Replace with your frames list
+    frames_to_render = []
     frame_index = 0
 
     def modal(self, context, event):
+        if event.type == 'ESC':
+            self.finish(context)
+            self.report({'WARNING'}, f"Stopped after {self.frame_index} of {len(self.frames_to_render)} frames")
+            return {'CANCELLED'}
         if event.type == 'TIMER':
             if self.frame_index < len(self.frames_to_render):
                 frame = self.frames_to_render[self.frame_index]
-                context.scene.frame_set(frame)
-                bpy.ops.render.render(write_still=True)  # Render the frame
+                scene = context.scene
+                scene.frame_set(frame)
+                depsgraph = context.evaluated_depsgraph_get()
+                output = self.frame_path(frame)
+                key = self.hasher.key(depsgraph) if self.cache is not None else None
+                if key is not None and self.cache.fetch(key, output):
+                    if self.region is not None:
+                        self.region.record(depsgraph, output)
+                else:
+                    if self.region is not None:
+                        mode = self.region.render(depsgraph, output, lambda: self.render_full(scene, frame))
+                        print(f"frame {frame}: {mode.lower()}")
+                    else:
+                        self.render_full(scene, frame)
+                    if key is not None:
+                        self.cache.store(key, output)
                 self.frame_index += 1
             else:
                 self.finish(context)
+                linked, copied, missing = fill_holds(self.plan, self.frame_path)
+                manifest = write_manifest(self.plan, self.frame_path)
+                print(f"manifest written to {manifest}")
+                cached = 0
+                if self.cache is not None:
+                    self.cache.save_manifest()
+                    cached = self.cache.session["hits"]
+                    print(f"render cache: {self.cache.summary()}")
+                if self.region is not None:
+                    print(f"region renders: {self.region.stats}")
+                self.report({'INFO'}, f"Rendered {len(self.frames_to_render) - cached} frames, "
+                                      f"{cached} from the render cache, "
+                                      f"filled {linked + copied} held frames ({copied} copied, {missing} missing)")
                 return {'FINISHED'}
         return {'PASS_THROUGH'}
 
     def execute(self, context):
+        plan = load_frame_plan(context.scene)
+        if plan is None:
+            self.report({'ERROR'}, "No frame plan, run Calculate Required Frames first")
+            return {'CANCELLED'}
+        self.plan = plan
+        self.frames_to_render = plan.render_frames
         self.frame_index = 0
 
         # Store original frame settings
+        render = context.scene.render
         self.original_frame_start = context.scene.frame_start
         self.original_frame_end = context.scene.frame_end
+        self.original_frame_current = context.scene.frame_current
+        self.original_filepath = render.filepath
+        self.original_use_file_extension = render.use_file_extension
+        self.frame_path = lambda frame: bpy.path.abspath(render.frame_path(frame=frame))
+        self.cache = None
+        if context.scene.pix_use_render_cache:
+            self.cache = RenderCache.from_scene(context.scene)
+            self.hasher = FrameStateHasher(context.scene)
+        self.region = None
+        if context.scene.pix_region_render:
+            self.region = RegionRenderer(context.scene, context.scene.pix_region_padding,
+                                         context.scene.pix_region_threshold,
+                                         context.scene.pix_region_contained)
 
         wm = context.window_manager
         self._timer = wm.event_timer_add(0.1, window=context.window)
         wm.modal_handler_add(self)
         return {'RUNNING_MODAL'}
 
+    def render_full(self, scene, frame):
+        # write_still saves to render.filepath as is, so point it at this frame's file
+        scene.render.filepath = scene.render.frame_path(frame=frame)
+        scene.render.use_file_extension = False
+        bpy.ops.render.render(write_still=True)  # Render the frame
+        scene.render.filepath = self.original_filepath
+        scene.render.use_file_extension = self.original_use_file_extension
+
     def finish(self, context):
+        if self.region is not None:
+            self.region.cleanup()
         # Restore original frame settings
-        context.scene.frame_start = self.original_frame_start
-        context.scene.frame_end = self.original_frame_end
+        scene = context.scene
+        scene.frame_start = self.original_frame_start
+        scene.frame_end = self.original_frame_end
+        scene.render.filepath = self.original_filepath
+        scene.render.use_file_extension = self.original_use_file_extension
+        scene.frame_set(self.original_frame_current)
         wm = context.window_manager
         wm.event_timer_remove(self._timer)
 
+class RENDER_OT_PixRenderPool(bpy.types.Operator):
+    """Render the frames of the scene's frame plan with several background Blender processes"""
+    bl_idname = "render.pix_render_pool"
+    bl_label = "Render Frame Plan (Multi-Process)"
+    bl_options = {'REGISTER'}
+
+    _timer = None
+
+    def modal(self, context, event):
+        if event.type == 'ESC':
+            self.pool.terminate()
+            self.finish(context)
+            self.report({'WARNING'}, "Render pool stopped")
+            return {'CANCELLED'}
+        if event.type == 'TIMER':
+            if not self.pool.poll():
+                rendered, total = self.pool.progress
+                context.workspace.status_text_set(f"Rendering {rendered}/{total} frames "
+                                                  f"on {len(self.pool.running)} workers")
+                return {'PASS_THROUGH'}
+            self.finish(context)
+            if self.cache is not None:
+                for frame in self.pool.records:
+                    self.cache.store(self.frame_keys[frame], self.frame_path(frame))
+                self.cache.save_manifest()
+                print(f"render cache: {self.cache.summary()}")
+            linked, copied, missing = fill_holds(self.plan, self.frame_path)
+            write_manifest(self.plan, self.frame_path)
+            report = self.pool.write_report(os.path.join(os.path.dirname(self.frame_path(self.plan.frame_start)),
+                                                         "pix_render_report.json"))
+            print(f"render report written to {report}")
+            failed = self.pool.report()["frames_failed"]
+            if failed:
+                self.report({'ERROR'}, f"{len(failed)} frames failed, see {report}")
+            else:
+                cached = self.cache.session["hits"] if self.cache is not None else 0
+                self.report({'INFO'}, f"Rendered {len(self.pool.records)} frames, {cached} from the render cache, "
+                                      f"filled {linked + copied} held frames")
+            return {'FINISHED'}
+        return {'PASS_THROUGH'}
+
+    def execute(self, context):
+        scene = context.scene
+        plan = load_frame_plan(scene)
+        if plan is None:
+            self.report({'ERROR'}, "No frame plan, run Calculate Required Frames first")
+            return {'CANCELLED'}
+        self.plan = plan
+        render = scene.render
+        self.frame_path = lambda frame: bpy.path.abspath(render.frame_path(frame=frame))
+        output_directory = os.path.dirname(self.frame_path(plan.frame_start))
+        os.makedirs(output_directory, exist_ok=True)
+
+        # Workers render a copy of the current state, so unsaved changes are included
+        # and the open file keeps its path
+        self.blend_copy = os.path.join(output_directory, ".pix_render_pool.blend")
+        bpy.ops.wm.save_as_mainfile(filepath=self.blend_copy, copy=True, relative_remap=True)
+
+        frames = plan.render_frames
+        self.cache = None
+        self.frame_keys = {}
+        if scene.pix_use_render_cache:
+            self.cache = RenderCache.from_scene(scene)
+            self.frame_keys = FrameStateHasher(scene).frame_keys(frames, context)
+            frames = [frame for frame in frames if not self.cache.fetch(self.frame_keys[frame], self.frame_path(frame))]
+            self.cache.save_manifest()
+
+        blender = bpy.path.abspath(scene.pix_blender_binary) if scene.pix_blender_binary else bpy.app.binary_path
+        # The copy lives in the output directory, where a relative output path would
+        # point somewhere else
+        self.pool = RenderPool(blender, self.blend_copy, frames,
+                               workers=scene.pix_render_workers,
+                               threads=scene.pix_render_threads,
+                               chunk_size=scene.pix_render_chunk_size,
+                               retries=scene.pix_render_retries,
+                               extra_args=["--output", bpy.path.abspath(render.filepath)])
+        self.pool.start_workers()
+        print(f"rendering {len(frames)} frames with {self.pool.workers} workers "
+              f"of {self.pool.threads} threads")
+
+        wm = context.window_manager
+        self._timer = wm.event_timer_add(0.5, window=context.window)
+        wm.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+
+    def finish(self, context):
+        context.workspace.status_text_set(None)
+        context.window_manager.event_timer_remove(self._timer)
+        if os.path.exists(self.blend_copy):
+            os.remove(self.blend_copy)
+
+class RENDER_OT_PixSubmitRenderQueue(bpy.types.Operator):
+    """Put the frames of the scene's frame plan in a render queue on shared storage, for workers on any machine"""
+    bl_idname = "render.pix_submit_render_queue"
+    bl_label = "Submit Frame Plan to Render Queue"
+    bl_options = {'REGISTER'}
+
+    local_workers: bpy.props.IntProperty(
+        name="Local workers",
+        description="Workers to start on this machine right away",
+        default=0,
+        min=0
+    )
+
+    def invoke(self, context, event):
+        return context.window_manager.invoke_props_dialog(self)
+
+    def execute(self, context):
+        scene = context.scene
+        plan = load_frame_plan(scene)
+        if plan is None:
+            self.report({'ERROR'}, "No frame plan, run Calculate Required Frames first")
+            return {'CANCELLED'}
+        if not scene.pix_render_queue_dir:
+            self.report({'ERROR'}, "Set the render queue directory first")
+            return {'CANCELLED'}
+        directory = os.path.normpath(bpy.path.abspath(scene.pix_render_queue_dir))
+        os.makedirs(directory, exist_ok=True)
+
+        # Every machine opens the same copy, so they all render the same state
+        blend_copy = os.path.join(directory, "pix_render_queue.blend")
+        bpy.ops.wm.save_as_mainfile(filepath=blend_copy, copy=True, relative_remap=True)
+        queue = RenderQueue.create(directory, plan.render_frames, blend_copy, plan.to_dict())
+
+        # Resolved against the original file, the copy sits in the queue directory
+        output = ["--output", bpy.path.abspath(scene.render.filepath)]
+        command = queue_worker_command("blender", blend_copy, directory, extra_args=output)
+        print("start workers with:\n    " + " ".join(command))
+        blender = bpy.path.abspath(scene.pix_blender_binary) if scene.pix_blender_binary else bpy.app.binary_path
+        for index in range(self.local_workers):
+            subprocess.Popen(queue_worker_command(blender, blend_copy, directory,
+                                                  threads=scene.pix_render_threads, extra_args=output))
+        status = queue.status()
+        self.report({'INFO'}, f"Queued {status['frames'] - status['completed']} of {status['frames']} frames "
+                              f"in {directory}, started {self.local_workers} local workers")
+        return {'FINISHED'}
+
 def draw_menu(self, context):
     self.layout.operator(RENDER_OT_SpecificFramesModal.bl_idname)
+    self.layout.operator(RENDER_OT_PixRenderPool.bl_idname)
+    self.layout.operator(RENDER_OT_PixSubmitRenderQueue.bl_idname)
 
 def register():
     bpy.utils.register_class(RENDER_OT_SpecificFramesModal)
+    bpy.utils.register_class(RENDER_OT_PixRenderPool)
+    bpy.utils.register_class(RENDER_OT_PixSubmitRenderQueue)
     bpy.types.TOPBAR_MT_render.append(draw_menu)
+    bpy.types.Scene.pix_render_workers = bpy.props.IntProperty(
+        name="Render workers",
+        description="Number of background Blender processes rendering at once",
+        default=4,
+        min=1
+    )
+    bpy.types.Scene.pix_render_threads = bpy.props.IntProperty(
+        name="Threads per worker",
+        description="Render threads of each worker, 0 splits the cores evenly",
+        default=0,
+        min=0
+    )
+    bpy.types.Scene.pix_render_chunk_size = bpy.props.IntProperty(
+        name="Frames per chunk",
+        description="Frames a worker renders before the next chunk is handed out",
+        default=8,
+        min=1
+    )
+    bpy.types.Scene.pix_render_retries = bpy.props.IntProperty(
+        name="Retries",
+        description="How often frames of a failed worker are handed out again",
+        default=2,
+        min=0
+    )
+    bpy.types.Scene.pix_blender_binary = bpy.props.StringProperty(
+        name="Blender binary",
+        description="Blender executable for the workers, empty for the running one",
+        subtype='FILE_PATH',
+        default=""
+    )
+    bpy.types.Scene.pix_region_render = bpy.props.BoolProperty(
+        name="Render changed regions",
+        description="Render only the part of a frame where objects changed and paste it over the frame before",
+        default=False
+    )
+    bpy.types.Scene.pix_region_padding = bpy.props.IntProperty(
+        name="Region padding",
+        description="Pixels added around the changed region, for edges, soft shadows and glow",
+        default=32,
+        min=0
+    )
+    bpy.types.Scene.pix_region_contained = bpy.props.BoolProperty(
+        name="Changes stay in their bounds",
+        description="Render only the changed region even when changed objects cast shadows or show up "
+                    "in reflections or bounced light on other objects. Off, such frames are rendered whole",
+        default=False
+    )
+    bpy.types.Scene.pix_region_threshold = bpy.props.FloatProperty(
+        name="Region threshold",
+        description="Render the whole frame when the changed region covers more than this part of it",
+        default=0.5,
+        min=0.0,
+        max=1.0,
+        subtype='FACTOR'
+    )
+    bpy.types.Scene.pix_render_queue_dir = bpy.props.StringProperty(
+        name="Render queue directory",
+        description="Shared directory render workers on other machines take frames from",
+        subtype='DIR_PATH',
+        default=""
+    )
 
 def unregister():
     bpy.utils.unregister_class(RENDER_OT_SpecificFramesModal)
+    bpy.utils.unregister_class(RENDER_OT_PixRenderPool)
+    bpy.utils.unregister_class(RENDER_OT_PixSubmitRenderQueue)
     bpy.types.TOPBAR_MT_render.remove(draw_menu)
+    del bpy.types.Scene.pix_render_workers
+    del bpy.types.Scene.pix_render_threads
+    del bpy.types.Scene.pix_render_chunk_size
+    del bpy.types.Scene.pix_render_retries
+    del bpy.types.Scene.pix_blender_binary
+    del bpy.types.Scene.pix_render_queue_dir
+    del bpy.types.Scene.pix_region_render
+    del bpy.types.Scene.pix_region_padding
+    del bpy.types.Scene.pix_region_contained
+    del bpy.types.Scene.pix_region_threshold
 
 
 # if __name__ == "__main__":
@@ -71,69 +360,69 @@ def get_material_state(material):
                     # Assuming it's a color. Note: This may need refinement based on specific use cases.
                     node_state[prop_name] = tuple(prop_value)
             state[node.name] = node_state
+    # Socket values, which is what drivers change
+    state['fingerprint'] = material_fingerprint(material)
     return state
 
-def frames_to_generate():
+def frames_to_generate(method='ANALYTIC'):
     """
     Detects changes in transformation properties and material node values of objects in the scene across all frames,
     comparing against the last change, and returns a list of frames where changes were detected.
 
+    Args:
+    method (str): 'ANALYTIC' reads the changes from F-curves and drivers and only sets
+        frames for channels it can't reason about. 'SNAPSHOT' records the animated
+        objects' world matrices once and diffs them as arrays. 'SAMPLE' sets every
+        frame and compares every object.
+
     Returns:
     list: A list of frame numbers where changes were detected.
     """
+    if method == 'ANALYTIC':
+        frames_needed = analytic_changed_frames(bpy.context.scene)
+        print(f"frame require {len(frames_needed)}")
+        return frames_needed
+    if method == 'SNAPSHOT':
+        scene = bpy.context.scene
+        frames_needed = record_snapshots(scene, snapshot_directory(scene)).changed_frames()
+        print(f"frame require {len(frames_needed)}")
+        return frames_needed
+
+    scene = bpy.context.scene
+    materials = {slot.material.name: slot.material for obj in scene.objects
+                 for slot in obj.material_slots if slot.material}
+
+    def material_states():
+        # Once per material and frame, however many objects share it
+        depsgraph = bpy.context.evaluated_depsgraph_get()
+        return {name: material_fingerprint(material, depsgraph) for name, material in materials.items()}
 
     # Store the initial state
     states = {}
-    for obj in bpy.context.scene.objects:
-        obj_state = {
-            'location': tuple(obj.location),
-            'rotation_euler': tuple(obj.rotation_euler),
-            'scale': tuple(obj.scale),
-            'materials': {}
-        }
-        # Record initial material states
-        for mat_slot in obj.material_slots:
-            if mat_slot.material:
-                obj_state['materials'][mat_slot.name] = get_material_state(mat_slot.material)
-
-        states[obj.name] = obj_state
+    for obj in scene.objects:
+        states[obj.name] = (tuple(obj.location), tuple(obj.rotation_euler), tuple(obj.scale))
+    material_state = material_states()
 
     # List to hold frames that need generation
     frames_needed = []
 
     # Iterate over all frames
-    for frame in range(bpy.context.scene.frame_start, bpy.context.scene.frame_end + 1):
-        bpy.context.scene.frame_set(frame)
+    for frame in range(scene.frame_start, scene.frame_end + 1):
+        scene.frame_set(frame)
         change_detected = False
 
-        # Check each object for changes
-        for obj in bpy.context.scene.objects:
-            current_obj_state = states[obj.name]
-
-            # Check for transformation changes
-            if (tuple(obj.location) != current_obj_state['location'] or
-                tuple(obj.rotation_euler) != current_obj_state['rotation_euler'] or
-                tuple(obj.scale) != current_obj_state['scale']):
+        # Check each object for transformation changes
+        for obj in scene.objects:
+            current = (tuple(obj.location), tuple(obj.rotation_euler), tuple(obj.scale))
+            if current != states[obj.name]:
+                states[obj.name] = current
                 change_detected = True
 
-            # Check for material changes
-            for mat_slot in obj.material_slots:
-                if mat_slot.material:
-                    current_state = get_material_state(mat_slot.material)
-                    if current_state != current_obj_state['materials'].get(mat_slot.name, {}):
-                        change_detected = True
-                        break
-
-            if change_detected:
-                # Update the stored state
-                states[obj.name] = {
-                    'location': tuple(obj.location),
-                    'rotation_euler': tuple(obj.rotation_euler),
-                    'scale': tuple(obj.scale),
-                    'materials': {mat_slot.name: get_material_state(mat_slot.material)
-                                  for mat_slot in obj.material_slots if mat_slot.material}
-                }
-                break
+        # Check for material changes
+        current_material_state = material_states()
+        if current_material_state != material_state:
+            material_state = current_material_state
+            change_detected = True
 
         if change_detected:
             frames_needed.append(frame)
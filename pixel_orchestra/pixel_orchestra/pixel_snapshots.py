@@ -0,0 +1,238 @@
+import bpy
+import os
+import json
+import hashlib
+import tempfile
+import numpy as np
+from .pixel_frame_plan import FramePlan
+from .pixel_fingerprint import has_animated_channels, material_fingerprint, material_value_paths, object_fingerprint
+
+HEADER_NAME = "header.json"
+MATRICES_NAME = "matrices.npy"
+MATERIALS_NAME = "materials.npy"
+CHANNELS_NAME = "channels.npy"
+WORLD_NAME = "world.npy"
+# Frames compared per step when diffing, keeps memory flat for long pieces
+DIFF_CHUNK = 512
+
+
+def snapshot_directory(scene):
+    directory = scene.pix_snapshot_dir
+    if directory.startswith("//") and not bpy.data.filepath:
+        return os.path.join(tempfile.gettempdir(), "pix_snapshots")
+    return os.path.normpath(bpy.path.abspath(directory))
+
+
+def is_animated(id_block):
+    animation_data = getattr(id_block, "animation_data", None)
+    return animation_data is not None and (animation_data.action is not None
+                                           or len(animation_data.drivers) > 0
+                                           or len(animation_data.nla_tracks) > 0)
+
+
+def animated_objects(scene):
+    """
+    Indices into scene.objects of the objects whose world matrix can change: animated,
+    constrained, or below such an object.
+    """
+    moving = {}
+
+    def moves(obj):
+        key = obj.name
+        if key not in moving:
+            moving[key] = False
+            moving[key] = (is_animated(obj) or len(obj.constraints) > 0
+                           or (obj.parent is not None and moves(obj.parent)))
+        return moving[key]
+
+    return [index for index, obj in enumerate(scene.objects) if moves(obj)]
+
+
+def channel_objects(scene):
+    """
+    Indices into scene.objects of the objects with keyed or driven values that change
+    how they look without moving them: custom properties read by attribute shading,
+    point cloud attributes, shape keys, data and modifier settings.
+    """
+    return [index for index, obj in enumerate(scene.objects) if has_animated_channels(obj)]
+
+
+def animated_materials(scene):
+    """
+    The materials in the scene with node values that can change, see material_value_paths.
+    """
+    materials = {}
+    for obj in scene.objects:
+        for slot in obj.material_slots:
+            material = slot.material
+            if material is not None and material.name not in materials and material_value_paths(material):
+                materials[material.name] = material
+    return [materials[name] for name in sorted(materials)]
+
+
+class SnapshotStore:
+    """
+    World matrices of the animated objects, hashes of the animated materials and of
+    the keyed values of objects, and a hash of every object's world matrix, for every
+    frame of a range, on disk.
+
+    matrices.npy is a float32 array of shape (objects, frames, 16), with the matrices
+    in Blender's column-major order. materials.npy is a uint64 array of shape
+    (materials, frames), channels.npy one of shape (channel objects, frames), see
+    pixel_fingerprint.object_fingerprint. world.npy is a uint64 array with one hash of
+    all world matrices per frame, which catches objects moved by anything
+    animated_objects doesn't predict. header.json names the rows and the frame range.
+    The arrays are written as memory maps, so long pieces don't have to fit in memory.
+    """
+
+    def __init__(self, directory, header, matrices, materials, channels, world):
+        self.directory = directory
+        self.header = header
+        self.matrices = matrices
+        self.materials = materials
+        self.channels = channels
+        self.world = world
+
+    @property
+    def frame_start(self):
+        return self.header["frame_start"]
+
+    @property
+    def frame_end(self):
+        return self.header["frame_end"]
+
+    @classmethod
+    def create(cls, directory, frame_start, frame_end, object_names, material_names, channel_object_names=()):
+        os.makedirs(directory, exist_ok=True)
+        frame_count = frame_end - frame_start + 1
+        header = {
+            "frame_start": frame_start,
+            "frame_end": frame_end,
+            "objects": list(object_names),
+            "materials": list(material_names),
+            "channel_objects": list(channel_object_names)
+        }
+        matrices = np.lib.format.open_memmap(os.path.join(directory, MATRICES_NAME), mode='w+',
+                                             dtype=np.float32, shape=(len(object_names), frame_count, 16))
+        materials = np.lib.format.open_memmap(os.path.join(directory, MATERIALS_NAME), mode='w+',
+                                              dtype=np.uint64, shape=(len(material_names), frame_count))
+        channels = np.lib.format.open_memmap(os.path.join(directory, CHANNELS_NAME), mode='w+',
+                                             dtype=np.uint64, shape=(len(header["channel_objects"]), frame_count))
+        world = np.lib.format.open_memmap(os.path.join(directory, WORLD_NAME), mode='w+',
+                                          dtype=np.uint64, shape=(frame_count,))
+        with open(os.path.join(directory, HEADER_NAME), "w") as f:
+            json.dump(header, f)
+        return cls(directory, header, matrices, materials, channels, world)
+
+    def flush(self):
+        for array in (self.matrices, self.materials, self.channels, self.world):
+            if hasattr(array, "flush"):
+                array.flush()
+
+    def changed_mask(self):
+        """
+        For every frame, whether any recorded matrix, material or keyed value differs
+        from the frame before. The first frame counts as changed.
+        """
+        frame_count = self.frame_end - self.frame_start + 1
+        mask = np.zeros(frame_count, dtype=bool)
+        mask[0] = True
+        for first in range(1, frame_count, DIFF_CHUNK):
+            last = min(first + DIFF_CHUNK, frame_count)
+            block = self.matrices[:, first - 1:last, :]
+            changed = np.any(block[:, 1:, :] != block[:, :-1, :], axis=(0, 2))
+            materials = self.materials[:, first - 1:last]
+            changed |= np.any(materials[:, 1:] != materials[:, :-1], axis=0)
+            channels = self.channels[:, first - 1:last]
+            changed |= np.any(channels[:, 1:] != channels[:, :-1], axis=0)
+            world = self.world[first - 1:last]
+            changed |= world[1:] != world[:-1]
+            mask[first:last] = changed
+        return mask
+
+    def changed_frames(self):
+        return [int(frame) for frame in np.flatnonzero(self.changed_mask()) + self.frame_start]
+
+    def frame_digests(self):
+        """
+        One hash per frame over everything recorded for it.
+        """
+        digests = []
+        for column in range(self.frame_end - self.frame_start + 1):
+            digest = hashlib.blake2b(digest_size=16)
+            digest.update(np.ascontiguousarray(self.matrices[:, column, :]).tobytes())
+            digest.update(np.ascontiguousarray(self.materials[:, column]).tobytes())
+            digest.update(np.ascontiguousarray(self.channels[:, column]).tobytes())
+            digest.update(self.world[column].tobytes())
+            digests.append(digest.digest())
+        return digests
+
+    def plan(self):
+        """
+        A FramePlan that renders a frame only when it differs from the frame before and
+        from every frame rendered so far.
+        """
+        mask = self.changed_mask()
+        aliases = {}
+        first_seen = {}
+        for column, digest in enumerate(self.frame_digests()):
+            frame = self.frame_start + column
+            if digest not in first_seen:
+                first_seen[digest] = frame
+            elif mask[column]:
+                aliases[frame] = first_seen[digest]
+        return FramePlan.from_mask(self.frame_start, mask.tolist(), source="snapshot", aliases=aliases)
+
+
+def record_snapshots(scene, directory, context=None):
+    """
+    Steps through the scene's frame range once and records the world matrices of the
+    animated objects, a hash of all world matrices, the keyed values of objects and
+    the state of the animated materials.
+
+    Args:
+    scene (bpy.types.Scene): The scene to record.
+    directory (str): Where to write the store.
+    context (bpy.types.Context): Used for the depsgraph, defaults to bpy.context.
+
+    Returns:
+    SnapshotStore: The recorded store.
+    """
+    context = context or bpy.context
+    object_indices = np.array(animated_objects(scene), dtype=np.int64)
+    materials = animated_materials(scene)
+    objects = scene.objects
+    keyed_objects = [objects[index] for index in channel_objects(scene)]
+    store = SnapshotStore.create(directory, scene.frame_start, scene.frame_end,
+                                 [objects[int(index)].name for index in object_indices],
+                                 [material.name for material in materials],
+                                 [obj.name for obj in keyed_objects])
+    buffer = np.empty(len(objects) * 16, dtype=np.float32)
+    original_frame = scene.frame_current
+    for column, frame in enumerate(range(scene.frame_start, scene.frame_end + 1)):
+        scene.frame_set(frame)
+        objects.foreach_get("matrix_world", buffer)
+        store.world[column] = int.from_bytes(hashlib.blake2b(buffer.tobytes(), digest_size=8).digest(), "little")
+        if len(object_indices):
+            store.matrices[:, column, :] = buffer.reshape(-1, 16)[object_indices]
+        if materials or keyed_objects:
+            depsgraph = context.evaluated_depsgraph_get()
+            store.materials[:, column] = [material_fingerprint(material, depsgraph) for material in materials]
+            store.channels[:, column] = [object_fingerprint(obj, depsgraph) for obj in keyed_objects]
+    scene.frame_set(original_frame)
+    store.flush()
+    print(f"recorded {len(object_indices)} objects, {len(keyed_objects)} keyed objects and "
+          f"{len(materials)} materials over {scene.frame_end - scene.frame_start + 1} frames")
+    return store
+
+
+def register():
+    bpy.types.Scene.pix_snapshot_dir = bpy.props.StringProperty(
+        name="Snapshot directory",
+        description="Where per-frame scene snapshots are written",
+        subtype='DIR_PATH',
+        default="//pix_snapshots/"
+    )
+
+def unregister():
+    del bpy.types.Scene.pix_snapshot_dir
@@ -0,0 +1,314 @@
+import bpy
+import numpy as np
+from bpy.app.handlers import persistent
+from mathutils import Euler, Vector
+from mathutils.bvhtree import BVHTree
+
+# Face data of track planes, read in bulk with foreach_get. Local-space arrays are
+# kept per mesh and rebuilt only when the mesh's geometry changes; world-space arrays
+# are kept per object, so linked duplicates share the first but not the second, and
+# rebuilt only when the object's matrix_world changes.
+
+# MeshSurface by mesh pointer
+_surfaces = {}
+# ObjectSurface by (mesh pointer, object pointer)
+_object_surfaces = {}
+
+
+def read_array(collection, attribute, count, width, dtype=np.float32):
+    values = np.empty(count * width, dtype=dtype)
+    collection.foreach_get(attribute, values)
+    return values.reshape(count, width) if width > 1 else values
+
+
+def normalize_rows(vectors):
+    lengths = np.linalg.norm(vectors, axis=1, keepdims=True)
+    lengths[lengths == 0] = 1
+    return vectors / lengths
+
+
+def quaternion_matrices(quaternions):
+    """
+    (N, 3, 3) rotation matrices of (N, 4) unit quaternions (w, x, y, z), indexed
+    [n, column, row] like Blender's float[3][3].
+    """
+    q0, q1, q2, q3 = (np.sqrt(2.0) * quaternions).T
+    matrices = np.empty((len(quaternions), 3, 3))
+    matrices[:, 0, 0] = 1 - q2 * q2 - q3 * q3
+    matrices[:, 0, 1] = q0 * q3 + q1 * q2
+    matrices[:, 0, 2] = -q0 * q2 + q1 * q3
+    matrices[:, 1, 0] = -q0 * q3 + q1 * q2
+    matrices[:, 1, 1] = 1 - q1 * q1 - q3 * q3
+    matrices[:, 1, 2] = q0 * q1 + q2 * q3
+    matrices[:, 2, 0] = q0 * q2 + q1 * q3
+    matrices[:, 2, 1] = -q0 * q1 + q2 * q3
+    matrices[:, 2, 2] = 1 - q1 * q1 - q2 * q2
+    return matrices
+
+
+def multiply_quaternions(a, b):
+    aw, ax, ay, az = a.T
+    bw, bx, by, bz = b.T
+    return np.stack([
+        aw * bw - ax * bx - ay * by - az * bz,
+        aw * bx + ax * bw + ay * bz - az * by,
+        aw * by + ay * bw + az * bx - ax * bz,
+        aw * bz + az * bw + ax * by - ay * bx
+    ], axis=1)
+
+
+def matrix_eulers(matrices):
+    """
+    Euler angles (XYZ) of (N, 3, 3) rotation matrices, picking the smaller of the two
+    solutions the way Blender's mat3_normalized_to_eul does.
+    """
+    m = matrices
+    cy = np.hypot(m[:, 0, 0], m[:, 0, 1])
+    first = np.stack([np.arctan2(m[:, 1, 2], m[:, 2, 2]),
+                      np.arctan2(-m[:, 0, 2], cy),
+                      np.arctan2(m[:, 0, 1], m[:, 0, 0])], axis=1)
+    second = np.stack([np.arctan2(-m[:, 1, 2], -m[:, 2, 2]),
+                       np.arctan2(-m[:, 0, 2], -cy),
+                       np.arctan2(-m[:, 0, 1], -m[:, 0, 0])], axis=1)
+    gimbal = cy <= 16 * np.finfo(np.float32).eps
+    first[gimbal, 0] = np.arctan2(-m[gimbal, 2, 1], m[gimbal, 1, 1])
+    first[gimbal, 2] = 0
+    second[gimbal] = first[gimbal]
+    use_second = np.abs(first).sum(axis=1) > np.abs(second).sum(axis=1)
+    first[use_second] = second[use_second]
+    return first
+
+
+def track_z_rotations(normals):
+    """
+    Euler rotations (XYZ) that point the Z axis along each normal, the way
+    Vector.to_track_quat('Z', 'Y').to_euler() does row by row: the shortest rotation
+    from Z to the normal, then a turn about the normal that keeps Y pointing up.
+
+    Args:
+    normals (numpy.ndarray): (N, 3) normals.
+
+    Returns:
+    numpy.ndarray: (N, 3) Euler angles.
+    """
+    # A port of Blender's vec_to_quat for axis Z and up Y, one row per normal
+    t = np.asarray(normals, dtype=np.float64).reshape(-1, 3)
+    length = np.linalg.norm(t, axis=1)
+    valid = length > 0
+    length[~valid] = 1
+
+    axes = np.stack([-t[:, 1], t[:, 0], np.zeros(len(t))], axis=1)
+    along_z = np.abs(t[:, 0]) + np.abs(t[:, 1]) < 1e-4
+    axes[along_z, 0] = 1
+    axes = normalize_rows(axes)
+    half = 0.5 * np.arccos(np.clip(t[:, 2] / length, -1, 1))
+    quaternions = np.concatenate([np.cos(half)[:, None], axes * np.sin(half)[:, None]], axis=1)
+
+    # Where the rotation takes Z; the turn about the normal is read off it
+    z = quaternion_matrices(quaternions)[:, 2]
+    angle = -0.5 * np.arctan2(-z[:, 0], -z[:, 1])
+    turn = np.concatenate([np.cos(angle)[:, None], t * (np.sin(angle) / length)[:, None]], axis=1)
+    quaternions = multiply_quaternions(turn, quaternions)
+    quaternions /= np.linalg.norm(quaternions, axis=1, keepdims=True)
+
+    eulers = matrix_eulers(quaternion_matrices(quaternions))
+    eulers[~valid] = 0
+    return eulers
+
+
+class MeshSurface:
+    """
+    Per-face data of a mesh as NumPy arrays, in local space: vertices,
+    polygon_centers, polygon_normals, triangles (vertex indices of the loop triangles)
+    and triangle_polygons (the polygon each triangle belongs to).
+    """
+
+    def __init__(self, mesh):
+        self.mesh_name = mesh.name
+        self.vertices = read_array(mesh.vertices, "co", len(mesh.vertices), 3)
+        self.polygon_centers = read_array(mesh.polygons, "center", len(mesh.polygons), 3)
+        self.polygon_normals = read_array(mesh.polygons, "normal", len(mesh.polygons), 3)
+        self.loop_starts = read_array(mesh.polygons, "loop_start", len(mesh.polygons), 1, np.int32)
+        self.loop_totals = read_array(mesh.polygons, "loop_total", len(mesh.polygons), 1, np.int32)
+        self.loop_vertices = read_array(mesh.loops, "vertex_index", len(mesh.loops), 1, np.int32)
+        mesh.calc_loop_triangles()
+        self.triangles = read_array(mesh.loop_triangles, "vertices", len(mesh.loop_triangles), 3, np.int32)
+        self.triangle_polygons = read_array(mesh.loop_triangles, "polygon_index", len(mesh.loop_triangles), 1, np.int32)
+        self._bvh = None
+
+    @property
+    def face_count(self):
+        return len(self.polygon_centers)
+
+    def bvh(self):
+        """
+        A BVH tree of the local-space triangles, built on first use.
+        """
+        if self._bvh is None:
+            self._bvh = BVHTree.FromPolygons(self.vertices.tolist(), self.triangles.tolist())
+        return self._bvh
+
+
+class ObjectSurface:
+    """
+    The faces of one mesh object: the local arrays of its MeshSurface, shared with
+    linked duplicates, and world arrays for the matrix the surface was last updated
+    with: world_vertices, centers, normals, rotations (Euler XYZ aligning Z with the
+    normal), triangle_areas and areas.
+    """
+
+    def __init__(self, mesh_surface):
+        self.mesh_surface = mesh_surface
+        self.vertices = mesh_surface.vertices
+        self.polygon_centers = mesh_surface.polygon_centers
+        self.polygon_normals = mesh_surface.polygon_normals
+        self.loop_starts = mesh_surface.loop_starts
+        self.loop_totals = mesh_surface.loop_totals
+        self.loop_vertices = mesh_surface.loop_vertices
+        self.triangles = mesh_surface.triangles
+        self.triangle_polygons = mesh_surface.triangle_polygons
+        self.matrix_key = None
+
+    @property
+    def face_count(self):
+        return self.mesh_surface.face_count
+
+    def bvh(self):
+        return self.mesh_surface.bvh()
+
+    def update_world(self, matrix_world):
+        """
+        Recomputes the world-space arrays when `matrix_world` differs from the last one.
+        """
+        matrix = np.array(matrix_world, dtype=np.float64)
+        key = matrix.tobytes()
+        if key == self.matrix_key:
+            return
+        rotation_scale = matrix[:3, :3]
+        translation = matrix[:3, 3]
+        self.world_vertices = self.vertices @ rotation_scale.T + translation
+        self.centers = self.polygon_centers @ rotation_scale.T + translation
+        # Normals transform by the inverse transpose so non-uniform scale keeps them perpendicular
+        try:
+            normal_matrix = np.linalg.inv(rotation_scale).T
+        except np.linalg.LinAlgError:
+            normal_matrix = rotation_scale
+        self.normals = normalize_rows(self.polygon_normals @ normal_matrix.T)
+        self.rotations = track_z_rotations(self.normals)
+
+        corners = self.world_vertices[self.triangles]
+        self.triangle_areas = 0.5 * np.linalg.norm(
+            np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0]), axis=1)
+        self.areas = np.bincount(self.triangle_polygons, weights=self.triangle_areas, minlength=self.face_count)
+        self.matrix_key = key
+
+    def face_vertices(self, index):
+        start = self.loop_starts[index]
+        return self.world_vertices[self.loop_vertices[start:start + self.loop_totals[index]]]
+
+    def face_data(self, index):
+        """
+        Returns one face in the dict form get_mesh_data used to produce.
+        """
+        return {
+            'face': [Vector(co) for co in self.face_vertices(index)],
+            'normal': Vector(self.normals[index]),
+            'world_position': Vector(self.centers[index]),
+            'rotation_euler': Euler(self.rotations[index])
+        }
+
+
+def get_surface(mesh_object):
+    """
+    Returns the ObjectSurface of a mesh object, up to date with its geometry and
+    matrix_world. Geometry is only read again after a depsgraph update touched it.
+
+    Args:
+    mesh_object (bpy.types.Object): A mesh object.
+
+    Returns:
+    ObjectSurface: The object's face data.
+    """
+    if mesh_object.type != 'MESH':
+        raise ValueError("Provided object is not a mesh")
+    mesh = mesh_object.data
+    key = mesh.as_pointer()
+    mesh_surface = _surfaces.get(key)
+    # A freed mesh's pointer can be reused by another one
+    if mesh_surface is None or mesh_surface.mesh_name != mesh.name:
+        mesh_surface = _surfaces[key] = MeshSurface(mesh)
+    object_key = (key, mesh_object.as_pointer())
+    surface = _object_surfaces.get(object_key)
+    if surface is None or surface.mesh_surface is not mesh_surface:
+        surface = _object_surfaces[object_key] = ObjectSurface(mesh_surface)
+    surface.update_world(mesh_object.matrix_world)
+    return surface
+
+
+class SurfaceSet:
+    """
+    The faces of several mesh objects as one range of indices.
+    """
+
+    def __init__(self, mesh_objects):
+        self.objects = list(mesh_objects)
+        self.surfaces = [get_surface(obj) for obj in self.objects]
+        self.offsets = np.cumsum([0] + [surface.face_count for surface in self.surfaces])
+
+    @property
+    def face_count(self):
+        return int(self.offsets[-1])
+
+    def locate(self, index):
+        """
+        Maps a face index of the set to (object, surface, face index in the surface).
+        """
+        surface_index = int(np.searchsorted(self.offsets, index, side='right')) - 1
+        return self.objects[surface_index], self.surfaces[surface_index], index - int(self.offsets[surface_index])
+
+    def face_data(self, index):
+        _, surface, face_index = self.locate(index)
+        return surface.face_data(face_index)
+
+    def concatenate(self, attribute):
+        return np.concatenate([getattr(surface, attribute) for surface in self.surfaces])
+
+
+@persistent
+def invalidate_surfaces(scene, depsgraph):
+    """
+    Drops the cached surfaces of meshes whose geometry changed.
+    """
+    if not _surfaces:
+        return
+    for update in depsgraph.updates:
+        id_block = update.id.original
+        if isinstance(id_block, bpy.types.Object):
+            if not update.is_updated_geometry or id_block.type != 'MESH':
+                continue
+            id_block = id_block.data
+        if isinstance(id_block, bpy.types.Mesh):
+            key = id_block.as_pointer()
+            if _surfaces.pop(key, None) is not None:
+                for object_key in [object_key for object_key in _object_surfaces if object_key[0] == key]:
+                    del _object_surfaces[object_key]
+
+
+@persistent
+def clear_surfaces(*args):
+    _surfaces.clear()
+    _object_surfaces.clear()
+
+
+def register():
+    if invalidate_surfaces not in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.append(invalidate_surfaces)
+    if clear_surfaces not in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.append(clear_surfaces)
+
+def unregister():
+    if invalidate_surfaces in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.remove(invalidate_surfaces)
+    if clear_surfaces in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.remove(clear_surfaces)
+    clear_surfaces()
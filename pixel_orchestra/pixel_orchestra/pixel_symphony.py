@@ -5,16 +5,32 @@ import json
 import mathutils
 import bmesh
 import random
+import numpy as np
 from mathutils import Vector
 from .pixel_rendering import frames_to_generate
-from .pixel_utils import distribute_collection_to_face, get_mesh_data, get_meshes_in_collection, pin_collection_to_face
+from .pixel_utils import get_meshes_in_collection
+from .pixel_surface import SurfaceSet
+from .pixel_placement import SpatialHash, apply_placements, instance_radii, place_on_surfaces, resolve_overlaps
 from .pixel_stored_functions import functions_dict
+from .pixel_material_pool import material_signature, pool_realized_materials
+from . import pixel_datablocks
+from .pixel_fingerprint import instance_fingerprint, realization_fingerprint
+from .pixel_point_instancing import find_track_point_cloud, key_point_note, point_cloud_index
+from .pixel_library_cache import LibraryCache, library_cache_key
+from .pixel_frame_plan import FramePlan, store_frame_plan
+from .pixel_note_schedule import activation_bitmap, plan_from_bitmap
+from .pixel_snapshots import record_snapshots, snapshot_directory
 from bpy.props import CollectionProperty, StringProperty
 
 PIX_PREFIX = "pix_"
 PIX_ID = "pix_id"
 PIX_ID_DUPS = "pix_id_dups"
 PIX_PROPERTIES = "pix_properties"
+PIX_ATTRIBUTE_SOURCE = "pix_attribute_source"
+PIX_ATTRIBUTE_SIGNATURE = "pix_attribute_signature"
+PIX_SOURCE_FINGERPRINT = "pix_source_fingerprint"
+PIX_INSTANCE_FINGERPRINT = "pix_instance_fingerprint"
+PIX_INSTANCE_RECORD = "pix_instance_record"
 
 
 def create_driver(material, node, object, expression, variables_data):
@@ -43,6 +59,7 @@ def create_object_driver(mesh, object, property_name, axis, expression, variable
     :param mesh: The mesh object on which the driver is to be created.
     :param object: The Blender object to which the driver refers.
     :param property_name: The name of the property to drive.
+    :param axis: The axis to drive, or None for a single value property.
     :param expression: The driver expression.
     :param variables_data: A list of tuples containing variable names and data paths.
     :return: The created driver.
@@ -55,7 +72,10 @@ def create_object_driver(mesh, object, property_name, axis, expression, variable
         axis = 0
 
     # Access the property to drive and create a driver for it
-    fcurve = mesh.driver_add(property_name, axis)
+    if axis is None:
+        fcurve = mesh.driver_add(property_name)
+    else:
+        fcurve = mesh.driver_add(property_name, axis)
     driver = fcurve.driver
     driver.type = 'SCRIPTED'
     driver.expression = expression
@@ -210,6 +230,166 @@ def realize_nodes(node, material, obj):
                     variables_data=variables_data
                 )
 
+def realize_nodes_as_attributes(node, material, obj):
+    """
+    Realizes a customized node of a shared attribute material (see
+    share_attribute_materials_in_collection). Instead of driving the node, the value is
+    put on the object, where the node's Attribute node reads it.
+    """
+    pix_properties = read_prefixed_properties(node, PIX_PREFIX)
+    if PIX_PROPERTIES in pix_properties:
+        source_name = material.get(PIX_ATTRIBUTE_SOURCE, material.name)
+        props = split_string_by_comma(pix_properties[PIX_PROPERTIES])
+        for i in range(len(props)):
+            prop = f"{PIX_PREFIX}{props[i]}"
+            if prop in pix_properties:
+                set_custom_property_if_not_exists(obj, remove_prefix(prop, PIX_PREFIX), pix_properties[prop])
+            if prop + "_expression" not in pix_properties:
+                continue
+            expression = pix_properties[prop + "_expression"]
+            variables_data = []
+            if prop + "_properties" in pix_properties:
+                _properties = split_string_by_comma(pix_properties[prop + "_properties"])
+                _property_paths = split_string_by_comma(pix_properties[prop + "_property_paths"])
+                variables_data = list(zip(_properties, _property_paths))
+            attribute_name = get_shading_attribute_name(source_name, node, expression, variables_data)
+            if len(variables_data) == 1 and attribute_name == variables_data[0][1]:
+                # The node reads the property directly, nothing to drive
+                continue
+            if attribute_name not in obj:
+                obj[attribute_name] = 0.0
+            create_object_driver(
+                mesh=obj,
+                object=obj,
+                property_name=f'["{attribute_name}"]',
+                axis=None,
+                expression=expression,
+                variables_data=variables_data
+            )
+
+def get_shading_attribute_name(source_material_name, node, expression, variables_data):
+    """
+    Returns the object property the Attribute node replacing `node` reads.
+
+    An expression that is just one variable reads that variable's property directly,
+    anything else is evaluated by an object driver into a property named after the
+    material and node.
+    """
+    variables_data = list(variables_data)
+    if len(variables_data) == 1 and expression.strip() == variables_data[0][0]:
+        return variables_data[0][1]
+    return bpy.path.clean_name(f"pix_shade_{source_material_name}_{node.name}")
+
+def rewire_node_to_attribute(material, node, attribute_name):
+    """
+    Feeds everything linked to the node's first output from an Attribute node that
+    reads `attribute_name` from the object instead.
+    """
+    node_tree = material.node_tree
+    attribute = node_tree.nodes.new('ShaderNodeAttribute')
+    attribute.attribute_type = 'OBJECT'
+    attribute.attribute_name = attribute_name
+    attribute.location = (node.location.x, node.location.y - 180)
+    attribute.label = f"{node.name} ({attribute_name})"
+    output = node.outputs[0]
+    if output.type in ('RGBA', 'VECTOR'):
+        attribute_output = attribute.outputs['Color']
+    else:
+        attribute_output = attribute.outputs['Fac']
+    for link in list(output.links):
+        node_tree.links.new(attribute_output, link.to_socket)
+    return attribute
+
+# Shared attribute materials by source material name, and the sources checked against
+# their shared copy, for one realize pass. See reset_attribute_materials.
+_attribute_materials = None
+_checked_attribute_sources = set()
+
+def reset_attribute_materials():
+    """
+    Forgets the attribute materials found so far, so the next realize pass looks them
+    up again and checks each against its source once.
+    """
+    global _attribute_materials
+    _attribute_materials = None
+    _checked_attribute_sources.clear()
+
+def attribute_materials():
+    global _attribute_materials
+    if _attribute_materials is None:
+        _attribute_materials = {material[PIX_ATTRIBUTE_SOURCE]: material for material in bpy.data.materials
+                                if PIX_ATTRIBUTE_SOURCE in material}
+    return _attribute_materials
+
+def get_attribute_material(material):
+    """
+    Returns the shared copy of a customized material whose customized nodes read their
+    values from object properties, creating it on first use.
+
+    A shared copy made before the source material was edited is rebuilt, and the
+    objects using it are moved to the new copy.
+    """
+    materials = attribute_materials()
+    existing = materials.get(material.name)
+    if existing is not None and material.name in _checked_attribute_sources:
+        return existing
+    _checked_attribute_sources.add(material.name)
+    signature = material_signature(material)
+    if existing is not None and existing.get(PIX_ATTRIBUTE_SIGNATURE) == signature:
+        return existing
+
+    shared = material.copy()
+    shared.name = f"{material.name}_attributes"
+    shared[PIX_ATTRIBUTE_SOURCE] = material.name
+    shared[PIX_ATTRIBUTE_SIGNATURE] = signature
+    if shared.node_tree is not None:
+        if shared.node_tree.animation_data:
+            for fcurve in list(shared.node_tree.animation_data.drivers):
+                shared.node_tree.animation_data.drivers.remove(fcurve)
+        for node in list(shared.node_tree.nodes):
+            pix_properties = read_prefixed_properties(node, PIX_PREFIX)
+            if PIX_PROPERTIES not in pix_properties:
+                continue
+            for prop in split_string_by_comma(pix_properties[PIX_PROPERTIES]):
+                prop = f"{PIX_PREFIX}{prop}"
+                if prop + "_expression" not in pix_properties:
+                    continue
+                variables_data = []
+                if prop + "_properties" in pix_properties:
+                    variables_data = list(zip(split_string_by_comma(pix_properties[prop + "_properties"]),
+                                              split_string_by_comma(pix_properties[prop + "_property_paths"])))
+                attribute_name = get_shading_attribute_name(material.name, node, pix_properties[prop + "_expression"], variables_data)
+                rewire_node_to_attribute(shared, node, attribute_name)
+                # Only the first output is ever driven, so one attribute per node
+                break
+    if existing is not None:
+        name = existing.name
+        existing.user_remap(shared)
+        bpy.data.materials.remove(existing)
+        shared.name = name
+        print(f"Rebuilt attribute material '{shared.name}', its source changed.")
+    else:
+        print(f"Created attribute material '{shared.name}'.")
+    materials[material.name] = shared
+    return shared
+
+def share_attribute_materials_in_collection(collection_name):
+    """
+    Counterpart of duplicate_customized_materials_in_collection for the 'ATTRIBUTES'
+    shading mode: every object gets the one shared attribute material instead of a copy.
+    """
+    collection = bpy.data.collections.get(collection_name)
+    if not collection:
+        print(f"Collection '{collection_name}' not found.")
+        return
+
+    for obj in collection.objects:
+        for slot in obj.material_slots:
+            original_material = slot.material
+            if original_material is not None and needs_instance_material(original_material):
+                slot.link = 'OBJECT'
+                slot.material = get_attribute_material(original_material)
+
 def iterate_collection(collection, object_func=None, material_func=None, node_func=None):
     # Find the collection
     if not collection:
@@ -222,20 +402,59 @@ def iterate_collection(collection, object_func=None, material_func=None, node_fu
         if object_func:
             object_func(obj)
 
-        # Check if the object has material slots
-        if hasattr(obj.data, 'materials'):
-            for material in obj.data.materials:
-                if material is not None:
-                    # Execute the material function
-                    if material_func:
-                        material_func(material, obj)
-
-                    # Iterate through each node in the material's node tree
-                    if material.node_tree is not None:
-                        for node in material.node_tree.nodes:
-                            # Execute the node function
-                            if node_func:
-                                node_func(node, material, obj)
+        # Iterate the slots rather than obj.data.materials, realized objects share their
+        # mesh and keep per-instance materials in object-linked slots
+        for slot in obj.material_slots:
+            material = slot.material
+            if material is not None:
+                # Execute the material function
+                if material_func:
+                    material_func(material, obj)
+
+                # Iterate through each node in the material's node tree
+                if material.node_tree is not None:
+                    for node in material.node_tree.nodes:
+                        # Execute the node function
+                        if node_func:
+                            node_func(node, material, obj)
+
+def needs_instance_material(material):
+    """
+    Checks whether realizing a material creates drivers on it, which means every
+    realized instance needs its own copy. Customized nodes without an expression only
+    copy their values onto the object and can keep sharing the material.
+    """
+    if material.node_tree is None:
+        return False
+    for node in material.node_tree.nodes:
+        pix_properties = read_prefixed_properties(node, PIX_PREFIX)
+        if PIX_PROPERTIES in pix_properties:
+            for prop in split_string_by_comma(pix_properties[PIX_PROPERTIES]):
+                if f"{PIX_PREFIX}{prop}_expression" in pix_properties:
+                    return True
+    return False
+
+def needs_unique_data(obj):
+    """
+    Checks whether a realized copy of obj needs its own copy of obj.data.
+
+    Pix bindings on the object itself (custom properties and the transform drivers made
+    by realize_objects) live on the object, so the data block can be shared. Only pix
+    properties stored on the data block, or animation and drivers on the data block or
+    its shape keys, make a copy necessary.
+    """
+    data = obj.data
+    if data is None:
+        return False
+    if len(read_prefixed_properties(data, PIX_PREFIX).keys()) > 0:
+        return True
+    if getattr(data, 'animation_data', None) is not None:
+        return True
+    shape_keys = getattr(data, 'shape_keys', None)
+    if shape_keys is not None and shape_keys.animation_data is not None:
+        return True
+    return False
+
 def has_customization(material):
     print("check for customizations")
     if material.node_tree is not None:
@@ -258,21 +477,8 @@ def delete_collection_and_hierarchy(collection_name):
         print(f"Collection '{collection_name}' not found.")
         return
 
-    # Function to recursively delete objects in collections
-    def delete_objects_in_collection(coll):
-        # Delete all objects in the current collection
-        for obj in coll.objects:
-            bpy.data.objects.remove(obj, do_unlink=True)
-        
-        # Recursively delete objects in child collections
-        for child_coll in coll.children:
-            delete_objects_in_collection(child_coll)
-
-    # Start the recursive deletion
-    delete_objects_in_collection(collection)
-
-    # Once all objects are deleted, delete the collection itself
-    bpy.data.collections.remove(collection)
+    # Remove the collection, its children and all their objects in one batch
+    pixel_datablocks.remove_collection_hierarchies([collection], remove_data=True)
 
 def find_collections_with_property(property_name, property_value):
     matching_collections = []
@@ -296,19 +502,18 @@ def duplicate_customized_materials_in_collection(collection_name):
 
     # Iterate through each object in the collection
     for obj in collection.objects:
-        # Check if the object has material slots
-        if hasattr(obj.data, 'materials'):
-            for i in range(len(obj.data.materials)):
-                original_material = obj.data.materials[i]
-                print(f"checking material =>  {original_material.name}")
-                # Check if there is a material in the slot
-                if original_material is not None and has_customization(original_material):
-                    # Duplicate the material
-                    duplicate_material = original_material.copy()
-                    duplicate_material.name = f"{original_material.name}_duplicate"
-                    
-                    # Replace the original material with the duplicate
-                    obj.data.materials[i] = duplicate_material
+        for slot in obj.material_slots:
+            original_material = slot.material
+            # Check if there is a material in the slot
+            if original_material is not None and needs_instance_material(original_material):
+                print(f"duplicating material =>  {original_material.name}")
+                # Duplicate the material
+                duplicate_material = original_material.copy()
+                duplicate_material.name = f"{original_material.name}_duplicate"
+
+                # Assign the duplicate on the object so a shared mesh keeps its own material
+                slot.link = 'OBJECT'
+                slot.material = duplicate_material
 
 def delete_collection_instance(collection_instance_name):
     # Get the collection instance object
@@ -318,7 +523,7 @@ def delete_collection_instance(collection_instance_name):
         return
 
     # Delete the object
-    bpy.data.objects.remove(collection_instance, do_unlink=True)
+    pixel_datablocks.remove_objects([collection_instance])
 
 def link_obj_to_collection(obj, collection_name):
     """
@@ -333,8 +538,7 @@ def link_obj_to_collection(obj, collection_name):
     collection = bpy.data.collections.get(collection_name)
     if not collection:
         # Create a new collection if it doesn't exist
-        collection = bpy.data.collections.new(collection_name)
-        bpy.context.scene.collection.children.link(collection)
+        collection = pixel_datablocks.create_collection(collection_name)
         print(f"Created new collection '{collection_name}'.")
 
     # Link the armature to the collection if it's not already linked
@@ -361,29 +565,31 @@ def move_top_objects_in_collection(collection_name, move_vector):
     #         print(f"Moved {obj.name} by {move_vector}")
 
 def create_collection(collection_name, parent_collection_name=None):
-    # Create a new collection
-    new_collection = bpy.data.collections.new(collection_name)
-
     # If a parent collection name is given, link the new collection to the parent
     if parent_collection_name:
         parent_collection = bpy.data.collections.get(parent_collection_name)
         if parent_collection:
-            parent_collection.children.link(new_collection)
+            new_collection = pixel_datablocks.create_collection(collection_name, parent=parent_collection)
             print(f"Collection '{collection_name}' created under parent '{parent_collection_name}'.")
         else:
+            new_collection = pixel_datablocks.create_collection(collection_name, link=False)
             print(f"Parent collection '{parent_collection_name}' not found. Collection created but not linked.")
     else:
         # No parent collection given, link the new collection to the master collection
-        bpy.context.scene.collection.children.link(new_collection)
+        new_collection = pixel_datablocks.create_collection(collection_name)
         print(f"Collection '{collection_name}' created at the top level.")
 
     return new_collection
 
-def duplicate_collection_instance(source_instance, parent_collection=None):
+def duplicate_collection_instance(source_instance, parent_collection=None, make_single=False):
     """
     Duplicates a Blender collection instance along with its objects and their hierarchical relationships.
 
+    The copies share their data blocks with the source objects unless needs_unique_data
+    finds a binding that needs per-instance data, or make_single is set.
+
     :param source_instance: The source Blender collection instance to duplicate.
+    :param make_single: Copy the data block of every object.
     :return: The new duplicated collection instance object.
     """
     if not isinstance(source_instance, bpy.types.Object) or source_instance.instance_type != 'COLLECTION':
@@ -395,16 +601,13 @@ def duplicate_collection_instance(source_instance, parent_collection=None):
         raise ValueError("The provided instance does not have a linked collection.")
 
     # Create a new collection
-    new_collection = bpy.data.collections.new(name=f"{source_collection.name}_Duplicate")
-    if parent_collection != None:
-        parent_collection.children.link(new_collection)
-    else:
-        bpy.context.scene.collection.children.link(new_collection)
-    
+    new_collection = pixel_datablocks.create_collection(f"{source_collection.name}_Duplicate", parent=parent_collection)
+
     # Function to duplicate object and link to the new collection
     def duplicate_object(obj, parent=None):
         new_obj = obj.copy()
-        new_obj.data = obj.data.copy()
+        if obj.data is not None and (make_single or needs_unique_data(obj)):
+            new_obj.data = obj.data.copy()
         new_obj.animation_data_clear()
         new_collection.objects.link(new_obj)
 
@@ -468,11 +671,9 @@ def create_collection_instance(collection_name, parent_collection = None):
         return
 
     # Create an empty object
-    empty_obj = bpy.data.objects.new("Instance_" + collection_name, None)
     if parent_collection == None:
-        bpy.context.collection.objects.link(empty_obj)
-    else: 
-        parent_collection.objects.link(empty_obj)
+        parent_collection = bpy.context.collection
+    empty_obj = pixel_datablocks.create_empty("Instance_" + collection_name, parent_collection)
 
     # Set the instance type and collection
     empty_obj.instance_type = 'COLLECTION'
@@ -485,14 +686,15 @@ def duplicate_collection(collection_name, make_single):
         print(f"Collection '{collection_name}' not found")
         return
 
-    new_collection = bpy.data.collections.new(name=f"{collection_name}_Duplicate")
-    bpy.context.scene.collection.children.link(new_collection)
+    new_collection = pixel_datablocks.create_collection(f"{collection_name}_Duplicate")
 
+    new_objects = []
     for obj in original_collection.objects:
         new_obj = obj.copy()
         if make_single:
             new_obj.data = obj.data.copy() if obj.data else None
-        new_collection.objects.link(new_obj)
+        new_objects.append(new_obj)
+    pixel_datablocks.link_objects(new_objects, new_collection)
 
 def get_collection_names(self, context):
     collection_names = [(col.name, col.name, "") for col in bpy.data.collections]
@@ -756,6 +958,8 @@ class ApplyMusicOperator(bpy.types.Operator):
         track_count , unique_notes_per_track, unique_notes_for_track = analyze_tracks(json_data=raw_json_data)
         self.report({'INFO'}, "Apply Music")
         symphony_trees = get_pixel_symphony_trees()
+        # Point clouds by source collection and track, looked up once for the whole pass
+        point_clouds = point_cloud_index()
         for i in range(len(symphony_trees)):
             defauly_symphony_tree = symphony_trees[i]
             pixel_math_nodes = get_pixelnode_math_nodes(defauly_symphony_tree)
@@ -812,7 +1016,13 @@ class ApplyMusicOperator(bpy.types.Operator):
                                                     data["Time"] = extract_data(note, time_path)
 
                                                     track_note_collection = find_collection_with_properties({"track": i, "note": data["Midi"] })
-                                                    if track_note_collection != None:
+                                                    point_cloud = None
+                                                    if track_note_collection == None:
+                                                        track_collection = bpy.data.collections.get(
+                                                            track_section.track_object_collection or scene.my_collection_enum)
+                                                        point_cloud = (find_track_point_cloud(i, track_collection, point_clouds)
+                                                                       or find_track_point_cloud(i, index=point_clouds))
+                                                    if track_note_collection != None or point_cloud != None:
                                                         print(f"track {i}")
                                                         print(f"note {j}")
                                                         print("track note  collection found")
@@ -834,6 +1044,14 @@ class ApplyMusicOperator(bpy.types.Operator):
                                                         end_frame = int(frame_rate *  data["Time"] + frame_rate * data["Duration"])
                                                         if start_frame + 3 < end_frame:
                                                             print(f"pixel_math_node.pixproperty => {pixel_math_node.pixproperty}")
+                                                            frames = end_frame - start_frame
+                                                            start_peak = max(start_frame + 1, int(start_frame + frames * pixel_math_node.start))
+                                                            end_peak = min(end_frame - 1, int(end_frame - frames * (1 - pixel_math_node.end)))
+                                                            if point_cloud != None:
+                                                                key_point_note(point_cloud, data["Midi"], pixel_math_node.pixproperty,
+                                                                               point_cloud.get(f"pix_{pixel_math_node.pixproperty}", 0.0),
+                                                                               data["Value"], (start_frame, start_peak, end_peak, end_frame))
+                                                                continue
                                                             pix_objects = find_pix_properties(collection=track_note_collection,property_name=pixel_math_node.pixproperty)
                                                             print(f"pix_objects {len(pix_objects)}")
                                                             for po in pix_objects:
@@ -842,9 +1060,6 @@ class ApplyMusicOperator(bpy.types.Operator):
                                                                 print(po[f"pix_{pixel_math_node.pixproperty}"])
                                                                 print(f"applying property {pixel_math_node.pixproperty}")
                                                                 po_path = pixel_math_node.pixproperty
-                                                                frames = end_frame - start_frame
-                                                                start_peak = max(start_frame + 1, int(start_frame + frames * pixel_math_node.start))
-                                                                end_peak = min(end_frame - 1, int(end_frame - frames * (1 - pixel_math_node.end)))
                                                                 print(f"start_frame => {start_frame}, start_peak => {start_peak}, end_peak => {end_peak}, end_frame => {end_frame}")
                                                                 add_keyframe(po, po_path, po[f"pix_{pixel_math_node.pixproperty}"], start_frame)
                                                                 add_keyframe(po, po_path, po[f"pix_{pixel_math_node.pixproperty}"], end_frame)
@@ -865,6 +1080,8 @@ class ApplyMusicOperator(bpy.types.Operator):
                     if matching_instance != None:
                         pass
 
+        if scene.pool_materials:
+            pool_realized_materials(context, scene.pool_bake_drivers)
         return {'FINISHED'}
 
 def add_keyframe(obj, property_path, value, frame):
@@ -945,16 +1162,16 @@ def find_pix_properties(collection, property_name):
                         unique_properties.append(obj)
 
                 # Go through each material of the object
-                if hasattr(obj.data, "materials"):
-                    for mat in obj.data.materials:
-                        if mat is not None and mat.node_tree is not None:
-                            # Go through each node in the material
-                            for node in mat.node_tree.nodes:
-                                # Check if the node has the pix_properties custom property
-                                if "pix_properties" in node.keys():
-                                    if node["pix_properties"].find(property_name) != -1:
-                                        obj[f"pix_{property_name}"] = node[f"pix_{property_name}"]
-                                        unique_properties.append(obj)
+                for slot in obj.material_slots:
+                    mat = slot.material
+                    if mat is not None and mat.node_tree is not None:
+                        # Go through each node in the material
+                        for node in mat.node_tree.nodes:
+                            # Check if the node has the pix_properties custom property
+                            if "pix_properties" in node.keys():
+                                if node["pix_properties"].find(property_name) != -1:
+                                    obj[f"pix_{property_name}"] = node[f"pix_{property_name}"]
+                                    unique_properties.append(obj)
     except Exception as e:
         print(e)
     return unique_properties
@@ -971,6 +1188,129 @@ def remove_prefix(string, prefix):
         return string[len(prefix):]
     return string
 
+def shared_datablocks(new_collection, target_collection):
+    """
+    Returns the datablocks a realized copy uses without owning them: data it still
+    shares with the source objects and materials that aren't per-instance copies.
+    """
+    source_data = {obj.data.as_pointer() for obj in target_collection.all_objects if obj.data is not None}
+    shared = {}
+    for obj in new_collection.all_objects:
+        if obj.data is not None and obj.data.as_pointer() in source_data:
+            shared[obj.data.as_pointer()] = obj.data
+        for slot in obj.material_slots:
+            material = slot.material
+            if material is not None and (slot.link != 'OBJECT' or PIX_ATTRIBUTE_SOURCE in material):
+                shared[material.as_pointer()] = material
+    return list(shared.values())
+
+def realize_instance(scene, insta, target_collection, parent_collection, library_cache=None, cache_key=None):
+    """
+    Turns one collection instance into a real copy of its collection, parented to an
+    empty that takes over the instance's transform. The instance itself is left for
+    the caller to remove.
+
+    With a library cache the copy is appended from the cached library for `cache_key`,
+    and a copy made in-session is written to the cache for the next time.
+
+    :param scene: The scene whose realization settings are used.
+    :param insta: The collection instance to realize.
+    :param target_collection: The instanced source collection, carrying PIX_ID.
+    :param parent_collection: The collection to create the copy under.
+    :param library_cache: An optional LibraryCache.
+    :param cache_key: The cache key of the source collection, see library_cache_key.
+    :return: The new collection.
+    """
+    insta_parent = insta.parent
+    new_collection = None
+    if library_cache is not None:
+        new_collection = library_cache.append(cache_key, parent_collection or scene.collection)
+    if new_collection is None:
+        new_collection = duplicate_collection_instance(insta, parent_collection, make_single=scene.make_single)
+        if scene.pix_shading_mode == 'ATTRIBUTES':
+            share_attribute_materials_in_collection(new_collection.name)
+            node_func = realize_nodes_as_attributes
+        else:
+            duplicate_customized_materials_in_collection(new_collection.name)
+            node_func = realize_nodes
+        iterate_collection(new_collection,
+                        object_func=realize_objects,
+                        material_func=lambda mat, obj: print(f"Material: {mat.name}, Object: {obj.name}"),
+                        node_func=node_func)
+        if library_cache is not None:
+            library_cache.store(cache_key, new_collection, shared_datablocks(new_collection, target_collection))
+
+    new_collection[PIX_ID_DUPS] = target_collection[PIX_ID]
+    new_collection['track'] = insta['track']
+    new_collection['note'] = insta['note']
+
+    empty = parent_to_empty(new_collection)
+    if insta_parent:
+        empty.parent = insta_parent
+    empty.location = insta.location
+    # Instances placed on planes are rotated with Eulers, pinned and older ones with
+    # quaternions; carry over whichever the instance uses
+    empty.rotation_mode = insta.rotation_mode
+    empty.rotation_quaternion = insta.rotation_quaternion
+    empty.rotation_euler = insta.rotation_euler
+    empty.rotation_axis_angle = insta.rotation_axis_angle
+    empty.scale = insta.scale
+    return new_collection
+
+def instance_record(insta):
+    """
+    What realize_instance reads from a collection instance, as JSON. Stored on the
+    realized collection so it can be realized again once the instance is gone.
+    """
+    return json.dumps({
+        "parent": insta.parent.name if insta.parent else None,
+        "location": list(insta.location),
+        "rotation_mode": insta.rotation_mode,
+        "rotation_quaternion": list(insta.rotation_quaternion),
+        "rotation_euler": list(insta.rotation_euler),
+        "rotation_axis_angle": list(insta.rotation_axis_angle),
+        "scale": list(insta.scale),
+        "track": insta.get('track'),
+        "note": insta.get('note')
+    })
+
+def instance_from_record(record, target_collection, collection):
+    """
+    Recreates the collection instance a realized collection was made from, see
+    instance_record.
+    """
+    record = json.loads(record)
+    insta = pixel_datablocks.create_empty(f"{target_collection.name}_Instance", collection)
+    insta.instance_type = 'COLLECTION'
+    insta.instance_collection = target_collection
+    if record["parent"]:
+        insta.parent = bpy.data.objects.get(record["parent"])
+    insta.location = record["location"]
+    insta.rotation_mode = record["rotation_mode"]
+    insta.rotation_quaternion = record["rotation_quaternion"]
+    insta.rotation_euler = record["rotation_euler"]
+    if "rotation_axis_angle" in record:
+        insta.rotation_axis_angle = record["rotation_axis_angle"]
+    insta.scale = record["scale"]
+    if record["track"] is not None:
+        insta['track'] = record["track"]
+    if record["note"] is not None:
+        insta['note'] = record["note"]
+    return insta
+
+def build_duplicate_index():
+    """
+    Maps every PIX_ID to the realized collections made from it, with one pass over
+    bpy.data.collections.
+
+    :return: A dict of PIX_ID to a list of collections.
+    """
+    index = {}
+    for collection in bpy.data.collections:
+        if PIX_ID_DUPS in collection:
+            index.setdefault(collection[PIX_ID_DUPS], []).append(collection)
+    return index
+
 class RealizeCollectionOperator(bpy.types.Operator):
     """Operator to make collection instances real copies"""
     bl_idname = "object.realize_collection"
@@ -989,55 +1329,78 @@ class RealizeCollectionOperator(bpy.types.Operator):
             if track_section.track_object_collection:
                 collection_names.add(track_section.track_object_collection)
         parent_collection = bpy.data.collections.get(context.scene.target_collection_enum)
+        duplicate_index = build_duplicate_index()
+        reset_attribute_materials()
+        realized_count = 0
+        kept_count = 0
         for collection_name in collection_names:
             target_collection = bpy.data.collections.get(collection_name)
             if not PIX_ID in target_collection:
                 target_collection[PIX_ID] = generate_unique_id()
-            else:
-                to_delete = find_collections_with_property(PIX_ID_DUPS, target_collection[PIX_ID])
-                for i in range(len(to_delete)):
-                    inst = to_delete[i]
-                    delete_collection_and_hierarchy(inst.name)
+            source_fingerprint = realization_fingerprint(scene, target_collection)
+
+            # Realized copies from earlier runs, by the track and note they were made for
+            existing = {}
+            for dup in duplicate_index.get(target_collection[PIX_ID], []):
+                existing.setdefault((dup.get('track'), dup.get('note')), dup)
+
             instances = find_collection_instances(collection_name)
-            for i in range(len(instances)):
-                insta = instances[i]
-                insta_parent = insta.parent
-                new_collection = duplicate_collection_instance(insta, parent_collection)
-                new_collection[PIX_ID_DUPS] = target_collection[PIX_ID]
-                new_collection['track'] = insta['track']
-                new_collection['note'] = insta['note']
-
-                empty = parent_to_empty(new_collection)
-                if insta_parent:
-                    empty.parent = insta_parent
-                empty.location = insta.location
-                empty.rotation_mode = 'QUATERNION'
-                empty.rotation_quaternion = insta.rotation_quaternion
-                empty.scale = insta.scale
-                delete_collection_instance(insta.name)
-                duplicate_customized_materials_in_collection(new_collection.name)
-                iterate_collection(new_collection,
-                                object_func=realize_objects,
-                                material_func=lambda mat, obj: print(f"Material: {mat.name}, Object: {obj.name}"),
-                                node_func=realize_nodes)
+            to_realize = []
+            kept = set()
+            for insta in instances:
+                insta_fingerprint = instance_fingerprint(insta)
+                dup = existing.pop((insta.get('track'), insta.get('note')), None)
+                if (scene.pix_incremental_realize and dup is not None and dup.name not in kept
+                        and dup.get(PIX_SOURCE_FINGERPRINT) == source_fingerprint
+                        and dup.get(PIX_INSTANCE_FINGERPRINT) == insta_fingerprint):
+                    kept.add(dup.name)
+                else:
+                    to_realize.append((insta, insta_fingerprint))
+
+            # Instances are removed once realized, so copies without a live instance
+            # stand for their own: kept while the source is unchanged, otherwise
+            # realized again from the instance they recorded
+            for dup in existing.values():
+                if scene.pix_incremental_realize and dup.get(PIX_SOURCE_FINGERPRINT) == source_fingerprint:
+                    kept.add(dup.name)
+                elif PIX_INSTANCE_RECORD in dup:
+                    insta = instance_from_record(dup[PIX_INSTANCE_RECORD], target_collection, scene.collection)
+                    instances.append(insta)
+                    to_realize.append((insta, instance_fingerprint(insta)))
+
+            # Everything from earlier runs that isn't still up to date goes
+            stale = [dup for dup in duplicate_index.get(target_collection[PIX_ID], []) if dup.name not in kept]
+            pixel_datablocks.remove_collection_hierarchies(stale, remove_data=True)
+
+            library_cache = None
+            cache_key = None
+            if scene.pix_use_library_cache and to_realize:
+                library_cache = LibraryCache.from_scene(scene)
+                cache_key = library_cache_key(scene, target_collection)
+            for insta, insta_fingerprint in to_realize:
+                new_collection = realize_instance(scene, insta, target_collection, parent_collection,
+                                                  library_cache=library_cache, cache_key=cache_key)
+                new_collection[PIX_SOURCE_FINGERPRINT] = source_fingerprint
+                new_collection[PIX_INSTANCE_FINGERPRINT] = insta_fingerprint
+                new_collection[PIX_INSTANCE_RECORD] = instance_record(insta)
+            if library_cache is not None:
+                library_cache.release()
+            pixel_datablocks.remove_objects(instances)
+            realized_count += len(to_realize)
+            kept_count += len(kept)
+        self.report({'INFO'}, f"Realized {realized_count} instances, {kept_count} unchanged")
         return {'FINISHED'}
 def parent_to_empty(collection):
     if not collection:
         print(f"Collection '{collection}' not found")
         return
 
-    # Create an empty object
-    bpy.ops.object.empty_add(type='PLAIN_AXES')
-    empty = bpy.context.active_object
-    empty.name = f"Empty_{collection}"
     # Set the empty as the parent for top-level objects in the collection
-    for obj in collection.objects:
-        if not obj.parent:
-            obj.parent = empty
-
-    unlink_object_from_scene_collection(empty.name)
-    # Add the empty to the collection
-    collection.objects.link(empty)
+    roots = [obj for obj in collection.objects if not obj.parent]
+    # Create the empty directly in the collection
+    empty = pixel_datablocks.create_empty(f"Empty_{collection.name}", collection)
+    for obj in roots:
+        obj.parent = empty
     return empty
 
 def unlink_object_from_scene_collection(object_name):
@@ -1197,6 +1560,61 @@ def distribute_collection_on_plane(instance, plane_obj, x_min, x_max, y_min, y_m
     instance.parent = None
 
 
+def collect_note_columns(scene):
+    """
+    Reads the note tables the PixelNodeMath nodes key, the same way ApplyMusicOperator
+    walks them, without changing anything in the scene.
+
+    :param scene: The scene holding the music data.
+    :return: A list of (start, end, tracks, times, durations, midis), one per
+             PixelNodeMath node, where start/end are the node's envelope parameters and
+             the others are lists with one entry per note.
+    """
+    raw_json_data = json.loads(scene['raw_json_data'])
+    columns = []
+    for symphony_tree in get_pixel_symphony_trees():
+        for pixel_math_node in get_pixelnode_math_nodes(symphony_tree):
+            track_socket = get_connected_socket(pixel_math_node, 'Track')
+            note_socket = get_connected_socket(pixel_math_node, 'Note')
+            duration_socket = get_connected_socket(pixel_math_node, 'Duration')
+            time_socket = get_connected_socket(pixel_math_node, 'Time')
+            midi_socket = get_connected_socket(pixel_math_node, 'Midi')
+            if None in (track_socket, note_socket, duration_socket, time_socket, midi_socket):
+                continue
+            note_path = remove_prefix(note_socket.json_path_data, track_socket.json_path_data)
+            duration_path = f"${remove_prefix(duration_socket.json_path_data, note_socket.json_path_data)}"
+            time_path = f"${remove_prefix(time_socket.json_path_data, note_socket.json_path_data)}"
+            midi_path = f"${remove_prefix(midi_socket.json_path_data, note_socket.json_path_data)}"
+            tracks = []
+            times = []
+            durations = []
+            midis = []
+            for i, track in enumerate(extract_data(raw_json_data, track_socket.json_path_data)):
+                track_section = get_track_section(scene, i)
+                if track_section is None or not track_section.enabled:
+                    continue
+                for note in extract_data(track, note_path):
+                    tracks.append(i)
+                    times.append(extract_data(note, time_path))
+                    durations.append(extract_data(note, duration_path))
+                    midis.append(extract_data(note, midi_path))
+            columns.append((pixel_math_node.start, pixel_math_node.end, tracks, times, durations, midis))
+    return columns
+
+def plan_frames_from_notes(scene):
+    """
+    Builds the FramePlan of a scene from its note tables alone.
+    """
+    columns = collect_note_columns(scene)
+    track_count = max([get_music_track_count(scene)] + [max(tracks) + 1 for _, _, tracks, _, _, _ in columns if tracks])
+    bitmap = np.zeros((track_count, scene.frame_end - scene.frame_start + 1), dtype=bool)
+    for start, end, tracks, times, durations, midis in columns:
+        if tracks:
+            bitmap |= activation_bitmap(tracks, times, durations, scene.render.fps, [(start, end)],
+                                        scene.frame_start, scene.frame_end, track_count=track_count,
+                                        keys=midis)
+    return plan_from_bitmap(bitmap, scene.frame_start, scene.frame_end)
+
 class CalculateRequiredFramesOperator(bpy.types.Operator):
     bl_idname = "scene.calculate_required_frames"
     bl_label = "Calculate Require Frames"
@@ -1207,8 +1625,19 @@ class CalculateRequiredFramesOperator(bpy.types.Operator):
 
     def execute(self, context):
         print("calculating")
-        frames_needed = frames_to_generate()
-        self.report({'INFO'}, f"Required frames to print {len(frames_needed)}")
+        scene = context.scene
+        method = scene.pix_change_detection
+        if method == 'NOTES':
+            plan = plan_frames_from_notes(scene)
+        elif method == 'SNAPSHOT':
+            # The store also knows which frames repeat earlier ones, so the plan skips those too
+            plan = record_snapshots(scene, snapshot_directory(scene), context).plan()
+        else:
+            frames_needed = frames_to_generate(method=method)
+            plan = FramePlan(scene.frame_start, scene.frame_end, frames_needed, source=method.lower())
+        store_frame_plan(scene, plan)
+        print(plan)
+        self.report({'INFO'}, f"Required frames to print {len(plan.render_frames)} of {plan.frame_count}")
         return {'FINISHED'}
 
 class DistributeInstancesOperator(bpy.types.Operator):
@@ -1221,57 +1650,61 @@ class DistributeInstancesOperator(bpy.types.Operator):
 
     def execute(self, context):
         scene = context.scene
-        # Check if music data is available
-        placement_offsets = {}
-        
+        # Tracks placed on the same plane collection share one spatial hash, so they keep their distance too
+        occupied = {}
+        instances_by_note = {}
+        for obj in bpy.data.objects:
+            if obj.instance_type == 'COLLECTION' and 'track' in obj and 'note' in obj:
+                instances_by_note.setdefault((obj['track'], obj['note']), obj)
+        placed_tracks = []
+        placed = 0
+
         if has_music_track(scene, track_index=0):
             for index in range(get_music_track_count(scene)):
-                prop_name = f"track-section-{index}"
                 track_section = get_track_section(scene, index)
                 if track_section != None and track_section.enabled:
-                    # Dropdown for plane selection
-                    if track_section.enabled:
-                        mesh_name = track_section.track_plane
-                        if mesh_name != None and mesh_name in bpy.data.collections:
-                            collection = bpy.data.collections[mesh_name]
-                            print("collection ")
-                            print(collection)
-                            objs = get_meshes_in_collection(collection.name)
-                            all_mesh_data = []
-                            all_obj_data = []
-                            for i in range(len(objs)):
-                                obj = objs[i]
-                                mesh_data = get_mesh_data(obj)
-                                all_mesh_data.extend(mesh_data)
-                                all_obj_data.append(obj)
-                            if  collection.name in placement_offsets:
-                                c = placement_offsets[collection.name] 
-                            else:
-                                placement_offsets[collection.name] = 0
-                                c = 0
-                            notes = get_music_data_track_notes(scene, index)
-                            instances = [obj for obj in bpy.data.objects if obj.instance_type == 'COLLECTION']  # List of collection instances
-                            for note in notes:
-                                prop_name = f"cb_{note}_{index}"
-                                print(prop_name)
-                                track_note = get_track_note(scene, index, note)
-                                if  track_note == None or track_note.enabled:
-                                    properties = { "note": note, "track": index }  # Dictionary of properties to match
-                                    mesh_dat = all_mesh_data[c % len(all_mesh_data)]
-                                    obj_dat = all_obj_data[c % len(all_obj_data)]
-                                    matching_instance = find_instance_with_properties(instances, properties)
-                                    if matching_instance != None:
-                                        if should_pin_to_Face(scene, track_index=index):
-                                            pin_collection_to_face(matching_instance, obj_dat)
-                                        else: 
-                                            distribute_collection_to_face(matching_instance, mesh_data=mesh_dat)
-                                        c = c + 1
-                                        placement_offsets[collection.name] = c
+                    mesh_name = track_section.track_plane
+                    if mesh_name != None and mesh_name in bpy.data.collections:
+                        collection = bpy.data.collections[mesh_name]
+                        objs = get_meshes_in_collection(collection.name)
+                        surfaces = SurfaceSet(objs)
+                        if surfaces.face_count == 0:
+                            print(f"No faces in '{collection.name}'")
+                            continue
+                        track_instances = []
+                        for note in get_music_data_track_notes(scene, index):
+                            track_note = get_track_note(scene, index, note)
+                            if track_note == None or track_note.enabled:
+                                matching_instance = instances_by_note.get((index, note))
+                                if matching_instance != None:
+                                    track_instances.append(matching_instance)
                                 else:
-                                    print(f"cant find {prop_name}")
-                            
-                            
-        self.report({'INFO'}, "Distributed instances")
+                                    print(f"cant find cb_{note}_{index}")
+                        if not track_instances:
+                            continue
+                        # Avoiding overlap has to look across planes, so then all tracks share one hash
+                        hash_key = None if scene.avoid_overlap else collection.name
+                        if hash_key not in occupied:
+                            occupied[hash_key] = SpatialHash(track_section.placement_spacing)
+                        radii = instance_radii(track_instances) if scene.avoid_overlap else None
+                        placements = place_on_surfaces(surfaces, len(track_instances),
+                                                       spacing=track_section.placement_spacing,
+                                                       seed=track_section.placement_seed,
+                                                       occupied=occupied[hash_key],
+                                                       radii=radii)
+                        placed_tracks.append((track_instances, placements, radii,
+                                              should_pin_to_Face(scene, track_index=index)))
+
+        # All tracks share one hash when avoiding overlap, so instances can only overlap
+        # where sampling had to relax the spacing; then every placement is checked
+        if scene.avoid_overlap and any(placements.relaxed for _, placements, _, _ in placed_tracks):
+            resolve_overlaps([(placements, radii) for _, placements, radii, _ in placed_tracks])
+        for track_instances, placements, _, pin_to_face in placed_tracks:
+            apply_placements(track_instances, placements, pin_to_face=pin_to_face)
+            placed += len(track_instances)
+        context.view_layer.update()
+
+        self.report({'INFO'}, f"Distributed {placed} instances")
         return {'FINISHED'}
 
 def print_all_keys_of_object(obj):
@@ -1372,6 +1805,9 @@ class TrackSectionItem(bpy.types.PropertyGroup):
     max_y: bpy.props.FloatProperty(name="Max y")
     show: bpy.props.BoolProperty(name="Show")
     pin_to_face: bpy.props.BoolProperty(name="Pin to Face")
+    placement_seed: bpy.props.IntProperty(name="Seed", description="Random seed of the instance placement")
+    placement_spacing: bpy.props.FloatProperty(name="Spacing", description="Minimum distance between placed instances",
+                                               default=0.0, min=0.0, subtype='DISTANCE')
     enabled: bpy.props.BoolProperty(name="Enabled")
 
 def show_track_section(scene, track_index):
@@ -1497,6 +1933,9 @@ class PixelSymphonyPanel(bpy.types.Panel):
                     box.prop(track_section, 'enabled', text=track.name)
                     box.prop(track_section, 'show', text="Show")
                     box.prop(track_section, 'pin_to_face', text="Pin to face")
+                    row = box.row()
+                    row.prop(track_section, 'placement_seed')
+                    row.prop(track_section, 'placement_spacing')
                     box.prop_search(track_section, 'track_plane', bpy.data, "collections")
                     box.prop_search(track_section, 'track_object_collection', bpy.data, "collections")
                     box.prop(track_section, "track_symphony_tree")
@@ -1528,13 +1967,41 @@ class PixelSymphonyPanel(bpy.types.Panel):
         # layout.operator("object.duplicate_collection")
         layout.operator("object.read_json_file")
         layout.prop(context.scene, "make_single", text="Make single user")
+        layout.prop(context.scene, "pix_shading_mode")
+        layout.prop(context.scene, "pix_incremental_realize")
+        layout.prop(context.scene, "pix_use_library_cache")
+        if scene.pix_use_library_cache:
+            layout.prop(context.scene, "pix_library_cache_dir")
+            layout.prop(context.scene, "pix_library_cache_limit")
+            layout.operator("scene.pix_verify_library_cache")
         if 'json_data' in scene:
             layout.operator("scene.process_json_file")
+            layout.prop(context.scene, "avoid_overlap")
             layout.operator("scene.distribut_instances")
             layout.operator("object.realize_collection")
+            layout.operator("object.realize_point_instances")
             layout.prop(context.scene, "symphonytrees")
             layout.operator("object.apply_music_to_collections")
+            layout.prop(context.scene, "pool_materials")
+            layout.prop(context.scene, "pool_bake_drivers")
+            layout.operator("scene.pix_pool_materials")
+            layout.prop(context.scene, "pix_change_detection")
+            if scene.pix_change_detection == 'SNAPSHOT':
+                layout.prop(context.scene, "pix_snapshot_dir")
             layout.operator("scene.calculate_required_frames")
+            layout.prop(context.scene, "pix_use_render_cache")
+            if scene.pix_use_render_cache:
+                layout.prop(context.scene, "pix_render_cache_dir")
+                layout.prop(context.scene, "pix_render_cache_limit")
+                layout.operator("scene.pix_clear_render_cache")
+            layout.prop(context.scene, "pix_region_render")
+            if scene.pix_region_render:
+                layout.prop(context.scene, "pix_region_padding")
+                layout.prop(context.scene, "pix_region_contained")
+                layout.prop(context.scene, "pix_region_threshold")
+            layout.prop(context.scene, "pix_render_workers")
+            layout.prop(context.scene, "pix_render_threads")
+            layout.prop(context.scene, "pix_render_queue_dir")
         self.draw_music_panel(context)
 
 def register():
@@ -1558,7 +2025,37 @@ def register():
     bpy.types.Scene.symphonytrees = bpy.props.EnumProperty(items=find_pixel_symphony_node_trees)
     bpy.types.Scene.make_single = bpy.props.BoolProperty(
         name="Make single user",
-        description="Makes each collection a single user.",
+        description="Copies the data of every realized object instead of sharing data that no pix binding changes",
+        default=False
+    )
+    bpy.types.Scene.pix_shading_mode = bpy.props.EnumProperty(
+        name="Shading",
+        description="How realized instances feed pix values into their materials",
+        items=[
+            ('DRIVERS', "Material Drivers", "Copy customized materials per instance and drive their nodes"),
+            ('ATTRIBUTES', "Object Attributes", "Share one material that reads pix values from object properties")
+        ],
+        default='DRIVERS'
+    )
+    bpy.types.Scene.pix_incremental_realize = bpy.props.BoolProperty(
+        name="Incremental realize",
+        description="Keep realized copies whose source collection and instance haven't changed",
+        default=True
+    )
+    bpy.types.Scene.pix_change_detection = bpy.props.EnumProperty(
+        name="Change detection",
+        description="How Calculate Required Frames finds the frames that differ",
+        items=[
+            ('NOTES', "Note Schedule", "Read the note tables, without evaluating the scene"),
+            ('ANALYTIC', "F-Curves", "Read keyframes and drivers, sampling only what can't be read"),
+            ('SNAPSHOT', "Snapshots", "Record world matrices and material states per frame and compare them as arrays"),
+            ('SAMPLE', "Sample Frames", "Set every frame and compare every object")
+        ],
+        default='NOTES'
+    )
+    bpy.types.Scene.avoid_overlap = bpy.props.BoolProperty(
+        name="Avoid overlap",
+        description="Keep distributed instances far enough apart that their bounds don't intersect, across all track planes",
         default=False
     )
 
@@ -1582,6 +2079,10 @@ def unregister():
     del bpy.types.Scene.my_collection_enum
     del bpy.types.Scene.target_collection_enum
     del bpy.types.Scene.symphonytrees
+    del bpy.types.Scene.pix_shading_mode
+    del bpy.types.Scene.pix_incremental_realize
+    del bpy.types.Scene.avoid_overlap
+    del bpy.types.Scene.pix_change_detection
 
 # if __name__ == "__main__":
 #     register()
@@ -2,14 +2,18 @@ import os
 import bpy
 from bpy.types import NodeTree, Node, NodeSocket, NodeSocketFloat, Operator
 from bpy.props import *
+from bpy.app.handlers import persistent
 import inspect
 import json
-from bpy_extras.object_utils import world_to_camera_view
 import mathutils
+import numpy as np
 import nodeitems_utils
 from nodeitems_utils import NodeCategory, NodeItem
 from .pixel_collection import PIXEL_COLLECTION
 from .pixel_stored_functions import functions_dict
+from .pixel_projection import camera_projection, project_points_to_image, world_bounds
+from .pixel_character_stream import character_stream, finalize_character_stream, flush_character_streams
+from .pixel_character_tracks import FIELDS, CharacterTracks, tracks_path, write_character_tracks
 
 PIX_PREFIX = "pix_"
 PIX_ID = "pix_id"
@@ -105,55 +109,12 @@ def update_object_items(self, context):
 
 # Function to project a 3D point to the image plane
 def project_3d_point_to_image(camera, point):
-    # Get the camera's intrinsic matrix
-    scene = bpy.context.scene
-    render = scene.render
-    camera_data = camera.data
-
-    # Intrinsic parameters
-    f_in_mm = camera_data.lens
-    sensor_width_in_mm = camera_data.sensor_width
-    sensor_height_in_mm = camera_data.sensor_height
-
-    resolution_x_in_px = render.resolution_x
-    resolution_y_in_px = render.resolution_y
-    scale = render.resolution_percentage / 100
-    resolution_x_in_px = scale * resolution_x_in_px
-    resolution_y_in_px = scale * resolution_y_in_px
-
-    # pixel_aspect_ratio = render.pixel_aspect_x / render.pixel_aspect_y
-
-    # # Focal length in pixels
-    # f_x = (f_in_mm / sensor_width_in_mm) * resolution_x_in_px
-    # f_y = (f_in_mm / sensor_height_in_mm) * resolution_y_in_px / pixel_aspect_ratio
-
-    # # Principal point in pixels
-    # c_x = resolution_x_in_px / 2
-    # c_y = resolution_y_in_px / 2
-
-    # # Camera intrinsic matrix
-    # K = mathutils.Matrix(((f_x, 0, c_x, 0),
-    #                       (0, f_y, c_y, 0),
-    #                       (0, 0, 1, 0),
-    #                       (0, 0, 0, 1)))
-
-    # # Convert the point from world coordinates to camera coordinates
-    # point_world = mathutils.Vector(point)
-    # point_camera = camera.matrix_world.inverted() @ point_world
-
-    # # Homogeneous coordinates
-    # point_camera_homogeneous = mathutils.Vector((point_camera.x, point_camera.y, point_camera.z, 1))
-
-    # # Project the point onto the image plane using the intrinsic matrix
-    # point_image_homogeneous = K @ point_camera_homogeneous
-    coords2d = world_to_camera_view(scene, camera, point)
-    pixel_x = int(coords2d.x * resolution_x_in_px)
-    pixel_y = int((1 - coords2d.y) * resolution_y_in_px)  # Flip y-axis
-
-    # Normalize homogeneous coordinates
-    point_image = mathutils.Vector((pixel_x, pixel_y, 0))
-
-    return point_image
+    """
+    Projects a world-space point to pixel coordinates of the rendered image, top left
+    origin. See pixel_projection.CameraProjection for many points at once.
+    """
+    pixel = project_points_to_image(bpy.context.scene, camera, [tuple(point)])[0]
+    return mathutils.Vector((int(pixel[0]), int(pixel[1]), 0))
 
 class PixelSymphonyCharacterNode(Node, PixelBaseNode):
     bl_idname = 'PixelSymphonyCharacterNode'
@@ -164,6 +125,13 @@ class PixelSymphonyCharacterNode(Node, PixelBaseNode):
         self.inputs.new('NodeSocketString', "Object ID")
         self.inputs.new('NodeSocketString', "Height Object ID")
         self.outputs.new('CharacterSocketType', "Character")
+        mark_character_nodes_dirty()
+
+    def copy(self, node):
+        mark_character_nodes_dirty()
+
+    def free(self):
+        mark_character_nodes_dirty()
 
     def update(self):
         if self.inputs['Camera ID'].is_linked and self.inputs['Object ID'].is_linked and self.inputs['Height Object ID'].is_linked:
@@ -185,22 +153,19 @@ class PixelSymphonyCharacterNode(Node, PixelBaseNode):
                 height_projected_point = project_3d_point_to_image(camera, height_object.matrix_world.translation)
                 distance = (camera.matrix_world.translation - location).length
 
-                character = bpy.context.scene.character_property_groups.add()
+                # The output socket is the node's one sample slot, rather than an entry
+                # piling up in the scene on every update
+                character = self.outputs['Character'].default_value
                 character.x = location.x
                 character.y = location.y
                 character.z = location.z
                 character.distance = distance
-
-                self.outputs['Character'].default_value.x = character.x
-                self.outputs['Character'].default_value.y = character.y
-                self.outputs['Character'].default_value.z = character.z
-                self.outputs['Character'].default_value.distance = character.distance
-                self.outputs['Character'].default_value.object_id = object_id
-                self.outputs['Character'].default_value.camera_id = camera_id
-                self.outputs['Character'].default_value.project_x = projected_point[0]
-                self.outputs['Character'].default_value.project_y = projected_point[1]
-                self.outputs['Character'].default_value.top_x = height_projected_point[0]
-                self.outputs['Character'].default_value.top_y = height_projected_point[1]
+                character.object_id = object_id
+                character.camera_id = camera_id
+                character.project_x = projected_point[0]
+                character.project_y = projected_point[1]
+                character.top_x = height_projected_point[0]
+                character.top_y = height_projected_point[1]
 
                 print(f"Character info: {character.to_dict()}")
 
@@ -303,42 +268,224 @@ class CharacterSocket(NodeSocket):
 
     def set_value(self, value):
         self.default_value = value
-# Define a global variable to store the frames with keyframes
-keyframed_frames = []
 
-def get_keyframed_frames():
-    keyframes = set()
-    
-    # Iterate through all objects in the scene
-    for obj in bpy.context.scene.objects:
-        # Check if the object has animation data
-        if obj.animation_data:
-            # Get the action (which contains the keyframes)
-            action = obj.animation_data.action
-            if action:
-                # Iterate through all FCurves in the action
-                for fcurve in action.fcurves:
-                    # Iterate through all keyframe points in the FCurve
-                    for keyframe in fcurve.keyframe_points:
-                        keyframes.add(int(keyframe.co.x))
-    
-    # Sort the frames
-    sorted_keyframes = sorted(keyframes)
-    
-    global keyframed_frames
-    keyframed_frames = sorted_keyframes
+class CharacterSample:
+    """
+    One character of a collection character node at the current frame, with the
+    to_dict of CharacterPropertyGroup. Kept in memory only, see _collection_samples.
+    """
+    __slots__ = FIELDS + ("object_id", "camera_id")
+
+    def __init__(self, values, object_id, camera_id):
+        for field, value in zip(FIELDS, values):
+            setattr(self, field, float(value))
+        self.object_id = object_id
+        self.camera_id = camera_id
+
+    def to_dict(self):
+        character = {field: getattr(self, field) for field in FIELDS}
+        character["object_id"] = self.object_id
+        character["camera_id"] = self.camera_id
+        return character
+
+# The characters of each collection character node at the current frame, by node
+# pointer. Rewritten on every update and never saved with the file.
+_collection_samples = {}
+
+class PixelSymphonyCollectionCharacterNode(Node, PixelBaseNode):
+    """Collect character information for every object of a collection at once"""
+    bl_idname = 'PixelSymphonyCollectionCharacterNode'
+    bl_label = 'Collect information for collection'
+    bl_icon = 'SOUND'
+
+    def init(self, context):
+        self.inputs.new('NodeSocketString', "Camera ID")
+        self.inputs.new('NodeSocketString', "Collection ID")
+        self.outputs.new('CharacterSocketType', "Characters")
+        mark_character_nodes_dirty()
+
+    def copy(self, node):
+        mark_character_nodes_dirty()
+
+    def free(self):
+        _collection_samples.pop(self.as_pointer(), None)
+        mark_character_nodes_dirty()
+
+    def update(self):
+        # Files saved while the samples were a node property still carry them
+        if "characters" in self.keys():
+            del self["characters"]
+        camera = bpy.data.objects.get(self.inputs['Camera ID'].default_value)
+        collection = bpy.data.collections.get(self.inputs['Collection ID'].default_value)
+        if camera is None or camera.type != 'CAMERA' or collection is None:
+            return
+        objects = sorted((obj for obj in collection.all_objects if obj.type not in {'CAMERA', 'LIGHT'}),
+                         key=lambda obj: obj.name)
+        if not objects:
+            _collection_samples[self.as_pointer()] = []
+            return
+
+        locations = np.array([obj.matrix_world.translation for obj in objects], dtype=np.float64)
+        # The top of the world bounding box stands in for the height object of the
+        # single character node
+        corners = world_bounds(objects)
+        tops = np.concatenate([corners[:, :, :2].mean(axis=1), corners[:, :, 2:].max(axis=1)], axis=1)
+        projection = camera_projection(bpy.context.scene, camera)
+        # Truncated like project_3d_point_to_image
+        projected = np.trunc(projection.to_pixels(locations))
+        top_projected = np.trunc(projection.to_pixels(tops))
+        distances = np.linalg.norm(locations - np.array(camera.matrix_world.translation), axis=1)
+
+        values = {
+            "x": locations[:, 0], "y": locations[:, 1], "z": locations[:, 2], "distance": distances,
+            "project_x": projected[:, 0], "project_y": projected[:, 1],
+            "top_x": top_projected[:, 0], "top_y": top_projected[:, 1]
+        }
+        # Rounded through float32 like the float properties they used to be written to
+        rows = np.stack([values[field] for field in FIELDS], axis=1).astype(np.float32)
+        samples = [CharacterSample(row, obj.name, camera.name) for row, obj in zip(rows, objects)]
+        _collection_samples[self.as_pointer()] = samples
+
+        first = samples[0]
+        output = self.outputs['Characters'].default_value
+        for field in FIELDS:
+            setattr(output, field, getattr(first, field))
+        output.object_id = first.object_id
+        output.camera_id = first.camera_id
+
+    def get_characters(self):
+        samples = _collection_samples.get(self.as_pointer())
+        if samples is None:
+            self.update()
+            samples = _collection_samples.get(self.as_pointer(), [])
+        return list(samples)
+
+class KeyframeIndex:
+    """
+    The frames that have a keyframe on any object of a scene, as a sorted NumPy array
+    and a set.
+
+    Built on first use and kept until animation data changes, which the depsgraph
+    handler reports with mark_dirty, so a frame change costs a set lookup instead of a
+    scan over every keyframe in the scene.
+    """
+
+    def __init__(self):
+        self.frames = np.zeros(0, dtype=np.int64)
+        self.frame_set = frozenset()
+        self.scene_pointer = None
+        self.dirty = True
+
+    def mark_dirty(self):
+        self.dirty = True
+
+    def ensure(self, scene=None):
+        scene = scene or bpy.context.scene
+        if self.dirty or self.scene_pointer != scene.as_pointer():
+            self.rebuild(scene)
+        return self
+
+    def rebuild(self, scene):
+        chunks = []
+        actions = {obj.animation_data.action for obj in scene.objects
+                   if obj.animation_data and obj.animation_data.action}
+        for action in actions:
+            for fcurve in action.fcurves:
+                count = len(fcurve.keyframe_points)
+                if count == 0:
+                    continue
+                coordinates = np.empty(count * 2, dtype=np.float64)
+                fcurve.keyframe_points.foreach_get("co", coordinates)
+                chunks.append(coordinates[0::2])
+        if chunks:
+            self.frames = np.unique(np.concatenate(chunks).astype(np.int64))
+        else:
+            self.frames = np.zeros(0, dtype=np.int64)
+        self.frame_set = frozenset(self.frames.tolist())
+        self.scene_pointer = scene.as_pointer()
+        self.dirty = False
+
+    def between(self, first, last):
+        """
+        The keyframed frames from `first` to `last`, inclusive.
+        """
+        self.ensure()
+        lower, upper = np.searchsorted(self.frames, [first, last + 1])
+        return self.frames[lower:upper].tolist()
+
+    def __contains__(self, frame):
+        return frame in self.ensure().frame_set
+
+    def __iter__(self):
+        return iter(self.ensure().frames.tolist())
+
+    def __len__(self):
+        return len(self.ensure().frames)
 
-# Register the frame change handler
-def frame_change_handler(scene):
-    get_keyframed_frames()
+    def __repr__(self):
+        return f"KeyframeIndex({len(self.frames)} frames)"
+
+# The frames with keyframes
+keyframed_frames = KeyframeIndex()
+
+def get_keyframed_frames():
+    return keyframed_frames.ensure(bpy.context.scene)
+
+# Character nodes by node tree and name, rebuilt when nodes are added or removed
+_character_nodes = {"dirty": True, "keys": []}
+
+def mark_character_nodes_dirty():
+    _character_nodes["dirty"] = True
+
+def character_nodes():
+    """
+    The character nodes of all node trees. Scans the node trees only after a character
+    node was added, copied or removed, or a file was loaded.
+    """
+    if _character_nodes["dirty"]:
+        _character_nodes["keys"] = [(node_tree.name, node.name) for node_tree in bpy.data.node_groups
+                                    for node in node_tree.nodes
+                                    if isinstance(node, (PixelSymphonyCharacterNode,
+                                                         PixelSymphonyCollectionCharacterNode))]
+        _character_nodes["dirty"] = False
+    nodes = []
+    for tree_name, node_name in _character_nodes["keys"]:
+        node_tree = bpy.data.node_groups.get(tree_name)
+        node = node_tree.nodes.get(node_name) if node_tree else None
+        if node is None:
+            # Renamed or removed without going through free()
+            mark_character_nodes_dirty()
+            continue
+        nodes.append(node)
+    return nodes
+
+# Register the frame change handler, after the frame is evaluated so matrix_world
+# is that of the new frame
+@persistent
+def frame_change_handler(scene, depsgraph=None):
     update_character_nodes(scene)
-bpy.app.handlers.frame_change_pre.append(frame_change_handler)
+
+@persistent
+def keyframe_index_on_update(scene, depsgraph):
+    for update in depsgraph.updates:
+        id_block = update.id
+        # Actions change when keyframes do. Object updates that are neither transform
+        # nor geometry come from animation data being assigned, or objects being added.
+        if isinstance(id_block, bpy.types.Action) or (
+                isinstance(id_block, bpy.types.Object)
+                and not update.is_updated_transform and not update.is_updated_geometry):
+            keyframed_frames.mark_dirty()
+            return
+
+@persistent
+def reset_indexes_on_load(dummy):
+    keyframed_frames.mark_dirty()
+    mark_character_nodes_dirty()
+    _collection_samples.clear()
 
 def update_character_nodes(scene):
-    for node_tree in bpy.data.node_groups:
-        for node in node_tree.nodes:
-            if isinstance(node, PixelSymphonyCharacterNode):
-                node.update()
+    for node in character_nodes():
+        node.update()
 
 # Custom node type to write location to a file as JSON
 class PixelSymphonyWriteToFileNode(Node, PixelBaseNode):
@@ -353,7 +500,10 @@ class PixelSymphonyWriteToFileNode(Node, PixelBaseNode):
         character_data.display_shape = 'SQUARE_DOT'
 
     def draw_buttons(self, context, layout):
+        layout.prop(self, "export_format")
         layout.operator("node.write_location_to_file", text="Write Character Data to File")
+        layout.operator("node.finalize_character_data", text="Finalize Character Data")
+        layout.operator("node.bake_character_tracks", text="Bake Character Tracks")
 
     def update(self):
         pass
@@ -364,6 +514,16 @@ class PixelSymphonyWriteToFileNode(Node, PixelBaseNode):
         update=lambda self, context: self.update()
     )
     characters: bpy.props.PointerProperty(type=CharacterPropertyGroup)
+    export_format: bpy.props.EnumProperty(
+        name="Format",
+        description="What finalizing the character data writes",
+        items=[
+            ('JSON', "JSON", "The {\"frames\": {...}} JSON file"),
+            ('COLUMNAR', "Columnar", "One float32 array per field next to the file, for memory-mapped reading"),
+            ('BOTH', "Both", "The JSON file and the columnar arrays")
+        ],
+        default='JSON'
+    )
 
     def update_location(self, context):
         self.update()
@@ -374,30 +534,44 @@ class PixelSymphonyWriteToFileNode(Node, PixelBaseNode):
             for link in self.inputs['Character Data'].links:
                 from_socket = link.from_socket
                 from_socket.node.update()
+                if hasattr(from_socket.node, "get_characters"):
+                    # One link carries every member of a collection
+                    locations.extend(from_socket.node.get_characters())
+                    continue
                 loc_vector = from_socket.get_value()
                 locations.append(loc_vector)
         return locations
 
 # Function to serialize characters to file
 def serialize_characters_to_file(file_path, characters):
+    """
+    Adds the current frame's characters to the output file's stream. The file itself
+    is written by finalize_character_stream.
+    """
     current_frame = bpy.context.scene.frame_current
-    data = {}
-    
-    # Check if file exists
-    if os.path.exists(file_path):
-        with open(file_path, 'r') as file:
-            data = json.load(file)
-    
-    # Ensure 'frames' key exists
-    if 'frames' not in data:
-        data['frames'] = {}
-    
-    # Add or update the current frame's data
-    data['frames'][str(current_frame)] = {"characters": [char.to_dict() for char in characters]}
-
-    # Write the updated data back to the file
-    with open(file_path, 'w') as file:
-        json.dump(data, file, indent=4)
+    character_stream(file_path).write(current_frame, [char.to_dict() for char in characters])
+
+def finalize_character_export(file_path, export_format='JSON'):
+    """
+    Finalizes a character data stream into the export format of a write node.
+
+    Args:
+    file_path (str): The JSON output path; columnar tracks go next to it, see tracks_path.
+    export_format (str): 'JSON', 'COLUMNAR' or 'BOTH'.
+
+    Returns:
+    int: The number of frames exported.
+    """
+    if export_format == 'JSON':
+        return len(finalize_character_stream(file_path))
+    directory = tracks_path(file_path)
+    frames = None
+    if export_format == 'COLUMNAR':
+        # Frames exported before are in the tracks, not the JSON file
+        frames = CharacterTracks.open(directory).to_frames() if os.path.isdir(directory) else {}
+    frames = finalize_character_stream(file_path, write_json=export_format == 'BOTH', frames=frames)
+    write_character_tracks(directory, frames)
+    return len(frames)
 
 # Handler to write character data on render complete
 def write_character_data_on_render(scene):
@@ -412,6 +586,7 @@ def write_character_data_on_render(scene):
                         print(keyframed_frames)
                         serialize_characters_to_file(file_path, characters)
                         print(f"Character data written to {file_path} on render")
+    flush_character_streams()
 
 # Operator to write location to file
 class WRITE_OT_location_to_file(Operator):
@@ -449,19 +624,60 @@ class WRITE_OT_location_to_file(Operator):
             start_frame = scene.frame_start
             end_frame = scene.frame_end
 
-            for frame in range(start_frame, end_frame + 1):
-                if current_frame in keyframed_frames:
-                    scene.frame_set(frame)
-                    locations = node.get_linked_character_data()
-                    if locations:
-                        serialize_characters_to_file(file_path, locations)
+            for frame in keyframed_frames.between(start_frame, end_frame):
+                scene.frame_set(frame)
+                locations = node.get_linked_character_data()
+                if locations:
+                    serialize_characters_to_file(file_path, locations)
             
             # Return to the original frame
             scene.frame_set(current_frame)
-            self.report({'INFO'}, f"Locations written to {file_path}")
+            frame_count = finalize_character_export(file_path, node.export_format)
+            self.report({'INFO'}, f"Locations written to {file_path}, {frame_count} frames")
         else:
             self.report({'WARNING'}, "Invalid file path or locations")
         return {'FINISHED'}
+class WRITE_OT_bake_character_tracks(Operator):
+    """Sample the linked characters on every frame of the scene and save them as columnar tracks"""
+    bl_idname = "node.bake_character_tracks"
+    bl_label = "Bake Character Tracks"
+    bl_options = {'REGISTER'}
+
+    def execute(self, context):
+        node = context.node
+        file_path = node.inputs['File Path'].default_value
+        if not file_path:
+            self.report({'WARNING'}, "Invalid file path")
+            return {'CANCELLED'}
+        scene = context.scene
+        current_frame = scene.frame_current
+        frames = {}
+        for frame in range(scene.frame_start, scene.frame_end + 1):
+            scene.frame_set(frame)
+            characters = node.get_linked_character_data()
+            if characters:
+                frames[str(frame)] = {"characters": [character.to_dict() for character in characters]}
+        scene.frame_set(current_frame)
+        directory = tracks_path(bpy.path.abspath(file_path))
+        tracks = write_character_tracks(directory, frames)
+        self.report({'INFO'}, f"Baked {len(tracks)} frames of {len(tracks.characters)} characters to {directory}")
+        return {'FINISHED'}
+
+class WRITE_OT_finalize_character_data(Operator):
+    """Write the character data streamed so far into the node's JSON file"""
+    bl_idname = "node.finalize_character_data"
+    bl_label = "Finalize Character Data"
+    bl_options = {'REGISTER'}
+
+    def execute(self, context):
+        file_path = context.node.inputs['File Path'].default_value
+        if not file_path:
+            self.report({'WARNING'}, "Invalid file path")
+            return {'CANCELLED'}
+        frame_count = finalize_character_export(file_path, context.node.export_format)
+        self.report({'INFO'}, f"{frame_count} frames in {file_path}")
+        return {'FINISHED'}
+
 # Custom socket type
 class PixelCustomSocket(NodeSocketFloat):
     # Description string
@@ -786,6 +1002,7 @@ node_categories = [
         NodeItem('PixelSymphonyWriteToFileNode'),
         NodeItem('PixelFunction'),
         NodeItem('PixelSymphonyCharacterNode'),
+        NodeItem('PixelSymphonyCollectionCharacterNode'),
         NodeItem('PixelNodeMath')
     ]),
 ]
@@ -795,27 +1012,44 @@ classes = (PixelNodeTree, CharacterPropertyGroup, CharacterSocket,
            PixelNodeText, PixelSymphonyWriteToFileNode, PixelSymphonyProjectionNode, 
            PixelNodeFloat, PixelNodePrint, PixelSymphonyNode, PixelSymphonyLocationNode, 
            PixelNodeJSONData, PixelFunction, PixelNodeMath,
-           PixelSymphonyCharacterNode)
+           PixelSymphonyCharacterNode, PixelSymphonyCollectionCharacterNode)
 
 def register():
     bpy.utils.register_class(PixelCustomSocket)
     bpy.utils.register_class(WRITE_OT_location_to_file)
+    bpy.utils.register_class(WRITE_OT_finalize_character_data)
+    bpy.utils.register_class(WRITE_OT_bake_character_tracks)
     from bpy.utils import register_class
     for cls in classes:
         register_class(cls)
     nodeitems_utils.register_node_categories('PIXEL_NODES', node_categories)
+    # No longer written to, kept so files saved with samples in it still load
     bpy.types.Scene.character_property_groups = bpy.props.CollectionProperty(type=CharacterPropertyGroup)
     bpy.app.handlers.render_complete.append(write_character_data_on_render)
+    # Guarded, reloading the add-on must not add the handlers twice
+    for handlers, handler in ((bpy.app.handlers.frame_change_post, frame_change_handler),
+                              (bpy.app.handlers.depsgraph_update_post, keyframe_index_on_update),
+                              (bpy.app.handlers.load_post, reset_indexes_on_load)):
+        if handler not in handlers:
+            handlers.append(handler)
 
 def unregister():
     bpy.utils.unregister_class(PixelCustomSocket)
     bpy.utils.unregister_class(WRITE_OT_location_to_file)
+    bpy.utils.unregister_class(WRITE_OT_finalize_character_data)
+    bpy.utils.unregister_class(WRITE_OT_bake_character_tracks)
     nodeitems_utils.unregister_node_categories('PIXEL_NODES')
     from bpy.utils import unregister_class
     for cls in reversed(classes):
         unregister_class(cls)
     del bpy.types.Scene.character_property_groups
     bpy.app.handlers.render_complete.remove(write_character_data_on_render)
+    for handlers, handler in ((bpy.app.handlers.frame_change_post, frame_change_handler),
+                              (bpy.app.handlers.depsgraph_update_post, keyframe_index_on_update),
+                              (bpy.app.handlers.load_post, reset_indexes_on_load)):
+        if handler in handlers:
+            handlers.remove(handler)
+    flush_character_streams()
 
 
 # Register when script is run
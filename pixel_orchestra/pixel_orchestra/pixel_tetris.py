@@ -8,6 +8,7 @@ import random
 from mathutils import Vector
 from bpy.props import CollectionProperty, StringProperty
 from .pixel_symphony import read_file_as_text
+from .pixel_datablocks import create_object, remove_datablocks, remove_objects
 
 
 class ReadPixelTetrisFileOperator(bpy.types.Operator):
@@ -208,13 +209,8 @@ def delete_meshes_with_custom_property(property_name):
         if obj.type == 'MESH' and property_name in obj:
             objects_to_remove.append(obj)
 
-    # Deselect all objects
-    bpy.ops.object.select_all(action='DESELECT')
-
-    # Select and delete the objects
-    for obj in objects_to_remove:
-        obj.select_set(True)
-        bpy.ops.object.delete()
+    # Delete the objects and their meshes in one batch
+    remove_objects(objects_to_remove, remove_data=True)
 
 def random_color():
     """
@@ -288,18 +284,9 @@ def create_meshes_from_json(data):
     # Parsing JSON data
 
     # Extracting vertices from polygons
-    polygons = data['polygons']
-    # Parsing JSON data
-    res = []
-    for polygon in polygons:
-        obj = create_mesh_from_json({'polygons':[polygon],'translation': data['translation']})
-        res.append(obj)
-    mesh = res[0]
-    if len(polygons) > 1:
-        for i in range(1, len(polygons)):
-            if res[i]:
-                join_meshes(mesh, res[i])
-    return [mesh]
+    # All polygons share the translation, so they go into one mesh as separate faces
+    # rather than one object per polygon joined afterwards
+    return [create_mesh_from_json({'polygons': data['polygons'], 'translation': data['translation']})]
 
 def create_mesh_from_json(data):
     # Parsing JSON data
@@ -312,11 +299,8 @@ def create_mesh_from_json(data):
     # Create a new mesh
     mesh = bpy.data.meshes.new('MeshObject')
 
-    # Create a new object with the mesh
-    obj = bpy.data.objects.new('MeshObject', mesh)
-
-    # Link the object to the current scene
-    bpy.context.collection.objects.link(obj)
+    # Create a new object with the mesh, linked to the current collection
+    obj = create_object('MeshObject', mesh, bpy.context.collection)
 
     # Set the location to the scene's origin
     obj.location = bpy.context.scene.cursor.location
@@ -328,10 +312,12 @@ def create_mesh_from_json(data):
     bm_verts = [bm.verts.new(v) for v in all_vertices]
     bm.verts.ensure_lookup_table()  # Ensure the lookup table is updated
 
-    # Add faces to the bmesh
+    # Add faces to the bmesh, each polygon's vertices follow the previous polygon's
+    start = 0
     for poly in polygons:
-        face_verts = [bm_verts[i] for i in range(len(poly))]
+        face_verts = bm_verts[start:start + len(poly)]
         bm.faces.new(face_verts)
+        start += len(poly)
 
     # Update the bmesh to the mesh
     bm.to_mesh(mesh)
@@ -396,11 +382,15 @@ def create_material(name, color):
     return material
 
 def create_cube_at_point(point, translation):
-    # Create a cube at the specified point
-    bpy.ops.mesh.primitive_cube_add(size=1, enter_editmode=False, align='WORLD', location=(point[0], point[1], 0))
+    # Create a unit cube at the specified point
+    mesh = bpy.data.meshes.new('Cube')
+    bm = bmesh.new()
+    bmesh.ops.create_cube(bm, size=1)
+    bm.to_mesh(mesh)
+    bm.free()
+    cube = create_object('Cube', mesh, bpy.context.collection)
+    cube.location = (point[0], point[1], 0)
     print(f"create cube at {point}, {translation}")
-    # Get the reference to the newly created cube
-    cube = bpy.context.active_object
 
     # Apply the translation offset
     cube.location.x += translation[0]
@@ -443,7 +433,9 @@ def get_mesh_dimensions(obj):
 
 def join_meshes(obj1, obj2):
     """
-    Joins two mesh objects into a single object.
+    Joins two mesh objects into a single object. The geometry of obj2 is moved into
+    obj1's mesh, keeping its place in the world, and obj2 is removed. Face material
+    indices are kept as they are.
 
     Args:
     obj1 (bpy.types.Object): The first mesh object.
@@ -454,18 +446,20 @@ def join_meshes(obj1, obj2):
     if obj1.type != 'MESH' or obj2.type != 'MESH':
         raise ValueError("Both objects must be of type 'MESH'")
 
-    # Deselect all objects
-    bpy.ops.object.select_all(action='DESELECT')
-
-    # Select both objects
-    obj1.select_set(True)
-    obj2.select_set(True)
+    # Bring obj2's geometry into obj1's space; matrix_basis, since matrix_world isn't
+    # updated until the next depsgraph evaluation
+    other = obj2.data.copy()
+    other.transform(obj1.matrix_basis.inverted() @ obj2.matrix_basis)
 
-    # Set the context's active object
-    bpy.context.view_layer.objects.active = obj1
+    bm = bmesh.new()
+    bm.from_mesh(obj1.data)
+    # from_mesh adds to the geometry already in the bmesh
+    bm.from_mesh(other)
+    bm.to_mesh(obj1.data)
+    bm.free()
 
-    # Join the objects
-    bpy.ops.object.join()
+    remove_objects([obj2], remove_data=True)
+    remove_datablocks([other])
 
 
 class PixelTetrisPanel(bpy.types.Panel):
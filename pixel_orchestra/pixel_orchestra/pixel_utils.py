@@ -3,6 +3,8 @@ import bmesh  # Importing the bmesh module
 import random
 from mathutils import Vector, Quaternion
 import mathutils
+from .pixel_surface import SurfaceSet, get_surface
+from .pixel_placement import apply_placements, place_on_surfaces
 
 def get_pix_properties_items(self, context):
     pix_props = ["brightness", "color_green", "color_blue", "color_red", "location_x", "location_y", "location_z", "scale_x",
@@ -26,7 +28,13 @@ def get_meshes_in_collection(collection_name):
     meshes = [obj for obj in collection.objects if obj.type == 'MESH']
     return meshes
 
-def pin_collection_to_face(instance, object_data):
+def pin_collection_to_face(instance, object_data, seed=None):
+    """
+    Parents an instance to a mesh object at a point on its surface, picked in
+    proportion to face area, with its Z axis along the face normal.
+
+    The view layer isn't updated, so this can be called for many instances in a row.
+    """
     # Ensure object_data is a mesh object
     if not isinstance(object_data.data, bpy.types.Mesh):
         print("object_data is not a Mesh object.")
@@ -37,32 +45,11 @@ def pin_collection_to_face(instance, object_data):
         print("No faces in the mesh.")
         return
 
-    # Select a random face
-    face = random.choice(object_data.data.polygons)
-
-    # Calculate the normal of the face in local space
-    normal_local = face.normal
-
-    # Calculate the face center in local space
-    face_center_local = sum((object_data.data.vertices[v].co for v in face.vertices), Vector()) / len(face.vertices)
-
-    # Set the location of the instance to the face center (relative to the parent)
-    instance.location = face_center_local
-
-    # Align instance's vertical axis (0,0,1) with the face normal
-    z_axis = Vector((0, 0, 1))
-    rotation_quaternion = z_axis.rotation_difference(normal_local)
-    instance.rotation_mode = 'QUATERNION'
-    instance.rotation_quaternion = rotation_quaternion
-
-    # Parent the instance to the object
-    instance.parent = object_data
-
-    # Update the scene (if needed)
-    bpy.context.view_layer.update()
+    placements = place_on_surfaces(SurfaceSet([object_data]), 1, seed=seed)
+    apply_placements([instance], placements, pin_to_face=True)
 
     print("Instance placed at: ", instance.location)
-    print("Instance rotation: ", instance.rotation_quaternion)
+    print("Instance rotation: ", instance.rotation_euler)
 
 
 def pin_collection_to_face2(instance, mesh_data):
@@ -129,53 +116,14 @@ def get_mesh_data(mesh_object):
     """
     Extracts faces, normals, world positions, and rotations (Euler) of each face of the given mesh object.
 
+    Builds a dict per face, so prefer get_surface from pixel_surface, which keeps the
+    same data as arrays and caches it between calls.
+
     Args:
     mesh_object (bpy.types.Object): The mesh object to extract data from.
 
     Returns:
     list of dicts: Each dict contains data for a face including vertices, normal, world position, and rotation.
     """
-
-    # Ensure the object is a mesh
-    if mesh_object.type != 'MESH':
-        raise ValueError("Provided object is not a mesh")
-
-    # Create a bmesh from the mesh
-    mesh = mesh_object.data
-    bm = bmesh.new()
-    bm.from_mesh(mesh)
-
-    # Calculate normals
-    bm.normal_update()
-    mesh.calc_normals()
-
-    # Transform to world coordinates
-    bm.transform(mesh_object.matrix_world)
-
-    # Extract data
-    results = []
-    for face in bm.faces:
-        info = {}
-        # Face vertices
-        face_verts = [vert.co.copy() for vert in face.verts]
-
-        # Face normal
-        normal = face.normal.copy()
-
-        # Face center in world coordinates
-        world_position = mesh_object.matrix_world @ face.calc_center_median()
-
-        # Calculate rotation (Euler) aligned with the face normal
-        rotation_matrix = normal.to_track_quat('Z', 'Y').to_euler()
-        
-        # Append data
-        info['face'] = face_verts
-        info['normal'] = normal
-        info['world_position'] = world_position
-        info['rotation_euler'] = rotation_matrix
-        results.append(info)
-
-    # Free the bmesh
-    bm.free()
-
-    return results
+    surface = get_surface(mesh_object)
+    return [surface.face_data(index) for index in range(surface.face_count)]